@@ -0,0 +1,529 @@
+"""
+Load and latency benchmark for the App A -> MCP -> App B pipeline.
+
+Boots the services with main.py against stub LLM endpoints (fake_llm.py, or
+the apps' in-process stub provider with --llm-in-process),
+drives them with a chosen concurrency and arrival pattern, and reports
+p50/p95/p99 latency, throughput and the resident memory of the services.
+Results are written as JSON; pass a previous run as --compare to print the
+change per scenario.
+
+Scenarios:
+    receive_context  POST contexts straight to the MCP server
+    summarize        POST emails to App A (stub OpenAI, then MCP send)
+    poll             pre-fill App B's inbox, then drain it through App B /poll
+    pipeline         send emails to App A while polling App B; latency is
+                     measured end to end, from send until App B's reply
+
+App B paces Claude calls to APP_B_LLM_REQUESTS_PER_MINUTE, so raise that in
+config.py before benchmarking poll or pipeline against the stub.
+
+Example:
+    python scripts/benchmark.py --scenarios summarize,receive_context \\
+        --requests 500 --concurrency 32 --llm-latency-ms 80 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import httpx
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+SRC_DIR = SCRIPTS_DIR.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+from config import (
+    APP_A_URL, APP_B_URL, MCP_SERVER_URL, MCP_RECEIVE_CONTEXT_ENDPOINT, MCP_BATCH_SUFFIX
+)
+
+SCENARIOS = ["receive_context", "summarize", "poll", "pipeline"]
+ARRIVALS = ["closed", "poisson", "burst"]
+
+_TAG = re.compile(r"\[bench-(\d+)\]")
+
+# A request returns how many messages it moved (ingested, summarized, replied to)
+RequestFn = Callable[[int], Awaitable[int]]
+
+
+def percentile(samples: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of `samples` (None when empty)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize_latencies(latencies: List[float]) -> Dict[str, Optional[float]]:
+    millis = [latency * 1000 for latency in latencies]
+    return {
+        "p50": percentile(millis, 50),
+        "p95": percentile(millis, 95),
+        "p99": percentile(millis, 99),
+        "mean": sum(millis) / len(millis) if millis else None,
+        "max": max(millis) if millis else None
+    }
+
+
+def sample_email(index: int) -> str:
+    return (
+        "Hello Support Team,\n"
+        "The laptop I bought last month has a weak battery and dead pixels.\n"
+        "I would like a refund under your 30-day return policy.\n"
+        f"Reference [bench-{index}]"
+    )
+
+
+def sample_package(index: int, target_app: Optional[str] = None) -> Dict[str, Any]:
+    package = {
+        "system": "You are a CRM assistant.",
+        "memory": ["Customer is a frequent buyer."],
+        "conversation": [{"role": "user", "content": f"Refund request [bench-{index}]"}],
+        "current_task": "Draft a polite reply."
+    }
+    if target_app:
+        package["target_app"] = target_app
+    return package
+
+
+class RssSampler:
+    """Samples the total resident memory of a process group (Linux only)."""
+
+    def __init__(self, pgid: Optional[int], interval: float = 0.5):
+        self.pgid = pgid
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def read_mb(self) -> Optional[float]:
+        if self.pgid is None or not os.path.isdir("/proc"):
+            return None
+        total_kb = 0
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                if os.getpgid(int(entry)) != self.pgid:
+                    continue
+                with open(f"/proc/{entry}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total_kb += int(line.split()[1])
+                            break
+            except (OSError, ValueError):
+                continue
+        return total_kb / 1024
+
+    async def _run(self) -> None:
+        while True:
+            rss = self.read_mb()
+            if rss is not None:
+                self.samples.append(rss)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> Dict[str, Optional[float]]:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        last = self.read_mb()
+        if last is not None:
+            self.samples.append(last)
+        if not self.samples:
+            return {"start_mb": None, "peak_mb": None, "end_mb": None}
+        return {"start_mb": self.samples[0], "peak_mb": max(self.samples), "end_mb": self.samples[-1]}
+
+
+async def run_load(
+    request: RequestFn,
+    requests: int,
+    concurrency: int,
+    arrival: str,
+    rate: float,
+    burst: int
+) -> Dict[str, Any]:
+    """
+    Issue `requests` calls of `request` and time each one.
+
+    closed keeps `concurrency` requests in flight back to back. poisson and
+    burst are open-loop: requests arrive on schedule (exponential gaps, or
+    `burst` at a time) at `rate` per second whether or not earlier ones have
+    finished, and latency is counted from the scheduled arrival so queueing
+    behind the concurrency limit is not hidden.
+    """
+    latencies: List[float] = []
+    errors: List[str] = []
+    moved = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def timed(index: int, arrived: float) -> None:
+        nonlocal moved
+        async with slots:
+            try:
+                moved += await request(index)
+            except Exception as e:
+                errors.append(str(e) or type(e).__name__)
+                return
+        latencies.append(time.perf_counter() - arrived)
+
+    started = time.perf_counter()
+    if arrival == "closed":
+        indices = iter(range(requests))
+
+        async def worker() -> None:
+            for index in indices:
+                await timed(index, time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    else:
+        tasks = []
+        next_arrival = started
+        for index in range(requests):
+            if arrival == "poisson":
+                next_arrival += random.expovariate(rate)
+            elif index and index % burst == 0:
+                next_arrival += burst / rate
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(timed(index, next_arrival)))
+        await asyncio.gather(*tasks)
+    duration = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "duration_s": duration,
+        "requests_per_sec": (requests - len(errors)) / duration if duration else None,
+        "messages_per_sec": moved / duration if duration else None,
+        "latency_ms": summarize_latencies(latencies)
+    }
+
+
+async def drain(client: httpx.AsyncClient, app_id: str) -> None:
+    await client.post(f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/{app_id}")
+
+
+async def check(response: httpx.Response) -> httpx.Response:
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+    return response
+
+
+async def scenario_receive_context(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    url = f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppA"
+
+    async def request(index: int) -> int:
+        await check(await client.post(url, json=sample_package(index, target_app="AppC")))
+        return 1
+
+    result = await run_load(request, args.requests, args.concurrency, args.arrival, args.rate, args.burst)
+    await drain(client, "AppC")
+    return result
+
+
+async def scenario_summarize(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    async def request(index: int) -> int:
+        await check(await client.post(f"{APP_A_URL}/summarize", json={"email": sample_email(index)}))
+        return 1
+
+    result = await run_load(request, args.requests, args.concurrency, args.arrival, args.rate, args.burst)
+    await drain(client, "AppB")
+    return result
+
+
+async def scenario_poll(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    await drain(client, "AppB")
+    packages = [sample_package(index) for index in range(args.requests)]
+    await check(await client.post(
+        f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppA{MCP_BATCH_SUFFIX}", json=packages
+    ))
+    polls = -(-args.requests // args.poll_batch)
+
+    async def request(index: int) -> int:
+        response = await check(await client.get(
+            f"{APP_B_URL}/poll", params={"max_messages": args.poll_batch}
+        ))
+        return sum(1 for reply in response.json().get("replies", []) if reply is not None)
+
+    result = await run_load(request, polls, args.concurrency, args.arrival, args.rate, args.burst)
+    await drain(client, "AppB")
+    return result
+
+
+async def scenario_pipeline(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    await drain(client, "AppB")
+    sent_at: Dict[int, float] = {}
+    latencies: List[float] = []
+    send_errors = 0
+    deadline_after_send = args.pipeline_timeout
+
+    async def consume(stop: asyncio.Event) -> None:
+        while len(latencies) < args.requests - send_errors and not stop.is_set():
+            try:
+                response = await client.get(
+                    f"{APP_B_URL}/poll", params={"wait": 1, "max_messages": args.poll_batch}
+                )
+            except httpx.HTTPError:
+                continue
+            if response.status_code != 200:
+                continue
+            now = time.perf_counter()
+            for reply in response.json().get("replies", []):
+                match = _TAG.search(reply or "")
+                if match and int(match.group(1)) in sent_at:
+                    latencies.append(now - sent_at.pop(int(match.group(1))))
+
+    async def request(index: int) -> int:
+        sent_at[index] = time.perf_counter()
+        try:
+            await check(await client.post(f"{APP_A_URL}/summarize", json={"email": sample_email(index)}))
+        except Exception:
+            sent_at.pop(index, None)
+            raise
+        return 1
+
+    stop = asyncio.Event()
+    consumer = asyncio.create_task(consume(stop))
+    started = time.perf_counter()
+    sent = await run_load(request, args.requests, args.concurrency, args.arrival, args.rate, args.burst)
+    send_errors = sent["errors"]
+    try:
+        await asyncio.wait_for(asyncio.shield(consumer), deadline_after_send)
+    except asyncio.TimeoutError:
+        stop.set()
+        await consumer
+    duration = time.perf_counter() - started
+    await drain(client, "AppB")
+
+    return {
+        "requests": args.requests,
+        "errors": send_errors + len(sent_at),
+        "lost": len(sent_at),
+        "duration_s": duration,
+        "messages_per_sec": len(latencies) / duration if duration else None,
+        "send_latency_ms": sent["latency_ms"],
+        "latency_ms": summarize_latencies(latencies)
+    }
+
+
+SCENARIO_FUNCTIONS = {
+    "receive_context": scenario_receive_context,
+    "summarize": scenario_summarize,
+    "poll": scenario_poll,
+    "pipeline": scenario_pipeline
+}
+
+
+class Services:
+    """Starts the stub LLM server and main.py, and stops them again."""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes: List[subprocess.Popen] = []
+        self.main: Optional[subprocess.Popen] = None
+
+    def start(self) -> None:
+        llm_url = f"http://127.0.0.1:{self.args.llm_port}"
+        stub_settings = {
+            "LATENCY_MS": self.args.llm_latency_ms,
+            "JITTER_MS": self.args.llm_jitter_ms,
+            "TOKENS_PER_SECOND": self.args.llm_tokens_per_second or "",
+            "FAILURE_RATE": self.args.llm_failure_rate,
+            "SEED": self.args.llm_seed
+        }
+        env = dict(
+            os.environ,
+            OPENAI_CHAT_URL=f"{llm_url}/v1/chat/completions",
+            ANTHROPIC_MESSAGES_URL=f"{llm_url}/v1/messages",
+            OPENAI_API_KEY="benchmark",
+            ANTHROPIC_API_KEY="benchmark",
+            PYTHONPATH=str(SRC_DIR)
+        )
+        for name, value in stub_settings.items():
+            env[f"FAKE_LLM_{name}"] = env[f"LLM_STUB_{name}"] = str(value)
+        if self.args.llm_in_process:
+            # The apps answer from the in-process stub; no stub server needed
+            env["APP_A_LLM_PROVIDER"] = env["APP_B_LLM_PROVIDER"] = "stub"
+        else:
+            self.processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "fake_llm:app",
+                 "--port", str(self.args.llm_port), "--log-level", "warning"],
+                cwd=SCRIPTS_DIR, env=env, start_new_session=True
+            ))
+        self.main = subprocess.Popen(
+            [sys.executable, "main.py"], cwd=SRC_DIR, env=env, start_new_session=True,
+            stdout=subprocess.DEVNULL if not self.args.verbose else None,
+            stderr=subprocess.DEVNULL if not self.args.verbose else None
+        )
+        self.processes.append(self.main)
+
+    @property
+    def pgid(self) -> Optional[int]:
+        return self.main.pid if self.main is not None else None
+
+    async def wait_ready(self, client: httpx.AsyncClient, timeout: float = 30.0) -> None:
+        urls = [
+            f"{MCP_SERVER_URL}/inbox/stats",
+            f"{APP_A_URL}/cache/stats",
+            f"{APP_B_URL}/cache/stats"
+        ]
+        if not self.args.llm_in_process:
+            urls.append(f"http://127.0.0.1:{self.args.llm_port}/openapi.json")
+        deadline = time.monotonic() + timeout
+        for url in urls:
+            while True:
+                try:
+                    if (await client.get(url)).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Service did not come up: {url}")
+                await asyncio.sleep(0.2)
+
+    def stop(self) -> None:
+        for process in self.processes:
+            try:
+                os.killpg(process.pid, signal.SIGINT)
+            except ProcessLookupError:
+                continue
+        for process in self.processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPTS_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    for name, result in results["scenarios"].items():
+        latency = result["latency_ms"]
+        fmt = lambda value: "-" if value is None else f"{value:8.1f}"
+        print(
+            f"{name:16} p50 {fmt(latency['p50'])} ms  p95 {fmt(latency['p95'])} ms  "
+            f"p99 {fmt(latency['p99'])} ms  {fmt(result.get('messages_per_sec'))} msg/s  "
+            f"errors {result['errors']}"
+        )
+    rss = results.get("rss")
+    if rss and rss.get("peak_mb") is not None:
+        print(f"services RSS: start {rss['start_mb']:.1f} MB, peak {rss['peak_mb']:.1f} MB")
+
+
+def print_comparison(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    for name, result in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        changes = []
+        for key in ("p50", "p95", "p99"):
+            old, new = before["latency_ms"].get(key), result["latency_ms"].get(key)
+            if old and new is not None:
+                changes.append(f"{key} {100 * (new - old) / old:+.1f}%")
+        old, new = before.get("messages_per_sec"), result.get("messages_per_sec")
+        if old and new is not None:
+            changes.append(f"msg/s {100 * (new - old) / old:+.1f}%")
+        print(f"{name:16} " + "  ".join(changes))
+
+
+async def main(args) -> Dict[str, Any]:
+    services = None if args.no_boot else Services(args)
+    limits = httpx.Limits(max_connections=args.concurrency + 8, max_keepalive_connections=args.concurrency + 8)
+    async with httpx.AsyncClient(limits=limits, timeout=args.request_timeout) as client:
+        if services is not None:
+            services.start()
+        try:
+            if services is not None:
+                await services.wait_ready(client)
+            sampler = RssSampler(services.pgid if services is not None else None)
+            sampler.start()
+            scenarios = {}
+            for name in args.scenarios:
+                print(f"Running {name}...", flush=True)
+                scenarios[name] = await SCENARIO_FUNCTIONS[name](client, args)
+            rss = await sampler.stop()
+        finally:
+            if services is not None:
+                services.stop()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "compare", "verbose")
+        },
+        "scenarios": scenarios,
+        "rss": rss
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="receive_context,summarize",
+                        type=lambda value: value.split(","),
+                        help=f"comma-separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=200, help="requests (or messages) per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--arrival", choices=ARRIVALS, default="closed")
+    parser.add_argument("--rate", type=float, default=100.0, help="arrivals per second for poisson/burst")
+    parser.add_argument("--burst", type=int, default=20, help="requests per burst")
+    parser.add_argument("--poll-batch", type=int, default=10, help="max_messages per App B poll")
+    parser.add_argument("--pipeline-timeout", type=float, default=120.0,
+                        help="seconds to wait for replies after the last send")
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--llm-port", type=int, default=8090)
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=10.0)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=None,
+                        help="stub generation speed (default: instant)")
+    parser.add_argument("--llm-seed", type=int, default=0, help="seed for stub jitter and failures")
+    parser.add_argument("--llm-in-process", action="store_true",
+                        help="use the apps' in-process stub LLM provider instead of the stub server")
+    parser.add_argument("--no-boot", action="store_true",
+                        help="benchmark services that are already running (LLM settings ignored)")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show service logs")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(main(args))
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
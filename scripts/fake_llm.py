@@ -0,0 +1,90 @@
+"""
+Stub OpenAI / Anthropic endpoints for benchmarking without real API calls.
+
+Serves /v1/chat/completions (OpenAI shape) and /v1/messages (Anthropic
+shape), including their SSE token streams when the request sets
+"stream": true. Completions come from common.llm_providers.StubLLM, the
+same model the in-process "stub" provider uses: each echoes the tail of the
+prompt so callers can correlate requests end to end.
+
+Behaviour is set through environment variables:
+    FAKE_LLM_LATENCY_MS        mean latency to the first token (default 50)
+    FAKE_LLM_JITTER_MS         +/- uniform jitter around the mean (default 10)
+    FAKE_LLM_TOKENS_PER_SECOND generation speed after that (default: instant)
+    FAKE_LLM_FAILURE_RATE      fraction of requests answered with a 500 (default 0)
+    FAKE_LLM_SEED              seed for jitter and failures (default 0)
+
+Run from this directory with src on PYTHONPATH:
+    PYTHONPATH=../src python -m uvicorn fake_llm:app --port 8090
+"""
+import asyncio
+import json
+import os
+from typing import Any, Dict
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from common.llm_providers import StubLLM
+
+_tokens_per_second = os.getenv("FAKE_LLM_TOKENS_PER_SECOND")
+stub = StubLLM(
+    latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", "50")),
+    jitter_ms=float(os.getenv("FAKE_LLM_JITTER_MS", "10")),
+    tokens_per_second=float(_tokens_per_second) if _tokens_per_second else None,
+    failure_rate=float(os.getenv("FAKE_LLM_FAILURE_RATE", "0")),
+    seed=int(os.getenv("FAKE_LLM_SEED", "0"))
+)
+
+app = FastAPI()
+
+
+async def _complete(body: Dict[str, Any]) -> str:
+    await asyncio.sleep(stub.first_token_delay())
+    return stub.completion(body["messages"][-1]["content"])
+
+
+async def _generate(text: str) -> str:
+    """Wait out the time a whole non-streamed completion takes to generate."""
+    await asyncio.sleep(stub.generation_delay(text))
+    return text
+
+
+def _sse(data: Dict[str, Any], event: str = None) -> str:
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request, response: Response):
+    body = await request.json()
+    text = await _complete(body)
+    if stub.should_fail():
+        response.status_code = 500
+        return {"error": {"message": "Injected failure"}}
+    if body.get("stream"):
+        async def events():
+            for chunk in stub.chunks(text):
+                yield _sse({"choices": [{"delta": {"content": chunk}}]})
+                await asyncio.sleep(stub.generation_delay(chunk))
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+    text = await _generate(text)
+    return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+
+
+@app.post("/v1/messages")
+async def messages(request: Request, response: Response):
+    body = await request.json()
+    text = await _complete(body)
+    if stub.should_fail():
+        response.status_code = 500
+        return {"error": {"type": "api_error", "message": "Injected failure"}}
+    if body.get("stream"):
+        async def events():
+            yield _sse({"type": "message_start"}, "message_start")
+            for chunk in stub.chunks(text):
+                delta = {"type": "content_block_delta", "delta": {"type": "text_delta", "text": chunk}}
+                yield _sse(delta, "content_block_delta")
+                await asyncio.sleep(stub.generation_delay(chunk))
+            yield _sse({"type": "message_stop"}, "message_stop")
+        return StreamingResponse(events(), media_type="text/event-stream")
+    text = await _generate(text)
+    return {"content": [{"type": "text", "text": text}]}
@@ -1,36 +1,179 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Dict, Literal, Optional
 import uvicorn
-from config import APP_A_PORT
-from app_a.mcp_handler import build_mcp_package, send_mcp_to_server
-from app_a.llm_client import call_openai_chat
+from config import (
+    APP_A_PORT, MCP_SEND_BUFFERED, MCP_SERVER_URL, APP_A_JOB_WORKERS,
+    APP_A_JOB_QUEUE_SIZE, APP_A_JOB_RESULTS_KEPT, APP_A_JOB_CALLBACK_TIMEOUT,
+    APP_A_JOB_CALLBACK_SCHEMES, APP_A_JOB_CALLBACK_HOSTS,
+    APP_A_SUMMARY_BATCHING
+)
+from common.http_client import client_lifespan
+from common.metrics import metrics_response
+from common.resilience import CircuitOpenError
+from common.sse import encode_event
+from app_a.mcp_handler import (
+    build_mcp_package, send_mcp_to_server, send_mcp_buffered
+)
+from app_a.llm_client import call_openai_chat, stream_openai_chat, llm_cache, LLM_URL
+from app_a.jobs import CallbackNotAllowed, JobQueue, JobQueueFull
+from app_a.summarizer import summarize_batched, summary_prompt
 from pydantic import BaseModel
 import traceback
 
-app = FastAPI()
+clients_lifespan = client_lifespan(MCP_SERVER_URL, LLM_URL)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    async with clients_lifespan(app):
+        jobs.start()
+        yield
+        await jobs.close()
+
+app = FastAPI(lifespan=lifespan)
 
 
 class EmailRequest(BaseModel):
     email: str
+    priority: Optional[Literal["high", "normal", "low"]] = None  # Delivery priority of the reply task
+    deadline: Optional[float] = None  # Unix time after which no reply is needed
+    callback_url: Optional[str] = None  # Async jobs only: POSTed the finished job
+    conversation_id: Optional[str] = None  # Email thread; its summaries form one conversation
+
+async def _send_summary(summary: str, request: EmailRequest) -> None:
+    """
+    Package a summary and pass it on to the MCP server. The summaries of one
+    email thread build up a single conversation, so each package after the
+    first is sent as a delta carrying only the new summary. The summary is
+    appended by the sender, after the thread's previous package has been
+    answered, so summaries finishing together cannot overwrite each other.
+    """
+    mcp_package = build_mcp_package(
+        system="You are a CRM assistant.",
+        memory=["Customer is a frequent buyer."],
+        conversation=[{"role": "user", "content": summary}],
+        current_task="Draft a polite reply.",
+        priority=request.priority,
+        deadline=request.deadline,
+        conversation_id=request.conversation_id
+    )
+    append = bool(request.conversation_id)
+    if MCP_SEND_BUFFERED:
+        await send_mcp_buffered(mcp_package, append)
+    else:
+        await send_mcp_to_server(mcp_package, append)
+
+async def _summarize(request: EmailRequest) -> Dict[str, Any]:
+    """
+    Summarize an email and send the summary to the MCP server. With
+    APP_A_SUMMARY_BATCHING, emails arriving together share one OpenAI request.
+    """
+    if APP_A_SUMMARY_BATCHING:
+        summary = await summarize_batched(request.email)
+    else:
+        summary = await call_openai_chat(summary_prompt(request.email))
+    await _send_summary(summary, request)
+    return {"status": "sent", "summary": summary}
+
+# Summarization jobs for /summarize?async=true
+jobs = JobQueue(
+    _summarize,
+    workers=APP_A_JOB_WORKERS,
+    max_queued=APP_A_JOB_QUEUE_SIZE,
+    max_kept=APP_A_JOB_RESULTS_KEPT,
+    callback_timeout=APP_A_JOB_CALLBACK_TIMEOUT,
+    callback_schemes=APP_A_JOB_CALLBACK_SCHEMES,
+    callback_hosts=APP_A_JOB_CALLBACK_HOSTS
+)
+
+async def _stream_summary(request: EmailRequest) -> AsyncIterator[bytes]:
+    """
+    SSE frames for a streamed summary: a `token` event per chunk as OpenAI
+    generates it, then `done` once the summary has been sent to the MCP
+    server (or `error`).
+    """
+    parts = []
+    try:
+        async for delta in stream_openai_chat(summary_prompt(request.email)):
+            parts.append(delta)
+            yield encode_event({"text": delta}, event="token")
+        summary = "".join(parts)
+        await _send_summary(summary, request)
+        yield encode_event({"status": "sent", "summary": summary}, event="done")
+    except Exception as e:
+        traceback.print_exc()
+        yield encode_event({"error": str(e)}, event="error")
 
 @app.post("/summarize")
-async def summarize_email(request: EmailRequest):
+async def summarize_email(
+    request: EmailRequest,
+    response: Response,
+    stream: bool = False,
+    run_async: bool = Query(False, alias="async")
+):
+    """
+    Summarize an email and send the summary to App B through the MCP server.
+    With ?stream=true the summary is streamed back as Server-Sent Events
+    while it is generated. With ?async=true the email is queued as a job and
+    its job id returned at once (202); poll GET /jobs/{job_id} for the result
+    or set callback_url (on an allowed host) to have the finished job POSTed there.
+    """
     # Validate email content first
     if not request.email.strip():
         raise HTTPException(status_code=400, detail="Email content cannot be empty")
+
+    if stream:
+        return StreamingResponse(
+            _stream_summary(request),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"}
+        )
     
+    if run_async:
+        try:
+            job = jobs.submit(request, callback_url=request.callback_url)
+        except CallbackNotAllowed as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except JobQueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        response.status_code = 202
+        return {"status": "queued", "job_id": job.job_id}
+
     try:
-        summary = call_openai_chat(f"Summarize this email briefly:\n{request.email}")
-        mcp_package = build_mcp_package(
-            system="You are a CRM assistant.",
-            memory=["Customer is a frequent buyer."],
-            conversation=[{"role": "user", "content": summary}],
-            current_task="Draft a polite reply."
+        return await _summarize(request)
+    except CircuitOpenError as e:
+        # OpenAI is failing; tell the client when to come back instead of queueing up
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(max(1, round(e.retry_after)))}
         )
-        send_mcp_to_server(mcp_package)
-        return {"status": "sent", "summary": summary}
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of a summarization job, with its result or error once finished."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job.to_dict()
+
+@app.get("/jobs")
+async def job_stats():
+    """Report queued, running and finished summarization jobs."""
+    return jobs.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Report LLM response cache hits, misses and evictions."""
+    return llm_cache.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: LLM and MCP call latencies and errors."""
+    return metrics_response()
+
 if __name__ == "__main__":
     uvicorn.run(app, port=APP_A_PORT)
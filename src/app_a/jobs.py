@@ -0,0 +1,214 @@
+import asyncio
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+import httpx
+from common.metrics import REGISTRY
+
+# Job states, in the order a job goes through them
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JOBS = REGISTRY.counter("app_a_jobs_total", "Summarization jobs by outcome", ("status",))
+JOB_QUEUE_DEPTH = REGISTRY.gauge("app_a_job_queue_depth", "Summarization jobs waiting for a worker")
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class CallbackNotAllowed(ValueError):
+    """Raised when a job's callback_url is outside the allowed schemes and hosts."""
+
+
+class Job:
+    """One queued unit of work and, once finished, its result or error."""
+
+    __slots__ = ("job_id", "payload", "callback_url", "status", "result", "error", "created", "finished")
+
+    def __init__(self, payload: Any, callback_url: Optional[str] = None):
+        self.job_id = uuid.uuid4().hex
+        self.payload = payload
+        self.callback_url = callback_url
+        self.status = QUEUED
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        job = {"job_id": self.job_id, "status": self.status, "created": self.created}
+        if self.finished is not None:
+            job["finished"] = self.finished
+        if self.result is not None:
+            job["result"] = self.result
+        if self.error is not None:
+            job["error"] = self.error
+        return job
+
+
+class JobQueue:
+    """
+    Bounded queue of jobs served by a fixed pool of worker tasks.
+
+    submit() returns at once with a job id; `workers` tasks run `handler` on
+    queued jobs, so how fast jobs are accepted no longer depends on how long
+    each takes. At most `max_queued` jobs wait for a worker, and the last
+    `max_kept` finished jobs stay available to get(). A job submitted with a
+    callback_url has its final state POSTed there when it finishes; the URL
+    must use one of `callback_schemes` and name one of `callback_hosts`.
+    Callbacks share one client, opened by start() and closed by close(), and
+    redirects are not followed.
+
+    Workers are started on the running event loop by start(), or on first
+    submit() when the app lifespan did not run.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Dict[str, Any]]],
+        workers: int,
+        max_queued: int,
+        max_kept: int,
+        callback_timeout: float = 10.0,
+        callback_schemes: Iterable[str] = ("https",),
+        callback_hosts: Iterable[str] = ()
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_kept = max_kept
+        self.callback_timeout = callback_timeout
+        self.callback_schemes = frozenset(callback_schemes)
+        self.callback_hosts = frozenset(host.lower() for host in callback_hosts)
+        self._active: Dict[str, Job] = {}
+        self._finished: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def start(self) -> None:
+        """Start the workers on the running loop (a no-op if already running there)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._client = httpx.AsyncClient(timeout=self.callback_timeout)
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+        # Jobs queued on a previous loop would never run; fail them
+        for job in list(self._active.values()):
+            self._finish(job, FAILED, error="Worker pool restarted")
+
+    async def close(self) -> None:
+        """Stop the workers; jobs still queued are failed."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        for job in list(self._active.values()):
+            self._finish(job, FAILED, error="Worker pool stopped")
+
+    def submit(self, payload: Any, callback_url: Optional[str] = None) -> Job:
+        """
+        Queue a job.
+
+        Raises:
+            CallbackNotAllowed: If callback_url is not an allowed callback
+            JobQueueFull: If max_queued jobs are already waiting
+        """
+        if callback_url:
+            self.check_callback(callback_url)
+        self.start()
+        if self._queue.qsize() >= self.max_queued:
+            JOBS.labels("rejected").inc()
+            raise JobQueueFull(f"Job queue is full ({self.max_queued} jobs waiting)")
+        job = Job(payload, callback_url)
+        self._active[job.job_id] = job
+        self._queue.put_nowait(job)
+        JOB_QUEUE_DEPTH.labels().set(self._queue.qsize())
+        return job
+
+    def check_callback(self, url: str) -> None:
+        """
+        Check a callback URL against the allowed schemes and hosts.
+
+        Raises:
+            CallbackNotAllowed: If `url` is not an allowed callback
+        """
+        try:
+            parts = urlsplit(url)
+            host = parts.hostname
+        except ValueError:
+            raise CallbackNotAllowed("callback_url is not a valid URL")
+        if parts.scheme not in self.callback_schemes:
+            schemes = ", ".join(sorted(self.callback_schemes))
+            raise CallbackNotAllowed(f"callback_url scheme must be one of {schemes}")
+        if not host or host not in self.callback_hosts or parts.username or parts.password:
+            raise CallbackNotAllowed(f"callback_url host is not allowed: {host}")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._active.get(job_id) or self._finished.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        running = sum(1 for job in self._active.values() if job.status == RUNNING)
+        return {
+            "queued": len(self._active) - running,
+            "running": running,
+            "finished": len(self._finished),
+            "workers": len(self._tasks)
+        }
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            JOB_QUEUE_DEPTH.labels().set(self._queue.qsize())
+            if job.status != QUEUED:
+                continue  # Failed by a restart while waiting
+            job.status = RUNNING
+            try:
+                self._finish(job, DONE, result=await self.handler(job.payload))
+            except asyncio.CancelledError:
+                self._finish(job, FAILED, error="Worker pool stopped")
+                raise
+            except Exception as e:
+                traceback.print_exc()
+                self._finish(job, FAILED, error=str(e))
+            if job.callback_url:
+                await self._notify(job)
+
+    def _finish(
+        self,
+        job: Job,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None
+    ) -> None:
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished = time.time()
+        job.payload = None  # Only the outcome is kept
+        JOBS.labels(status).inc()
+        self._active.pop(job.job_id, None)
+        self._finished[job.job_id] = job
+        while len(self._finished) > self.max_kept:
+            self._finished.popitem(last=False)
+
+    async def _notify(self, job: Job) -> None:
+        """POST a finished job to its callback URL; failures are logged only."""
+        try:
+            response = await self._client.post(job.callback_url, json=job.to_dict())
+            response.raise_for_status()
+        except Exception:
+            traceback.print_exc()
@@ -1,31 +1,13 @@
-import os
-from pathlib import Path
-from dotenv import load_dotenv
-import requests
-
-# Load environment variables from .env file
-dotenv_path = os.getenv("DOTENV_PATH", str(Path(__file__).parent.parent / ".env"))
-load_dotenv(dotenv_path)
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-def call_openai_chat(prompt):
-    if OPENAI_API_KEY == "your_openai_key":
-        raise ValueError("Please set the OPENAI_API_KEY environment variable")
-
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": "gpt-4-turbo",
-        "messages": [{"role": "user", "content": prompt}]
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        return response.json()["choices"][0]["message"]["content"]
-    except requests.exceptions.RequestException as e:
-        raise RuntimeError(f"OpenAI API request failed: {str(e)}")
\ No newline at end of file
+from common.llm_providers import create_cached_llm
+from config import APP_A_LLM_PROVIDER
+
+# Summaries come from OpenAI unless configured otherwise (e.g. the stub for
+# offline load tests); the APP_A_LLM_PROVIDER environment variable overrides config
+llm = create_cached_llm("APP_A_LLM_PROVIDER", APP_A_LLM_PROVIDER)
+llm_provider = llm.provider
+llm_cache = llm.cache
+LLM_URL = llm.url
+LLM_MODEL = llm.model
+
+call_openai_chat = llm.complete
+stream_openai_chat = llm.stream
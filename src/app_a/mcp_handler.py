@@ -1,8 +1,24 @@
-import requests
-from typing import Dict, Any, List
-from config import MCP_SERVER_URL, MCP_RECEIVE_CONTEXT_ENDPOINT
+import httpx
+from typing import Dict, Any, List, Optional
+from common.batching import BatchItemError, BufferedSender
+from common.codec import encode_request
+from common.http_client import post_with_backoff
+from common.mcp_package import ConversationDeltas, MCPPackage, Turn, UnknownConversation
+from common.metrics import MCP_CLIENT_ERRORS, MCP_CLIENT_SECONDS, timed
+from config import (
+    MCP_SERVER_URL, MCP_RECEIVE_CONTEXT_ENDPOINT, MCP_BATCH_SUFFIX,
+    MCP_SEND_BATCH_SIZE, MCP_SEND_BATCH_DELAY, MCP_WIRE_FORMAT, MCP_SEND_DELTA_CONVERSATIONS
+)
 
-def build_mcp_package(system: str, memory: List[str], conversation: List[Dict[str, str]], current_task: str) -> Dict[str, Any]:
+def build_mcp_package(
+    system: str,
+    memory: List[str],
+    conversation: List[Dict[str, str]],
+    current_task: str,
+    priority: Optional[str] = None,
+    deadline: Optional[float] = None,
+    conversation_id: Optional[str] = None
+) -> Dict[str, Any]:
     """
     Build an MCP package with the required components.
     
@@ -11,31 +27,116 @@ def build_mcp_package(system: str, memory: List[str], conversation: List[Dict[st
         memory: List of memory items
         conversation: List of conversation messages
         current_task: The current task to be performed
+        priority: Optional delivery priority ("high", "normal" or "low")
+        deadline: Optional Unix time after which the package is not worth delivering
+        conversation_id: Optional id of the conversation (e.g. email thread)
+            the package continues
         
     Returns:
         Dict containing the MCP package
     """
-    return {
-        "system": system,
-        "memory": memory,
-        "conversation": conversation,
-        "current_task": current_task
-    }
+    extra: Dict[str, Any] = {}
+    if priority:
+        extra["priority"] = priority
+    if deadline is not None:
+        extra["deadline"] = deadline
+    return MCPPackage(
+        system=system,
+        memory=memory,
+        conversation=[Turn(turn["role"], turn["content"]) for turn in conversation],
+        current_task=current_task,
+        conversation_id=conversation_id,
+        extra=extra
+    ).to_dict()
 
 
-def send_mcp_to_server(mcp_package: Dict[str, Any]) -> Dict[str, Any]:
+@timed(MCP_CLIENT_SECONDS, MCP_CLIENT_ERRORS, "AppA", "send")
+async def send_mcp_to_server(mcp_package: Dict[str, Any], append: bool = False) -> Dict[str, Any]:
     """
     Send MCP package to the MCP server.
     
     Args:
-        mcp_package: The MCP package to send
+        mcp_package: The MCP package to send; one continuing a conversation
+            goes as a delta of the last package sent for it
+        append: Whether the package only carries its conversation's new
+            turns, appended to those already sent for it (see
+            ConversationDeltas.send)
         
     Returns:
         Dict with status of the operation
     """
+    return await conversations.send(mcp_package, _post_package, append)
+
+
+async def _post_package(mcp_package: Dict[str, Any]) -> Dict[str, Any]:
     try:
-        response = requests.post(f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppA", json=mcp_package)
+        response = await post_with_backoff(
+            f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppA",
+            **encode_request(mcp_package, MCP_WIRE_FORMAT)
+        )
+        if response.status_code == 409:
+            raise UnknownConversation(response.json()["error"])
         response.raise_for_status()
         return response.json()
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
+        raise Exception(f"Failed to send MCP package: {str(e)}")
+
+
+@timed(MCP_CLIENT_SECONDS, MCP_CLIENT_ERRORS, "AppA", "send_batch")
+async def send_mcp_batch_to_server(mcp_packages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Send several MCP packages to the MCP server in one request.
+    
+    Args:
+        mcp_packages: The MCP packages to send
+        
+    Returns:
+        One status dict per package, in order
+    """
+    try:
+        response = await post_with_backoff(
+            f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppA{MCP_BATCH_SUFFIX}",
+            **encode_request(mcp_packages, MCP_WIRE_FORMAT)
+        )
+        response.raise_for_status()
+        return response.json()["results"]
+    except httpx.HTTPError as e:
+        raise Exception(f"Failed to send MCP packages: {str(e)}")
+
+
+_buffered_sender = BufferedSender(
+    send_mcp_batch_to_server, MCP_SEND_BATCH_SIZE, MCP_SEND_BATCH_DELAY
+)
+
+# Last package sent per conversation; later packages of one go as deltas
+conversations = ConversationDeltas(MCP_SEND_DELTA_CONVERSATIONS)
+
+
+async def _send_buffered(mcp_package: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return await _buffered_sender.send(mcp_package)
+    except BatchItemError as e:
+        if e.status_code == 409:
+            raise UnknownConversation(str(e))
+        raise
+
+
+async def send_mcp_buffered(mcp_package: Dict[str, Any], append: bool = False) -> Dict[str, Any]:
+    """
+    Send an MCP package through the buffered sender, which coalesces packages
+    sent within a short window into a single batch request.
+    
+    Args:
+        mcp_package: The MCP package to send; one continuing a conversation
+            goes as a delta of the last package sent for it
+        append: Whether the package only carries its conversation's new
+            turns, appended to those already sent for it (see
+            ConversationDeltas.send)
+        
+    Returns:
+        Dict with status of the operation
+    """
+    try:
+        return await conversations.send(mcp_package, _send_buffered, append)
+    except Exception as e:
         raise Exception(f"Failed to send MCP package: {str(e)}")
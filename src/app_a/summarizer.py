@@ -0,0 +1,116 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+from common.batching import BufferedSender
+from common.llm_cache import cache_key
+from common.metrics import REGISTRY
+from config import (
+    LLM_CACHE_ENABLED, APP_A_SUMMARY_BATCH_SIZE, APP_A_SUMMARY_BATCH_DELAY,
+    APP_A_SUMMARY_BATCH_MAX_CHARS
+)
+from app_a.llm_client import LLM_MODEL, call_openai_chat, llm_cache
+
+SUMMARY_BATCH_SIZE = REGISTRY.histogram(
+    "app_a_summary_batch_size", "Emails summarized per OpenAI request when micro-batching",
+    buckets=(1, 2, 4, 8, 16, 32)
+)
+SUMMARY_BATCH_FALLBACKS = REGISTRY.counter(
+    "app_a_summary_batch_fallbacks_total",
+    "Batched summary answers that could not be split, so each email was summarized alone"
+)
+
+_batch_sizes = SUMMARY_BATCH_SIZE.labels()
+_fallbacks = SUMMARY_BATCH_FALLBACKS.labels()
+
+
+def summary_prompt(email: str) -> str:
+    return f"Summarize this email briefly:\n{email}"
+
+
+def batch_prompt(emails: List[str]) -> str:
+    """One prompt asking for a summary of each email, as a JSON array in order."""
+    parts = [
+        f"Summarize each of the following {len(emails)} emails briefly. Answer with "
+        f"only a JSON array of {len(emails)} strings: the summary of each email, in order."
+    ]
+    for index, email in enumerate(emails, 1):
+        parts.append(f"\nEmail {index}:\n<<<\n{email}\n>>>")
+    return "\n".join(parts)
+
+
+def parse_batch_summaries(text: str, count: int) -> Optional[List[str]]:
+    """
+    Split the answer to batch_prompt() into per-email summaries.
+
+    Returns:
+        The summaries, or None if the answer is not a JSON array of `count` strings
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        # Drop a ```json fence around the array
+        text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+    try:
+        summaries = json.loads(text)
+    except ValueError:
+        return None
+    if (
+        not isinstance(summaries, list)
+        or len(summaries) != count
+        or not all(isinstance(summary, str) for summary in summaries)
+    ):
+        return None
+    return summaries
+
+
+async def _summarize_one(email: str) -> Dict[str, Any]:
+    try:
+        return {"summary": await call_openai_chat(summary_prompt(email))}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+async def _summarize_batch(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Summarize a batch of emails with one OpenAI request. An answer that does
+    not split into one summary per email falls back to a request per email.
+    """
+    emails = [item["email"] for item in items]
+    _batch_sizes.observe(len(emails))
+    if len(emails) == 1:
+        return [await _summarize_one(emails[0])]
+
+    summaries = parse_batch_summaries(await call_openai_chat(batch_prompt(emails)), len(emails))
+    if summaries is None:
+        _fallbacks.inc()
+        return list(await asyncio.gather(*(_summarize_one(email) for email in emails)))
+    if LLM_CACHE_ENABLED:
+        # Cached per email too, so a repeat is answered without a batch
+        for email, summary in zip(emails, summaries):
+            llm_cache.set(cache_key(LLM_MODEL, summary_prompt(email)), summary)
+    return [{"summary": summary} for summary in summaries]
+
+
+_batcher = BufferedSender(
+    _summarize_batch,
+    max_batch=APP_A_SUMMARY_BATCH_SIZE,
+    max_delay=APP_A_SUMMARY_BATCH_DELAY,
+    max_weight=APP_A_SUMMARY_BATCH_MAX_CHARS,
+    weigh=lambda item: len(item["email"])
+)
+
+
+async def summarize_batched(email: str) -> str:
+    """
+    Summarize an email, sharing an OpenAI request with the other emails
+    submitted within APP_A_SUMMARY_BATCH_DELAY seconds. Cached summaries are
+    returned without waiting for a batch.
+
+    Raises:
+        Exception: If the email could not be summarized
+    """
+    if LLM_CACHE_ENABLED:
+        cached = await llm_cache.get(cache_key(LLM_MODEL, summary_prompt(email)))
+        if cached is not None:
+            return cached
+    result = await _batcher.send({"email": email})
+    return result["summary"]
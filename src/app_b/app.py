@@ -1,19 +1,205 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+import asyncio
 import uvicorn
-from config import APP_B_PORT
-import requests
-from app_b.mcp_handler import parse_mcp_package, poll_mcp_server
-from app_b.llm_client import call_claude
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from config import (
+    APP_B_PORT, MCP_DEFAULT_LEASE_SECONDS, MCP_SERVER_URL, APP_B_LLM_CONCURRENCY,
+    APP_B_LLM_REQUESTS_PER_MINUTE, APP_B_LLM_TOKENS_PER_MINUTE, APP_B_DEDUP_ENABLED,
+    APP_B_DEDUP_THRESHOLD, APP_B_DEDUP_WINDOW, APP_B_DEDUP_TTL_SECONDS,
+    APP_B_DEDUP_SHINGLE_SIZE, APP_B_DEDUP_MIN_SHINGLES, APP_B_DEDUP_NUM_HASHES,
+    APP_B_DEDUP_BANDS
+)
+from common.http_client import client_lifespan
+from common.metrics import metrics_response
+from common.rate_limit import RateLimiter
+from common.sse import encode_event
+from common.llm_cache import CallAbandoned
+from app_b.dedup import NearDuplicateIndex
+from app_b.mcp_handler import build_prompt, poll_mcp_server, ack_mcp_messages
+from app_b.llm_client import call_claude, stream_claude, llm_cache, LLM_URL, CLAUDE_MAX_TOKENS
 import traceback
 
-app = FastAPI()
+app = FastAPI(lifespan=client_lifespan(MCP_SERVER_URL, LLM_URL))
+
+# Shared by every poll so concurrent polls together stay within the limits
+llm_rate_limiter = RateLimiter(APP_B_LLM_REQUESTS_PER_MINUTE, APP_B_LLM_TOKENS_PER_MINUTE)
+
+# Streamed reply chunks held for a slow client before upstream reads pause
+REPLY_STREAM_BUFFER = 64
+
+# Recent replies, reused for near-duplicate prompts when APP_B_DEDUP_ENABLED
+reply_index = NearDuplicateIndex(
+    APP_B_DEDUP_THRESHOLD,
+    APP_B_DEDUP_WINDOW,
+    APP_B_DEDUP_TTL_SECONDS,
+    shingle_size=APP_B_DEDUP_SHINGLE_SIZE,
+    min_shingles=APP_B_DEDUP_MIN_SHINGLES,
+    num_hashes=APP_B_DEDUP_NUM_HASHES,
+    bands=APP_B_DEDUP_BANDS
+)
+
+
+async def generate_replies(
+    messages: List[Dict[str, Any]]
+) -> Tuple[List[Optional[str]], List[Dict[str, Any]]]:
+    """
+    Draft a Claude reply for each message concurrently.
+
+    At most APP_B_LLM_CONCURRENCY calls run at once, each after clearing the
+    request and token rate limits. A failed message does not stop the others.
+    With APP_B_DEDUP_ENABLED, a message whose prompt nearly duplicates a
+    recent one gets that reply without a call.
+
+    Returns:
+        The replies in message order (None where generation failed) and an
+        error entry {"index", "error"} for each failed message
+    """
+    slots = asyncio.Semaphore(APP_B_LLM_CONCURRENCY)
+
+    async def reply_to(mcp_package: Dict[str, Any]) -> str:
+        prompt = build_prompt(mcp_package)
+
+        async def generate() -> str:
+            async with slots:
+                await llm_rate_limiter.acquire(prompt.tokens + CLAUDE_MAX_TOKENS)
+                return await call_claude(prompt.text)
+
+        if APP_B_DEDUP_ENABLED:
+            return await reply_index.get_or_call(prompt.text, generate)
+        return await generate()
+
+    outcomes = await asyncio.gather(
+        *(reply_to(mcp_package) for mcp_package in messages),
+        return_exceptions=True
+    )
+    replies, errors = [], []
+    for index, outcome in enumerate(outcomes):
+        # BaseException too: a cancelled reply is a failure, not a reply
+        if isinstance(outcome, BaseException):
+            replies.append(None)
+            errors.append({"index": index, "error": str(outcome) or type(outcome).__name__})
+        else:
+            replies.append(outcome)
+    return replies, errors
+
+
+async def _ack_page(response: Dict[str, Any], replied: List[bool]) -> None:
+    """
+    Ack a leased page once its messages are handled. Messages without a
+    reply are released back to the MCP server for redelivery.
+    """
+    cursor = response.get("next_cursor")
+    if cursor is None:
+        return
+    if all(replied):
+        await ack_mcp_messages(cursor)
+        return
+    message_ids = response.get("message_ids", [])
+    await ack_mcp_messages(
+        cursor,
+        release=True,
+        message_ids=[
+            message_ids[index]
+            for index, ok in enumerate(replied)
+            if ok and index < len(message_ids)
+        ]
+    )
+
+
+async def stream_reply_events(
+    response: Dict[str, Any], messages: List[Dict[str, Any]]
+) -> AsyncIterator[bytes]:
+    """
+    SSE frames for replies streamed from Claude as they are generated.
+
+    Replies are generated concurrently under the same limits as
+    generate_replies(). Chunks of different replies interleave as `token`
+    events tagged with the message index; each reply ends with `reply_done`
+    or `error`, and the stream ends with `done` after the page is acked.
+    Reply text is not retained (except for the near-duplicate index when
+    APP_B_DEDUP_ENABLED, which answers a near-duplicate with one `token`
+    event), and a full buffer of unsent events pauses the upstream streams,
+    so memory stays flat for long replies. If the client goes away first
+    the page is left to its lease and redelivered.
+    """
+    slots = asyncio.Semaphore(APP_B_LLM_CONCURRENCY)
+    events: asyncio.Queue = asyncio.Queue(maxsize=REPLY_STREAM_BUFFER)
+    replied = [False] * len(messages)
+
+    async def stream_one(index: int, mcp_package: Dict[str, Any]) -> None:
+        try:
+            prompt = build_prompt(mcp_package)
+            signature, earlier = reply_index.lookup(prompt.text) if APP_B_DEDUP_ENABLED else (None, None)
+            reply = None
+            if earlier is not None:
+                try:
+                    reply = await asyncio.shield(earlier)
+                except CallAbandoned:
+                    pass  # Its call was cancelled; generate this reply instead
+            if reply is not None:
+                await events.put(encode_event({"index": index, "text": reply}, event="token"))
+            else:
+                parts = [] if signature is not None else None
+                async with slots:
+                    await llm_rate_limiter.acquire(prompt.tokens + CLAUDE_MAX_TOKENS)
+                    async for delta in stream_claude(prompt.text):
+                        if parts is not None:
+                            parts.append(delta)
+                        await events.put(encode_event({"index": index, "text": delta}, event="token"))
+                if parts is not None:
+                    reply_index.add(signature, "".join(parts))
+            replied[index] = True
+            await events.put(encode_event({"index": index}, event="reply_done"))
+        except Exception as e:
+            await events.put(encode_event({"index": index, "error": str(e)}, event="error"))
+        # Not in a finally: once cancelled (the client went away) nobody reads
+        # the queue, and waiting for room in it would never return
+        await events.put(None)
+
+    tasks = [
+        asyncio.create_task(stream_one(index, mcp_package))
+        for index, mcp_package in enumerate(messages)
+    ]
+    try:
+        yield encode_event({"received_messages": messages}, event="messages")
+        remaining = len(tasks)
+        while remaining:
+            event = await events.get()
+            if event is None:
+                remaining -= 1
+            else:
+                yield event
+        await _ack_page(response, replied)
+        done = {"replies": sum(replied), "errors": len(replied) - sum(replied)}
+        if "has_more" in response:
+            done["has_more"] = response["has_more"]
+        yield encode_event(done, event="done")
+    finally:
+        for task in tasks:
+            task.cancel()
+
 
 @app.get("/poll")
-async def poll_endpoint():
+async def poll_endpoint(
+    wait: float = 0, max_messages: Optional[int] = None, stream: bool = False
+):
+    """
+    Pull messages from the MCP server and draft a reply to each.
+    Replies are generated concurrently and returned in message order; a
+    message whose reply failed is listed in `errors`. With max_messages,
+    messages are pulled in a bounded, leased chunk: those with a reply are
+    acked and the rest go back to the MCP server for redelivery.
+    With ?stream=true replies are streamed as Server-Sent Events while
+    Claude generates them (see stream_reply_events).
+    """
+    lease = MCP_DEFAULT_LEASE_SECONDS if max_messages else None
     try:
         # First try to poll the MCP server
         try:
-            response = poll_mcp_server()
+            response = await poll_mcp_server(
+                wait=wait, max_messages=max_messages, lease=lease
+            )
         except Exception as e:
             # Any poll error should return 503
             raise HTTPException(
@@ -26,6 +212,13 @@ async def poll_endpoint():
         # If there are no messages, return early with empty array
         if not messages:
             return {"messages": []}
+
+        if stream:
+            return StreamingResponse(
+                stream_reply_events(response, messages),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache"}
+            )
         
         # Process messages with Claude if we have any
         try:
@@ -35,14 +228,18 @@ async def poll_endpoint():
                 "replies": []
             }
             
+            if "has_more" in response:
+                result["has_more"] = response["has_more"]
+
             # Try to get Claude replies if possible
-            try:
-                for mcp_package in messages:
-                    prompt = parse_mcp_package(mcp_package)
-                    reply = call_claude(prompt)
-                    result["replies"].append(reply)
-            except Exception as e:
-                result["claude_error"] = str(e)
+            replies, errors = await generate_replies(messages)
+            result["replies"] = replies
+            if errors:
+                result["errors"] = errors
+                # Kept for clients that only look at the first failure
+                result["claude_error"] = errors[0]["error"]
+
+            await _ack_page(response, [reply is not None for reply in replies])
                 
             return result
         except Exception as e:
@@ -55,5 +252,15 @@ async def poll_endpoint():
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Report LLM response cache hits, misses and evictions, and near-duplicate reuse."""
+    return {**llm_cache.stats(), "near_duplicates": reply_index.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: LLM and MCP call latencies and errors."""
+    return metrics_response()
+
 if __name__ == "__main__":
     uvicorn.run(app, port=APP_B_PORT)
@@ -0,0 +1,259 @@
+import asyncio
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from common.llm_cache import CallAbandoned
+from common.metrics import FAST_BUCKETS, REGISTRY
+
+_WORD = re.compile(r"\w+")
+_DIGITS = re.compile(r"\d+")
+_MASK = (1 << 64) - 1
+
+# Added per bin of distance to values borrowed by empty bins, so they never
+# equal a value a bin holds itself (hash values are below 2**64)
+_BORROWED = 1 << 64
+
+# Most recent prompts kept per LSH bucket, and candidates compared in full
+# per lookup (those sharing the most bands), so a lookup costs the same
+# however many similar prompts arrive
+BUCKET_SIZE = 8
+MAX_CANDIDATES = 8
+
+NEAR_DUPLICATES = REGISTRY.counter(
+    "app_b_near_duplicates_total", "Messages answered with the reply to an earlier near-duplicate prompt"
+)
+DEDUP_SECONDS = REGISTRY.histogram(
+    "app_b_dedup_seconds", "Time to sign a prompt and look it up in the near-duplicate index",
+    buckets=FAST_BUCKETS
+)
+
+_near_duplicates = NEAR_DUPLICATES.labels()
+_lookup_seconds = DEDUP_SECONDS.labels()
+
+Signature = Tuple[int, ...]
+
+
+def shingles(text: str, size: int) -> Set[int]:
+    """
+    64-bit hashes of the `size`-word shingles of `text`. Case, punctuation
+    and whitespace are ignored and every number reads as 0, so texts
+    differing only in those (e.g. order numbers) have the same shingles.
+
+    Python's built-in hash is used for speed; it is salted per process, so
+    signatures are only comparable within one process.
+    """
+    words = _WORD.findall(_DIGITS.sub("0", text.lower()))
+    if len(words) < size:
+        return {hash(tuple(words)) & _MASK} if words else set()
+    return {hash(shingle) & _MASK for shingle in zip(*(words[i:] for i in range(size)))}
+
+
+def minhash(hashes: Set[int], num_hashes: int) -> Signature:
+    """
+    One-permutation MinHash signature of a set of 64-bit hashes.
+
+    Each hash falls into one of `num_hashes` bins, which keeps its minimum,
+    so signing costs one pass over the set however long the signature.
+    Empty bins borrow the value of the next filled bin (rotation
+    densification). The fraction of positions two signatures agree on
+    estimates the Jaccard similarity of their sets.
+    """
+    empty = _BORROWED
+    bins = [empty] * num_hashes
+    for value in hashes:
+        index = value % num_hashes
+        if value < bins[index]:
+            bins[index] = value
+    if empty not in bins:
+        return tuple(bins)
+    signature = list(bins)
+    borrowed, distance = empty, 0
+    # Two passes right to left, so every empty bin has seen a filled one
+    for step in range(2 * num_hashes - 1, -1, -1):
+        index = step % num_hashes
+        if bins[index] != empty:
+            borrowed, distance = bins[index], 0
+        else:
+            distance += 1
+            if step < num_hashes:
+                signature[index] = borrowed + distance * _BORROWED
+    return tuple(signature)
+
+
+def similarity(first: Signature, second: Signature) -> float:
+    """Estimated Jaccard similarity of the sets behind two signatures."""
+    return sum(a == b for a, b in zip(first, second)) / len(first)
+
+
+class _Entry:
+    __slots__ = ("entry_id", "signature", "keys", "reply", "created")
+
+    def __init__(self, entry_id: int, signature: Signature, keys: List[int], reply: asyncio.Future):
+        self.entry_id = entry_id
+        self.signature = signature
+        self.keys = keys
+        self.reply = reply
+        self.created = time.monotonic()
+
+
+class NearDuplicateIndex:
+    """
+    Replies to recent prompts, found again by prompts that are nearly the same.
+
+    Prompts are signed with MinHash over word shingles; an LSH index splits
+    each signature into `bands` bands, and a prompt is compared only with
+    the earlier prompts that share the most bands with it. The best of those
+    at `threshold` estimated similarity or more gives its reply. Only the last
+    `window` prompts, and none older than `ttl` seconds, are kept, so the
+    index's memory is bounded.
+
+    Like LLMCache.get_or_call(), a near-duplicate of a prompt still being
+    answered waits for that answer instead of making its own call; if that
+    call is cancelled, the pending reply fails with CallAbandoned and the
+    waiters make their own.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        window: int,
+        ttl: float,
+        shingle_size: int = 3,
+        min_shingles: int = 8,
+        num_hashes: int = 64,
+        bands: int = 16
+    ):
+        if num_hashes % bands:
+            raise ValueError("num_hashes must be a multiple of bands")
+        self.threshold = threshold
+        self.window = window
+        self.ttl = ttl
+        self.shingle_size = shingle_size
+        self.min_shingles = min_shingles
+        self.num_hashes = num_hashes
+        self.bands = bands
+        self._rows = num_hashes // bands
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[int, List[int]] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def sign(self, text: str) -> Optional[Signature]:
+        """The signature of `text`, or None if it is too short to compare."""
+        hashes = shingles(text, self.shingle_size)
+        if len(hashes) < self.min_shingles:
+            return None
+        return minhash(hashes, self.num_hashes)
+
+    def _band_keys(self, signature: Signature) -> List[int]:
+        rows = self._rows
+        return [hash((band, signature[band * rows:(band + 1) * rows])) for band in range(self.bands)]
+
+    def match(self, signature: Signature) -> Optional[asyncio.Future]:
+        """
+        The reply to the most similar recent prompt at `threshold` or more;
+        a pending future while that prompt is still being answered.
+        """
+        self._evict()
+        loop = asyncio.get_running_loop()
+        shared: Counter = Counter()
+        for key in self._band_keys(signature):
+            shared.update(self._buckets.get(key, ()))
+        best, best_similarity = None, self.threshold
+        for entry_id, _ in shared.most_common(MAX_CANDIDATES):
+            entry = self._entries[entry_id]
+            if entry.reply.get_loop() is not loop:
+                continue
+            score = similarity(signature, entry.signature)
+            if score >= best_similarity:
+                best, best_similarity = entry, score
+        return best.reply if best is not None else None
+
+    def add(self, signature: Signature, reply: Optional[str] = None) -> _Entry:
+        """Index a prompt with its reply, or with a pending reply to set later."""
+        future = asyncio.get_running_loop().create_future()
+        if reply is not None:
+            future.set_result(reply)
+        entry = _Entry(self._next_id, signature, self._band_keys(signature), future)
+        self._next_id += 1
+        self._entries[entry.entry_id] = entry
+        for key in entry.keys:
+            bucket = self._buckets.setdefault(key, [])
+            bucket.append(entry.entry_id)
+            if len(bucket) > BUCKET_SIZE:
+                del bucket[0]
+        self._evict()
+        return entry
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return  # Already evicted
+        for key in entry.keys:
+            bucket = self._buckets.get(key)
+            if bucket is not None and entry_id in bucket:
+                bucket.remove(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def _evict(self) -> None:
+        expired = time.monotonic() - self.ttl
+        while self._entries:
+            entry_id, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.window and entry.created > expired:
+                break
+            self._remove(entry_id)
+
+    def lookup(self, text: str) -> Tuple[Optional[Signature], Optional[asyncio.Future]]:
+        """
+        Sign `text` and find the reply to a recent near-duplicate.
+
+        Returns:
+            (the signature, None if `text` is too short to compare; the
+            earlier reply as with match(), or None)
+        """
+        started = time.perf_counter()
+        signature = self.sign(text)
+        earlier = self.match(signature) if signature is not None else None
+        _lookup_seconds.observe(time.perf_counter() - started)
+        if earlier is not None:
+            self.hits += 1
+            _near_duplicates.inc()
+        else:
+            self.misses += 1
+        return signature, earlier
+
+    async def get_or_call(self, text: str, call: Callable[[], Awaitable[str]]) -> str:
+        """
+        The reply to a recent near-duplicate of `text`, or await `call` to
+        produce one. Failed calls are not indexed.
+        """
+        signature, earlier = self.lookup(text)
+        while earlier is not None:
+            try:
+                return await asyncio.shield(earlier)
+            except CallAbandoned:
+                earlier = self.match(signature)  # The abandoned entry is gone
+        if signature is None:
+            return await call()
+
+        entry = self.add(signature)
+        try:
+            reply = await call()
+        except asyncio.CancelledError:
+            self._remove(entry.entry_id)
+            entry.reply.set_exception(CallAbandoned())
+            entry.reply.exception()  # Mark retrieved when nobody else was waiting
+            raise
+        except Exception as e:
+            self._remove(entry.entry_id)
+            entry.reply.set_exception(e)
+            entry.reply.exception()  # Mark retrieved when nobody else was waiting
+            raise
+        entry.reply.set_result(reply)
+        return reply
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -1,33 +1,15 @@
-import os
-from pathlib import Path
-from dotenv import load_dotenv
-import requests
+from common.llm_providers import create_cached_llm
+from config import APP_B_LLM_PROVIDER
 
-# Load environment variables from .env file
-dotenv_path = os.getenv("DOTENV_PATH", str(Path(__file__).parent.parent / ".env"))
-load_dotenv(dotenv_path)
+CLAUDE_MAX_TOKENS = 1000
 
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+# Replies come from Claude unless configured otherwise (e.g. the stub for
+# offline load tests); the APP_B_LLM_PROVIDER environment variable overrides config
+llm = create_cached_llm("APP_B_LLM_PROVIDER", APP_B_LLM_PROVIDER, max_tokens=CLAUDE_MAX_TOKENS)
+llm_provider = llm.provider
+llm_cache = llm.cache
+LLM_URL = llm.url
+LLM_MODEL = llm.model
 
-def call_claude(prompt):
-    if ANTHROPIC_API_KEY == "your_anthropic_key":
-        raise ValueError("Please set the ANTHROPIC_API_KEY environment variable")
-    
-    url = "https://api.anthropic.com/v1/messages"
-    headers = {
-        "Authorization": f"Bearer {ANTHROPIC_API_KEY}",
-        "Content-Type": "application/json",
-        "anthropic-version": "2023-06-01"
-    }
-    data = {
-        "model": "claude-3-opus-20240229",
-        "messages": [{"role": "user", "content": prompt}],
-        "max_tokens": 1000
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        return response.json()["content"][0]["text"]
-    except requests.exceptions.RequestException as e:
-        raise RuntimeError(f"Anthropic API request failed: {str(e)}")
\ No newline at end of file
+call_claude = llm.complete
+stream_claude = llm.stream
@@ -1,6 +1,31 @@
-import requests
-from typing import Dict, Any, List
-from config import MCP_SERVER_URL, MCP_RECEIVE_CONTEXT_ENDPOINT
+import httpx
+from typing import Dict, Any, AsyncIterator, List, Optional
+from common.codec import accept_headers, decode_response
+from common.http_client import STREAM_TIMEOUT, get_client, long_poll_timeout
+from common.metrics import MCP_CLIENT_ERRORS, MCP_CLIENT_SECONDS, timed
+from common.sse import aiter_events
+from app_b.prompt_builder import BuiltPrompt, PromptBuilder
+from config import (
+    MCP_SERVER_URL, MCP_RECEIVE_CONTEXT_ENDPOINT, MCP_SUBSCRIBE_ENDPOINT, MCP_ACK_ENDPOINT,
+    MCP_WIRE_FORMAT, APP_B_PROMPT_MAX_TOKENS, APP_B_PROMPT_CACHE_SIZE
+)
+
+# Renders packages into prompts, caching the rendered sections per thread
+prompt_builder = PromptBuilder(APP_B_PROMPT_MAX_TOKENS, APP_B_PROMPT_CACHE_SIZE)
+
+
+def build_prompt(mcp_package: Dict[str, Any]) -> BuiltPrompt:
+    """
+    Render an MCP package into a Claude prompt within the token budget.
+    
+    Args:
+        mcp_package: Dictionary containing system, memory, conversation, and current_task
+        
+    Returns:
+        The prompt with the estimated token count of each section
+    """
+    return prompt_builder.build(mcp_package)
+
 
 def parse_mcp_package(mcp_package: Dict[str, Any]) -> str:
     """
@@ -12,51 +37,100 @@ def parse_mcp_package(mcp_package: Dict[str, Any]) -> str:
     Returns:
         Formatted prompt string for Claude
     """
-    system = mcp_package.get('system', '')
-    memory = mcp_package.get('memory', [])
-    conversation = mcp_package.get('conversation', [])
-    current_task = mcp_package.get('current_task', '')
-    
-    # Build the prompt
-    prompt_parts = []
-    
-    # Add system context
-    if system:
-        prompt_parts.append(f"System: {system}\n")
-    
-    # Add memory items
-    if memory:
-        prompt_parts.append("Context:")
-        for item in memory:
-            prompt_parts.append(f"- {item}")
-        prompt_parts.append("")  # Empty line
-    
-    # Add conversation
-    if conversation:
-        prompt_parts.append("Conversation:")
-        for msg in conversation:
-            role = msg.get('role', '')
-            content = msg.get('content', '')
-            prompt_parts.append(f"{role}: {content}")
-        prompt_parts.append("")  # Empty line
-    
-    # Add current task
-    if current_task:
-        prompt_parts.append(f"Task: {current_task}")
-    
-    return "\n".join(prompt_parts)
+    return build_prompt(mcp_package).text
 
 
-def poll_mcp_server() -> Dict[str, Any]:
+@timed(MCP_CLIENT_SECONDS, MCP_CLIENT_ERRORS, "AppB", "poll")
+async def poll_mcp_server(
+    wait: float = 0,
+    max_messages: Optional[int] = None,
+    lease: Optional[float] = None,
+    cursor: Optional[int] = None
+) -> Dict[str, Any]:
     """
     Poll MCP server for messages.
     
+    Args:
+        wait: Seconds the server may hold the request open while the inbox
+            is empty (long-poll). 0 returns immediately.
+        max_messages: Optional cap on messages returned by this poll
+        lease: Optional visibility timeout (seconds); leased messages are
+            redelivered unless acked with ack_mcp_messages() in time
+        cursor: Optional next_cursor of the previous leased poll to ack
+    
     Returns:
         Dict containing any messages from the server
     """
+    params = {
+        "wait": wait, "max_messages": max_messages, "lease": lease, "cursor": cursor,
+        "materialize": "true"  # Expand delta packages into full contexts
+    }
     try:
-        response = requests.post(f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppB")
+        client = get_client(MCP_SERVER_URL)
+        response = await client.post(
+            f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppB",
+            params={k: v for k, v in params.items() if v} or None,
+            headers=accept_headers(MCP_WIRE_FORMAT),
+            timeout=long_poll_timeout(client, wait)
+        )
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return decode_response(response)
+    except httpx.HTTPError as e:
         raise Exception(f"Failed to poll MCP server: {str(e)}")
+
+
+@timed(MCP_CLIENT_SECONDS, MCP_CLIENT_ERRORS, "AppB", "ack")
+async def ack_mcp_messages(
+    cursor: int,
+    release: bool = False,
+    message_ids: Optional[List[int]] = None
+) -> Dict[str, Any]:
+    """
+    Acknowledge a leased poll so its messages are not redelivered.
+    
+    Args:
+        cursor: The next_cursor returned by the leased poll
+        release: Return the cursor's unacked messages to the inbox now instead
+        message_ids: Messages to ack individually (before any release)
+        
+    Returns:
+        Dict with status of the operation
+    """
+    ack = {"cursor": cursor, "release": release}
+    if message_ids:
+        ack["message_ids"] = message_ids
+    try:
+        response = await get_client(MCP_SERVER_URL).post(
+            f"{MCP_SERVER_URL}{MCP_ACK_ENDPOINT}/AppB",
+            json=ack
+        )
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPError as e:
+        raise Exception(f"Failed to ack MCP messages: {str(e)}")
+
+
+async def subscribe_mcp_server(max_events: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Hold one streaming connection to the MCP server and yield messages
+    as they are routed, instead of issuing a request per poll.
+    
+    Args:
+        max_events: Optional number of messages after which the server closes the stream
+        
+    Yields:
+        Each MCP package pushed by the server
+    """
+    params = {"max_events": max_events} if max_events else None
+    try:
+        async with get_client(MCP_SERVER_URL).stream(
+            "GET",
+            f"{MCP_SERVER_URL}{MCP_SUBSCRIBE_ENDPOINT}/AppB",
+            params=params,
+            timeout=STREAM_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            async for event in aiter_events(response.aiter_lines()):
+                yield event
+    except httpx.HTTPError as e:
+        raise Exception(f"MCP server subscription failed: {str(e)}")
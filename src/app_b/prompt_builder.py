@@ -0,0 +1,258 @@
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from common.metrics import REGISTRY
+from common.tokens import estimate_tokens
+
+# Sections of a rendered prompt, in prompt order
+SECTIONS = ("system", "memory", "conversation", "task")
+
+PROMPT_TOKENS = REGISTRY.histogram(
+    "app_b_prompt_tokens", "Estimated tokens per section of prompts sent to Claude",
+    ("section",), buckets=(16, 64, 256, 1024, 2048, 4096, 8192, 16384, 32768)
+)
+PROMPT_OMITTED = REGISTRY.counter(
+    "app_b_prompt_omitted_total", "Conversation turns and memory items left out to fit the budget",
+    ("section",)
+)
+
+_observed = {section: PROMPT_TOKENS.labels(section) for section in SECTIONS}
+_omitted_turns = PROMPT_OMITTED.labels("conversation")
+_omitted_memory = PROMPT_OMITTED.labels("memory")
+
+
+class BuiltPrompt:
+    """A rendered prompt with the estimated token count of each section."""
+
+    __slots__ = ("text", "sections", "omitted_turns", "omitted_memory")
+
+    def __init__(
+        self, text: str, sections: Dict[str, int], omitted_turns: int = 0, omitted_memory: int = 0
+    ):
+        self.text = text
+        self.sections = sections
+        self.omitted_turns = omitted_turns
+        self.omitted_memory = omitted_memory
+
+    @property
+    def tokens(self) -> int:
+        return sum(self.sections.values())
+
+
+class _Lines:
+    """Rendered lines of one section with the token estimate of each line, and their total."""
+
+    __slots__ = ("lines", "tokens", "total")
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self.tokens: List[int] = []
+        self.total = 0
+
+    def append(self, line: str) -> None:
+        tokens = estimate_tokens(line)
+        self.lines.append(line)
+        self.tokens.append(tokens)
+        self.total += tokens
+
+
+class _RenderedTurns(_Lines):
+    __slots__ = ("turns",)
+
+    def __init__(self):
+        super().__init__()
+        self.turns: List[Tuple[str, str]] = []
+
+    def add(self, role: str, content: str) -> None:
+        self.turns.append((role, content))
+        self.append(f"{role}: {content}")
+
+    def head(self, count: int) -> "_RenderedTurns":
+        """A copy of the first `count` turns."""
+        head = _RenderedTurns()
+        head.turns = self.turns[:count]
+        head.lines = self.lines[:count]
+        head.tokens = self.tokens[:count]
+        head.total = sum(head.tokens)
+        return head
+
+
+def _turn(message: Dict[str, Any]) -> Tuple[str, str]:
+    return message.get("role", ""), message.get("content", "")
+
+
+def _same_turns(conversation: List[Dict[str, Any]], turns: List[Tuple[str, str]]) -> bool:
+    """Whether `conversation` and the rendered `turns` agree on every turn they both have."""
+    return all(_turn(message) == turn for message, turn in zip(conversation, turns))
+
+
+class PromptBuilder:
+    """
+    Renders MCP packages into Claude prompts within a token budget.
+
+    The rendered memory section is cached per (system, memory) and the
+    rendered conversation per conversation, so a thread that grows by a turn
+    renders only the new turn. A cached render is reused only when every
+    turn it holds matches the package's; the new turns are appended to it in
+    place. When a prompt would exceed max_tokens, the
+    oldest conversation turns are replaced by a one-line note, then the
+    oldest memory items; the system prompt, the task and the latest turn are
+    always kept (the latest turn is cut from the front as a last resort).
+    Token counts use the estimate_tokens heuristic.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, cache_size: int = 256):
+        self.max_tokens = max_tokens
+        self.cache_size = cache_size
+        self._memory: "OrderedDict[str, _Lines]" = OrderedDict()
+        self._conversations: "OrderedDict[str, _RenderedTurns]" = OrderedDict()
+
+    def build(self, mcp_package: Dict[str, Any]) -> BuiltPrompt:
+        """
+        Render a package into a prompt.
+
+        Args:
+            mcp_package: Dictionary with system, memory, conversation and current_task
+
+        Returns:
+            The prompt and its per-section token estimates
+        """
+        system = mcp_package.get('system', '')
+        memory = mcp_package.get('memory', [])
+        conversation = mcp_package.get('conversation', [])
+        current_task = mcp_package.get('current_task', '')
+
+        system_line = f"System: {system}\n" if system else None
+        task_line = f"Task: {current_task}" if current_task else None
+        fixed = estimate_tokens(system_line or "") + estimate_tokens(task_line or "")
+        memory_lines = self._render_memory(system, memory) if memory else _Lines()
+        turns = self._render_conversation(mcp_package, conversation) if conversation else _RenderedTurns()
+
+        keep_memory, keep_turns = len(memory_lines.lines), len(turns.lines)
+        last_turn = None
+        if self.max_tokens is not None:
+            keep_memory, keep_turns, last_turn = self._fit(fixed, memory_lines, turns)
+
+        parts = []
+        if system_line is not None:
+            parts.append(system_line)
+        sections = {"system": estimate_tokens(system_line or ""), "memory": 0, "conversation": 0}
+
+        omitted_memory = len(memory_lines.lines) - keep_memory
+        if keep_memory or omitted_memory:
+            parts.append("Context:")
+            if omitted_memory:
+                parts.append(f"- [{omitted_memory} earlier items omitted]")
+            start = len(memory_lines.lines) - keep_memory
+            parts.extend(memory_lines.lines[start:])
+            parts.append("")  # Empty line
+            sections["memory"] = sum(memory_lines.tokens[start:])
+
+        omitted_turns = len(turns.lines) - keep_turns
+        if turns.lines:
+            parts.append("Conversation:")
+            if omitted_turns:
+                parts.append(f"[{omitted_turns} earlier messages omitted]")
+            start = len(turns.lines) - keep_turns
+            kept = turns.lines[start:]
+            if last_turn is not None:
+                kept[-1] = last_turn
+            parts.extend(kept)
+            parts.append("")  # Empty line
+            if not start and last_turn is None:
+                sections["conversation"] = turns.total
+            else:
+                sections["conversation"] = sum(turns.tokens[start:-1]) + estimate_tokens(kept[-1])
+
+        if task_line is not None:
+            parts.append(task_line)
+        sections["task"] = estimate_tokens(task_line or "")
+
+        for section, tokens in sections.items():
+            _observed[section].observe(tokens)
+        if omitted_turns:
+            _omitted_turns.inc(omitted_turns)
+        if omitted_memory:
+            _omitted_memory.inc(omitted_memory)
+        return BuiltPrompt("\n".join(parts), sections, omitted_turns, omitted_memory)
+
+    def _fit(self, fixed: int, memory: _Lines, turns: _RenderedTurns) -> Tuple[int, int, Optional[str]]:
+        """
+        Work out how many of the newest memory items and turns fit the budget.
+
+        Returns:
+            (memory items kept, turns kept, replacement text for the latest
+            turn if it had to be shortened, else None)
+        """
+        budget = self.max_tokens - fixed
+        memory_total = memory.total
+        if memory_total + turns.total <= budget:
+            return len(memory.lines), len(turns.lines), None
+
+        # Newest turns first, keeping at least the latest one
+        keep_turns, used = 0, 0
+        for tokens in reversed(turns.tokens):
+            if keep_turns and used + tokens > budget - memory_total:
+                break
+            keep_turns += 1
+            used += tokens
+
+        # Then as many of the newest memory items as still fit
+        keep_memory, memory_used = 0, 0
+        for tokens in reversed(memory.tokens):
+            if memory_used + tokens > budget - used:
+                break
+            keep_memory += 1
+            memory_used += tokens
+
+        last_turn = None
+        if turns.lines and used > budget:
+            # Even the latest turn alone is over budget: keep the end of its content
+            role, content = turns.turns[-1]
+            prefix = f"{role}: "
+            chars = max(0, budget * 4 - 1 - len(prefix))  # estimate_tokens() rounds up
+            last_turn = prefix + (content[-chars:] if chars else "")
+        return keep_memory, keep_turns, last_turn
+
+    def _render_memory(self, system: str, memory: List[str]) -> _Lines:
+        key = hashlib.sha256("\0".join([system, *memory]).encode()).hexdigest()
+        rendered = self._memory.get(key)
+        if rendered is not None:
+            self._memory.move_to_end(key)
+            return rendered
+        rendered = _Lines()
+        for item in memory:
+            rendered.append(f"- {item}")
+        self._remember(self._memory, key, rendered)
+        return rendered
+
+    def _render_conversation(
+        self, mcp_package: Dict[str, Any], conversation: List[Dict[str, Any]]
+    ) -> _Lines:
+        # Threads are identified by their id when the sender sets one,
+        # otherwise by their opening message
+        key = str(mcp_package.get("conversation_id") or _turn(conversation[0]))
+        cached = self._conversations.get(key)
+        count = len(conversation)
+        if cached is not None and _same_turns(conversation, cached.turns):
+            if len(cached.turns) > count:
+                return cached.head(count)  # An earlier package of the thread
+            # The thread grew (or was redelivered): render only the new
+            # turns, onto the cached lists. build() reads them before any
+            # other package can extend them.
+            for message in conversation[len(cached.turns):]:
+                cached.add(*_turn(message))
+            self._conversations.move_to_end(key)
+            return cached
+
+        rendered = _RenderedTurns()
+        for message in conversation:
+            rendered.add(*_turn(message))
+        self._remember(self._conversations, key, rendered)
+        return rendered
+
+    def _remember(self, cache: "OrderedDict[str, Any]", key: str, value: Any) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
@@ -1,10 +1,12 @@
 from fastapi import FastAPI, HTTPException
 import uvicorn
-from config import APP_C_PORT
+from config import APP_C_PORT, MCP_SERVER_URL
+from common.http_client import client_lifespan
+from common.metrics import metrics_response
 from app_c.mcp_handler import send_mcp_to_server, poll_mcp_server
 import traceback
 
-app = FastAPI()
+app = FastAPI(lifespan=client_lifespan(MCP_SERVER_URL))
 
 @app.get("/status")
 async def status():
@@ -19,11 +21,16 @@ async def status():
         ]
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: MCP call latencies and errors."""
+    return metrics_response()
+
 @app.get("/messages")
-async def get_messages():
-    """Poll MCP server for messages intended for App C."""
+async def get_messages(wait: float = 0):
+    """Poll MCP server for messages intended for App C, optionally long-polling."""
     try:
-        response = poll_mcp_server()
+        response = await poll_mcp_server(wait)
         return response
     except Exception as e:
         traceback.print_exc()
@@ -1,27 +1,77 @@
-import requests
-from typing import Dict, Any, List, Optional
-from config import MCP_SERVER_URL, MCP_RECEIVE_CONTEXT_ENDPOINT
+import httpx
+from typing import Dict, Any, AsyncIterator, List, Optional
+from common.batching import BatchItemError, BufferedSender
+from common.codec import accept_headers, decode_response, encode_request
+from common.http_client import STREAM_TIMEOUT, get_client, long_poll_timeout, post_with_backoff
+from common.mcp_package import ConversationDeltas, MCPPackage, UnknownConversation
+from common.metrics import MCP_CLIENT_ERRORS, MCP_CLIENT_SECONDS, timed
+from common.sse import aiter_events
+from config import (
+    MCP_SERVER_URL, MCP_RECEIVE_CONTEXT_ENDPOINT, MCP_SUBSCRIBE_ENDPOINT,
+    MCP_BATCH_SUFFIX, MCP_SEND_BATCH_SIZE, MCP_SEND_BATCH_DELAY, MCP_WIRE_FORMAT,
+    MCP_SEND_DELTA_CONVERSATIONS
+)
 
-def poll_mcp_server() -> Dict[str, Any]:
+@timed(MCP_CLIENT_SECONDS, MCP_CLIENT_ERRORS, "AppC", "poll")
+async def poll_mcp_server(wait: float = 0) -> Dict[str, Any]:
     """
     Poll MCP server for messages intended for App C.
     
+    Args:
+        wait: Seconds the server may hold the request open while the inbox
+            is empty (long-poll). 0 returns immediately.
+    
     Returns:
         Dict containing any messages from the server
     """
     try:
-        response = requests.post(f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppC")
+        params = {"wait": wait} if wait else None
+        client = get_client(MCP_SERVER_URL)
+        response = await client.post(
+            f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppC",
+            params=params,
+            headers=accept_headers(MCP_WIRE_FORMAT),
+            timeout=long_poll_timeout(client, wait)
+        )
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return decode_response(response)
+    except httpx.HTTPError as e:
         raise Exception(f"Failed to poll MCP server: {str(e)}")
 
-def send_mcp_to_server(mcp_package: Dict[str, Any], target_app: str = None) -> Dict[str, Any]:
+
+async def subscribe_mcp_server(max_events: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Hold one streaming connection to the MCP server and yield messages intended for App C
+    as they are routed, instead of issuing a request per poll.
+    
+    Args:
+        max_events: Optional number of messages after which the server closes the stream
+        
+    Yields:
+        Each MCP package pushed by the server
+    """
+    params = {"max_events": max_events} if max_events else None
+    try:
+        async with get_client(MCP_SERVER_URL).stream(
+            "GET",
+            f"{MCP_SERVER_URL}{MCP_SUBSCRIBE_ENDPOINT}/AppC",
+            params=params,
+            timeout=STREAM_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            async for event in aiter_events(response.aiter_lines()):
+                yield event
+    except httpx.HTTPError as e:
+        raise Exception(f"MCP server subscription failed: {str(e)}")
+
+@timed(MCP_CLIENT_SECONDS, MCP_CLIENT_ERRORS, "AppC", "send")
+async def send_mcp_to_server(mcp_package: Dict[str, Any], target_app: str = None) -> Dict[str, Any]:
     """
     Send MCP package to the MCP server, optionally targeting a specific app.
     
     Args:
-        mcp_package: The MCP package to send
+        mcp_package: The MCP package to send; one continuing a conversation
+            goes as a delta of the last package sent for it
         target_app: Optional target app (e.g., "AppA", "AppB")
         
     Returns:
@@ -30,20 +80,88 @@ def send_mcp_to_server(mcp_package: Dict[str, Any], target_app: str = None) -> D
     if target_app:
         mcp_package["target_app"] = target_app
 
+    return await conversations.send(mcp_package, _post_package)
+
+
+async def _post_package(mcp_package: Dict[str, Any]) -> Dict[str, Any]:
     try:
-        response = requests.post(
-            f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppC", 
-            json=mcp_package
+        response = await post_with_backoff(
+            f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppC",
+            **encode_request(mcp_package, MCP_WIRE_FORMAT)
         )
+        if response.status_code == 409:
+            raise UnknownConversation(response.json()["error"])
         response.raise_for_status()
         return response.json()
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
+        raise Exception(f"Failed to send MCP package: {str(e)}")
+
+
+@timed(MCP_CLIENT_SECONDS, MCP_CLIENT_ERRORS, "AppC", "send_batch")
+async def send_mcp_batch_to_server(mcp_packages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Send several MCP packages to the MCP server in one request.
+    
+    Args:
+        mcp_packages: The MCP packages to send
+        
+    Returns:
+        One status dict per package, in order
+    """
+    try:
+        response = await post_with_backoff(
+            f"{MCP_SERVER_URL}{MCP_RECEIVE_CONTEXT_ENDPOINT}/AppC{MCP_BATCH_SUFFIX}",
+            **encode_request(mcp_packages, MCP_WIRE_FORMAT)
+        )
+        response.raise_for_status()
+        return response.json()["results"]
+    except httpx.HTTPError as e:
+        raise Exception(f"Failed to send MCP packages: {str(e)}")
+
+
+_buffered_sender = BufferedSender(
+    send_mcp_batch_to_server, MCP_SEND_BATCH_SIZE, MCP_SEND_BATCH_DELAY
+)
+
+# Last package sent per conversation; later packages of one go as deltas
+conversations = ConversationDeltas(MCP_SEND_DELTA_CONVERSATIONS)
+
+
+async def _send_buffered(mcp_package: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return await _buffered_sender.send(mcp_package)
+    except BatchItemError as e:
+        if e.status_code == 409:
+            raise UnknownConversation(str(e))
+        raise
+
+
+async def send_mcp_buffered(mcp_package: Dict[str, Any], target_app: str = None) -> Dict[str, Any]:
+    """
+    Send an MCP package through the buffered sender, which coalesces packages
+    sent within a short window into a single batch request.
+    
+    Args:
+        mcp_package: The MCP package to send; one continuing a conversation
+            goes as a delta of the last package sent for it
+        target_app: Optional target app (e.g., "AppA", "AppB")
+        
+    Returns:
+        Dict with status of the operation
+    """
+    if target_app:
+        mcp_package["target_app"] = target_app
+
+    try:
+        return await conversations.send(mcp_package, _send_buffered)
+    except Exception as e:
         raise Exception(f"Failed to send MCP package: {str(e)}")
 
 def build_mcp_package(
     message: Dict[str, Any],
     target_app: Optional[str] = None,
-    analysis: Optional[Dict[str, Any]] = None
+    analysis: Optional[Dict[str, Any]] = None,
+    conversation_id: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Build an MCP package with App C specific analytics/monitoring data.
@@ -52,17 +170,15 @@ def build_mcp_package(
         message: The base message to process
         target_app: Optional target app for the message
         analysis: Optional analysis results to include
+        conversation_id: Optional id of the conversation the package continues
         
     Returns:
         Dict containing the MCP package
     """
-    mcp_package = {
-        "source_app": "AppC",
-        "message": message,
-        "analysis": analysis or {},
-    }
-
-    if target_app:
-        mcp_package["target_app"] = target_app
-
-    return mcp_package
+    return MCPPackage(
+        source_app="AppC",
+        target_app=target_app,
+        conversation_id=conversation_id,
+        # Analytics traffic yields to customer mail in the recipients' inboxes
+        extra={"message": message, "analysis": analysis or {}, "priority": "low"}
+    ).to_dict()
@@ -0,0 +1 @@
+# Helpers shared by the MCP server and the apps
@@ -0,0 +1,108 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# Sends a batch of items and returns one result per item, in order. A result
+# with an "error" key fails that item only.
+BatchSendFn = Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]
+
+# Size of one item, counted against a batch's max_weight
+WeighFn = Callable[[Dict[str, Any]], int]
+
+
+class BatchItemError(Exception):
+    """Raised for one item of a batch whose result has an error."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class BufferedSender:
+    """
+    Coalesce individually submitted items into batched sends.
+
+    Items are held until max_batch have accumulated or max_delay seconds have
+    passed since the first one arrived, whichever comes first, and then sent
+    with a single call to send_batch. Each submitter awaits the result for its
+    own item. With max_weight, batches are also kept to that total `weigh`
+    of their items (an item heavier than that is sent on its own).
+    """
+
+    def __init__(
+        self,
+        send_batch: BatchSendFn,
+        max_batch: int,
+        max_delay: float,
+        max_weight: Optional[int] = None,
+        weigh: Optional[WeighFn] = None
+    ):
+        self.send_batch = send_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self._weight = 0
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight: Set[asyncio.Task] = set()
+
+    async def send(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Queue an item for the next batch and wait for its result.
+
+        Raises:
+            BatchItemError: If the item's result has an error
+            Exception: If the batch failed
+        """
+        loop = asyncio.get_running_loop()
+        result = loop.create_future()
+        weighed = self.max_weight is not None and self.weigh is not None
+        weight = self.weigh(item) if weighed else 0
+        if weighed and self._pending and self._weight + weight > self.max_weight:
+            self._flush()  # This item would push the batch over max_weight
+        self._pending.append((item, result))
+        self._weight += weight
+        if len(self._pending) >= self.max_batch or (weighed and self._weight >= self.max_weight):
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await result
+
+    async def flush(self) -> None:
+        """Send whatever is pending now and wait for all sends to finish."""
+        self._flush()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        self._weight = 0
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        try:
+            results = await self.send_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, result in batch:
+                if not result.done():
+                    result.set_exception(e)
+            return
+
+        for index, (_, result) in enumerate(batch):
+            if result.done():
+                continue
+            if index >= len(results):
+                result.set_exception(Exception("No result returned for batched item"))
+            elif "error" in results[index]:
+                result.set_exception(
+                    BatchItemError(results[index]["error"], results[index].get("status_code"))
+                )
+            else:
+                result.set_result(results[index])
@@ -0,0 +1,192 @@
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+# JSON backend, fastest available first: orjson, then msgspec, then the
+# standard library. All three produce compact UTF-8 JSON.
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - depends on the environment
+    msgspec = None
+
+# MessagePack is optional; without it only JSON is spoken
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+MSGPACK_CONTENT_TYPES = (MSGPACK_CONTENT_TYPE, "application/x-msgpack")
+
+# Wire formats an app may use to talk to the MCP server
+WIRE_JSON = "json"
+WIRE_MSGPACK = "msgpack"
+WIRE_FORMATS = (WIRE_JSON, WIRE_MSGPACK)
+
+if orjson is not None:
+    JSON_BACKEND = "orjson"
+elif msgspec is not None:
+    JSON_BACKEND = "msgspec"
+else:
+    JSON_BACKEND = "json"
+
+
+def _stdlib_dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), default=default).encode()
+
+
+def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """
+    Encode `obj` as compact JSON bytes.
+
+    Args:
+        obj: JSON-serializable value
+        default: Called for values the encoder does not support
+
+    Returns:
+        UTF-8 encoded JSON without insignificant whitespace
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=default)
+        except TypeError:
+            # orjson refuses what the standard library accepts (non-str keys,
+            # integers beyond 64 bits); keep the old behaviour for those
+            return _stdlib_dumps(obj, default)
+    if msgspec is not None:
+        try:
+            return msgspec.json.encode(obj, enc_hook=default)
+        except (TypeError, msgspec.EncodeError):
+            return _stdlib_dumps(obj, default)
+    return _stdlib_dumps(obj, default)
+
+
+def loads(data: Any) -> Any:
+    """
+    Decode JSON from bytes or str.
+
+    Raises:
+        ValueError: If `data` is not valid JSON
+    """
+    if orjson is not None:
+        return orjson.loads(data)  # orjson.JSONDecodeError is a ValueError
+    if msgspec is not None:
+        try:
+            return msgspec.json.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    return json.loads(data)
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def pack(obj: Any) -> bytes:
+    """
+    Encode `obj` as MessagePack.
+
+    Raises:
+        RuntimeError: If msgpack is not installed
+    """
+    if msgpack is None:
+        raise RuntimeError("MessagePack support requires the msgpack package")
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def unpack(data: bytes) -> Any:
+    """
+    Decode one MessagePack value.
+
+    Raises:
+        ValueError: If `data` is not a single valid MessagePack value
+        RuntimeError: If msgpack is not installed
+    """
+    if msgpack is None:
+        raise RuntimeError("MessagePack support requires the msgpack package")
+    try:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Invalid MessagePack data: {e}") from e
+
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    """Whether a Content-Type or Accept header asks for MessagePack."""
+    if not content_type:
+        return False
+    return any(media_type in content_type for media_type in MSGPACK_CONTENT_TYPES)
+
+
+def decode_body(body: bytes, content_type: Optional[str]) -> Any:
+    """
+    Decode a request or response body by its Content-Type: MessagePack when
+    it says so, JSON otherwise.
+
+    Raises:
+        ValueError: If the body does not decode
+    """
+    if is_msgpack(content_type):
+        if msgpack is None:
+            raise ValueError("MessagePack is not supported by this server")
+        return unpack(body)
+    return loads(body)
+
+
+def reusable_payload(body: bytes) -> Optional[bytes]:
+    """
+    Return a JSON body that has already been decoded as something the inbox
+    can store verbatim, so it is not re-encoded: it must be UTF-8 and on one
+    line. None means the caller should re-encode the decoded value instead.
+    """
+    body = body.strip()
+    if b"\n" in body or b"\r" in body:
+        return None
+    try:
+        body.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    return body
+
+
+def splice_messages(payloads: List[bytes], fields: Optional[Dict[str, Any]] = None) -> bytes:
+    """
+    Build a JSON object {"messages": [...], **fields} around already-encoded
+    message payloads, without decoding and re-encoding them.
+
+    Args:
+        payloads: JSON-encoded messages, in order
+        fields: Other members of the object
+
+    Returns:
+        The encoded JSON object
+    """
+    messages = b'{"messages":[' + b",".join(payloads) + b"]"
+    if not fields:
+        return messages + b"}"
+    return messages + b"," + dumps(fields)[1:]
+
+
+def encode_request(obj: Any, wire_format: str = WIRE_JSON) -> Dict[str, Any]:
+    """httpx request arguments carrying `obj` in the given wire format."""
+    if wire_format == WIRE_MSGPACK:
+        return {"content": pack(obj), "headers": {"Content-Type": MSGPACK_CONTENT_TYPE}}
+    return {"content": dumps(obj), "headers": {"Content-Type": JSON_CONTENT_TYPE}}
+
+
+def accept_headers(wire_format: str = WIRE_JSON) -> Optional[Dict[str, str]]:
+    """Headers asking for responses in the given wire format (None for JSON)."""
+    if wire_format == WIRE_MSGPACK:
+        return {"Accept": MSGPACK_CONTENT_TYPE}
+    return None
+
+
+def decode_response(response: Any) -> Any:
+    """Decode an httpx response body by its Content-Type."""
+    return decode_body(response.content, response.headers.get("content-type"))
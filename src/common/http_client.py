@@ -0,0 +1,164 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+import httpx
+from config import (
+    HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+    HTTP_WRITE_TIMEOUT, HTTP_POOL_TIMEOUT, MCP_SEND_MAX_RETRIES,
+    MCP_SEND_BACKOFF_BASE, MCP_SEND_BACKOFF_MAX
+)
+
+# Extra seconds on top of a long-poll wait before the client gives up
+LONG_POLL_TIMEOUT_MARGIN = 5.0
+
+# Streaming responses (SSE subscriptions) may stay idle between events
+STREAM_TIMEOUT = httpx.Timeout(HTTP_CONNECT_TIMEOUT, read=None)
+
+# One pooled client per upstream host (scheme://host:port), remembered with
+# the event loop it was created on since its connections belong to that loop
+_clients: Dict[str, Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+
+# Statuses with which a server asks the sender to come back later
+RETRY_STATUSES = (429, 503)
+
+# Per host, the monotonic time before which sends hold off after a 429/503
+_not_before: Dict[str, float] = {}
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(
+            connect=HTTP_CONNECT_TIMEOUT,
+            read=HTTP_READ_TIMEOUT,
+            write=HTTP_WRITE_TIMEOUT,
+            pool=HTTP_POOL_TIMEOUT
+        )
+    )
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """
+    Return the shared keep-alive client for the host of `url`.
+
+    Each host gets its own connection pool, so the connection limit applies
+    per upstream. Clients are normally created by the app lifespan; one is
+    created on first use otherwise (e.g. when the lifespan did not run).
+
+    Args:
+        url: Any URL on the target host
+
+    Returns:
+        The pooled httpx.AsyncClient for that host
+    """
+    key = _host_key(url)
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(key)
+    if entry is None or entry[0] is not loop:
+        entry = (loop, _new_client())
+        _clients[key] = entry
+    return entry[1]
+
+
+def long_poll_timeout(client: httpx.AsyncClient, wait: float) -> httpx.Timeout:
+    """The client's timeouts, with the read timeout stretched to cover a long-poll."""
+    timeout = client.timeout
+    if not wait:
+        return timeout
+    return httpx.Timeout(
+        connect=timeout.connect,
+        read=max(timeout.read or 0, wait + LONG_POLL_TIMEOUT_MARGIN),
+        write=timeout.write,
+        pool=timeout.pool
+    )
+
+
+def retry_delay(
+    response: Optional[httpx.Response],
+    attempt: int,
+    base: float = MCP_SEND_BACKOFF_BASE,
+    maximum: float = MCP_SEND_BACKOFF_MAX
+) -> float:
+    """
+    Seconds to wait before retrying a refused or failed request: the
+    response's Retry-After (in seconds) if it has one, else a jittered
+    exponential backoff of up to `base` * 2**attempt (attempt 0 being the
+    first retry), capped at `maximum`.
+    """
+    delay: Optional[float] = None
+    if response is not None:
+        try:
+            delay = float(response.headers["retry-after"])
+        except (KeyError, ValueError):
+            pass
+    if delay is None:
+        delay = random.uniform(0, base * 2 ** attempt)
+    return min(max(delay, 0.0), maximum)
+
+
+async def post_with_backoff(url: str, **kwargs: Any) -> httpx.Response:
+    """
+    POST on the shared client, retrying while the server answers 429 or 503.
+
+    Each refusal also holds back the process's other sends to that host for
+    the same delay, so a busy server sees the producer slow down as a whole
+    rather than every send retrying on its own schedule.
+
+    Args:
+        url: The URL to post to
+        **kwargs: Passed to httpx.AsyncClient.post
+
+    Returns:
+        The last response; a 429/503 only once MCP_SEND_MAX_RETRIES retries
+        have been used up
+    """
+    key = _host_key(url)
+    attempt = 0
+    while True:
+        pause = _not_before.get(key, 0.0) - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        response = await get_client(url).post(url, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt >= MCP_SEND_MAX_RETRIES:
+            return response
+        resume = time.monotonic() + retry_delay(response, attempt)
+        _not_before[key] = max(_not_before.get(key, 0.0), resume)
+        attempt += 1
+
+
+async def close_clients() -> None:
+    """Close every pooled client owned by the running event loop."""
+    loop = asyncio.get_running_loop()
+    for key, (client_loop, client) in list(_clients.items()):
+        if client_loop is loop:
+            del _clients[key]
+            await client.aclose()
+
+
+def client_lifespan(*urls: str) -> Callable:
+    """
+    Build a FastAPI lifespan that opens the pooled clients for `urls` on
+    startup and closes them on shutdown. Empty URLs (e.g. of an in-process
+    LLM provider) are skipped.
+    """
+    @asynccontextmanager
+    async def lifespan(app):
+        for url in filter(None, urls):
+            get_client(url)
+        yield
+        await close_clients()
+
+    return lifespan
@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Expired and excess rows are purged from the SQLite tier every this many writes
+DB_TRIM_INTERVAL = 64
+
+
+class CallAbandoned(Exception):
+    """
+    Set on a shared in-flight call whose caller was cancelled, so the
+    callers waiting on it make the call themselves instead of being
+    cancelled too.
+    """
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Canonical form of a prompt: NFC text with whitespace runs collapsed."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", prompt)).strip()
+
+
+def cache_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_prompt(prompt)}".encode()).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier cache of LLM completions keyed on model + normalized prompt.
+
+    The memory tier is an LRU of at most max_entries completions. When
+    db_path is set, completions are also written to a SQLite file that
+    survives restarts and is trimmed to max_db_entries (least recently used
+    first). Entries in both tiers expire after ttl seconds.
+
+    The SQLite tier never runs on the event loop: lookups run on a single
+    database thread, and writes and last-used updates are queued and
+    committed there in batches, so one commit covers every change made while
+    the previous one was in progress.
+
+    get_or_call() also collapses concurrent misses for the same key into a
+    single upstream call. If the caller making that call is cancelled, the
+    others waiting on it retry rather than being cancelled with it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        db_path: Optional[str] = None,
+        max_db_entries: int = 100000
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_db_entries = max_db_entries
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = None
+        self._db_thread: Optional[ThreadPoolExecutor] = None
+        self._disk_entries = 0
+        self._writes_since_trim = 0
+        # Changes waiting for the database thread, guarded by _pending_lock
+        self._pending_lock = threading.Lock()
+        self._pending_writes: Dict[str, Tuple[str, float, float]] = {}  # key -> (value, expires_at, last_used)
+        self._pending_touches: Dict[str, float] = {}  # key -> last_used
+        self._flush_queued = False
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.commit()
+            self._disk_entries = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            self._db_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache-db")
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._memory[key]
+
+        if self._db is not None:
+            row = await asyncio.get_running_loop().run_in_executor(self._db_thread, self._db_get, key)
+            if row is not None and row[1] > now:
+                self._queue_changes(touches={key: now})
+                self._remember(key, row[1], row[0])
+                self.hits += 1
+                self.disk_hits += 1
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, expires_at, value)
+        if self._db is not None:
+            self._queue_changes(writes={key: (value, expires_at, now)})
+
+    def flush(self) -> None:
+        """Block until queued changes are committed to the SQLite tier (for shutdown and tests)."""
+        if self._db_thread is not None:
+            self._db_thread.submit(self._commit_pending).result()
+
+    async def get_or_call(
+        self, model: str, prompt: str, call: Callable[[], Awaitable[str]]
+    ) -> str:
+        """
+        Return the cached completion for (model, prompt), or await `call` to
+        produce it. Failures are not cached.
+        """
+        key = cache_key(model, prompt)
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        loop = asyncio.get_running_loop()
+        pending = self._in_flight.get(key)
+        while pending is not None and pending.get_loop() is loop:
+            try:
+                return await asyncio.shield(pending)
+            except CallAbandoned:
+                # Its caller was cancelled; follow a newer call or make one
+                pending = self._in_flight.get(key)
+
+        pending = loop.create_future()
+        self._in_flight[key] = pending
+        try:
+            value = await call()
+        except asyncio.CancelledError:
+            if self._in_flight.get(key) is pending:
+                del self._in_flight[key]
+            pending.set_exception(CallAbandoned())
+            pending.exception()  # Mark retrieved when nobody else was waiting
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            pending.exception()  # Mark retrieved when nobody else was waiting
+            raise
+        else:
+            self.set(key, value)
+            pending.set_result(value)
+            return value
+        finally:
+            if self._in_flight.get(key) is pending:
+                del self._in_flight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory)
+        }
+        if self._db is not None:
+            stats["disk_entries"] = self._disk_entries  # As of the last commit
+        return stats
+
+    def _remember(self, key: str, expires_at: float, value: str) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _queue_changes(
+        self,
+        writes: Optional[Dict[str, Tuple[str, float, float]]] = None,
+        touches: Optional[Dict[str, float]] = None
+    ) -> None:
+        """Queue changes for the database thread, scheduling a commit if none is queued."""
+        with self._pending_lock:
+            if writes:
+                self._pending_writes.update(writes)
+            if touches:
+                self._pending_touches.update(touches)
+            if self._flush_queued:
+                return
+            self._flush_queued = True
+        self._db_thread.submit(self._commit_pending)
+
+    def _db_get(self, key: str) -> Optional[Tuple[str, float]]:
+        """Look a key up on the database thread, changes not yet committed first."""
+        with self._pending_lock:
+            pending = self._pending_writes.get(key)
+        if pending is not None:
+            return pending[0], pending[1]
+        return self._db.execute(
+            "SELECT value, expires_at FROM completions WHERE key = ?", (key,)
+        ).fetchone()
+
+    def _commit_pending(self) -> None:
+        """Write the queued changes in one transaction (database thread)."""
+        with self._pending_lock:
+            writes, self._pending_writes = self._pending_writes, {}
+            touches, self._pending_touches = self._pending_touches, {}
+            self._flush_queued = False
+        if not writes and not touches:
+            return
+        now = time.time()
+        if writes:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                [(key, value, expires_at, used) for key, (value, expires_at, used) in writes.items()]
+            )
+            self._writes_since_trim += len(writes)
+        if touches:
+            self._db.executemany(
+                "UPDATE completions SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in touches.items() if key not in writes]
+            )
+        if self._writes_since_trim >= DB_TRIM_INTERVAL:
+            self._trim_db(now)
+        self._db.commit()
+        self._disk_entries = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def _trim_db(self, now: float) -> None:
+        self._writes_since_trim = 0
+        self._db.execute("DELETE FROM completions WHERE expires_at <= ?", (now,))
+        excess = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0] - self.max_db_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM completions WHERE key IN "
+                "(SELECT key FROM completions ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+            self.evictions += excess
@@ -0,0 +1,508 @@
+import asyncio
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple, Type
+import httpx
+from dotenv import load_dotenv
+from common.http_client import get_client, retry_delay
+from common.llm_cache import LLMCache, cache_key
+from common.metrics import (
+    LLM_CIRCUIT_REJECTED, LLM_CIRCUIT_STATE, LLM_ERRORS, LLM_FIRST_TOKEN_SECONDS,
+    LLM_HEDGES, LLM_RETRIES, LLM_SECONDS, timed, timed_stream
+)
+from common.resilience import CircuitBreaker, CircuitOpenError, LatencyWindow, hedge
+from common.sse import aiter_raw_events
+from common.tokens import estimate_tokens
+from config import (
+    LLM_STUB_LATENCY_MS, LLM_STUB_JITTER_MS, LLM_STUB_TOKENS_PER_SECOND,
+    LLM_STUB_FAILURE_RATE, LLM_STUB_SEED, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT,
+    LLM_MAX_RETRIES, LLM_RETRY_BACKOFF_BASE, LLM_RETRY_BACKOFF_MAX,
+    LLM_HEDGE_ENABLED, LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_SAMPLES,
+    LLM_LATENCY_WINDOW, LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS,
+    LLM_CACHE_ENABLED, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS,
+    LLM_CACHE_DB_PATH, LLM_CACHE_DB_MAX_ENTRIES
+)
+
+# Characters of the prompt echoed back in each stub completion
+STUB_ECHO_CHARS = 400
+
+# Timeouts of each LLM API request, in place of the shared client's defaults
+LLM_TIMEOUT = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+class ProviderError(RuntimeError):
+    """
+    Raised when an LLM API request fails. `retryable` failures (timeouts,
+    connection errors, 429 and 5xx answers) may succeed when retried and
+    count against the provider's circuit breaker.
+    """
+
+    def __init__(self, message: str, retryable: bool = False, response: Optional[httpx.Response] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.response = response
+
+
+class LLMProvider:
+    """
+    One chat completion API: how to address it, build requests and read
+    completions and token streams back.
+
+    complete() and stream() are timed in the llm_* metrics under the
+    provider's name and model. Both retry retryable failures up to
+    LLM_MAX_RETRIES times and fail fast with CircuitOpenError while the
+    provider's circuit breaker is open; with `hedging` on, a completion
+    slower than the recent LLM_HEDGE_QUANTILE latency is requested twice.
+    Subclasses implement the request and response shapes of their API.
+    """
+
+    name = ""
+    title = ""  # For error messages
+
+    def __init__(self, url: str, api_key: Optional[str], model: str, max_tokens: Optional[int] = None):
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.max_tokens = max_tokens
+        self.complete = timed(LLM_SECONDS, LLM_ERRORS, self.name, model)(self._complete)
+        self.stream = timed_stream(
+            LLM_SECONDS, LLM_FIRST_TOKEN_SECONDS, LLM_ERRORS, self.name, model
+        )(self._stream)
+        self.hedging = LLM_HEDGE_ENABLED
+        self.breaker = CircuitBreaker(
+            LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS, LLM_CIRCUIT_STATE.labels(self.name)
+        )
+        self.latencies = LatencyWindow(LLM_LATENCY_WINDOW)
+        self._retries = LLM_RETRIES.labels(self.name)
+        self._rejected = LLM_CIRCUIT_REJECTED.labels(self.name)
+        self._hedges_sent = LLM_HEDGES.labels(self.name, "sent")
+        self._hedges_won = LLM_HEDGES.labels(self.name, "won")
+
+    @classmethod
+    def from_env(cls, max_tokens: Optional[int] = None) -> "LLMProvider":
+        """
+        The provider as configured by environment variables.
+
+        Args:
+            max_tokens: Completion length limit sent with each request
+        """
+        raise NotImplementedError
+
+    def headers(self) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def request_body(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def parse_completion(self, data: Dict[str, Any]) -> str:
+        """The completion text of a non-streamed response body."""
+        raise NotImplementedError
+
+    def parse_stream_event(self, event_type: Optional[str], data: str) -> Tuple[Optional[str], bool]:
+        """
+        Read one SSE event of a streamed response.
+
+        Returns:
+            (the text it carries if any, whether it ends the stream)
+
+        Raises:
+            ProviderError: If the event reports an error
+        """
+        raise NotImplementedError
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which a completion is hedged, or None to not hedge it."""
+        if not self.hedging or len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return self.latencies.quantile(LLM_HEDGE_QUANTILE)
+
+    def _error(self, error: httpx.HTTPError) -> ProviderError:
+        response = error.response if isinstance(error, httpx.HTTPStatusError) else None
+        if response is not None:
+            retryable = response.status_code == 429 or response.status_code >= 500
+        else:
+            retryable = isinstance(error, httpx.TransportError)  # Timeouts and connection errors
+        return ProviderError(f"{self.title} API request failed: {str(error)}", retryable, response)
+
+    def _admit(self) -> None:
+        """
+        Raises:
+            CircuitOpenError: If the circuit breaker refuses calls right now
+        """
+        if not self.breaker.allow():
+            self._rejected.inc()
+            raise CircuitOpenError(
+                f"{self.title} API is failing; circuit breaker open", self.breaker.retry_after()
+            )
+
+    def _record(self, error: ProviderError) -> None:
+        # Only failures that say the provider is unhealthy trip the breaker;
+        # e.g. a 400 is still an answer
+        if error.retryable:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    async def _retry_pause(self, error: ProviderError, attempt: int) -> None:
+        """
+        Sleep before retrying `error`, or re-raise it when out of retries.
+        """
+        if not error.retryable or attempt >= LLM_MAX_RETRIES:
+            raise error
+        self._retries.inc()
+        await asyncio.sleep(retry_delay(
+            error.response, attempt, LLM_RETRY_BACKOFF_BASE, LLM_RETRY_BACKOFF_MAX
+        ))
+
+    async def _request(self, prompt: str) -> str:
+        """One completion request, its latency recorded for hedging."""
+        started = time.perf_counter()
+        text = await self._send(prompt)
+        self.latencies.add(time.perf_counter() - started)
+        return text
+
+    async def _complete(self, prompt: str) -> str:
+        attempt = 0
+        while True:
+            self._admit()
+            try:
+                delay = self.hedge_delay()
+                if delay is None:
+                    text = await self._request(prompt)
+                else:
+                    text, hedged = await hedge(lambda: self._request(prompt), delay)
+                    self._hedges_sent.inc()
+                    if hedged:
+                        self._hedges_won.inc()
+                self.breaker.record_success()
+                return text
+            except ProviderError as e:
+                self._record(e)
+                await self._retry_pause(e, attempt)
+            attempt += 1
+
+    async def _stream(self, prompt: str) -> AsyncIterator[str]:
+        # Retried only until the first chunk; after that the caller has
+        # already consumed part of the answer
+        attempt = 0
+        while True:
+            self._admit()
+            started = False
+            try:
+                async for text in self._send_stream(prompt):
+                    started = True
+                    yield text
+                self.breaker.record_success()
+                return
+            except ProviderError as e:
+                self._record(e)
+                if started:
+                    raise
+                await self._retry_pause(e, attempt)
+            attempt += 1
+
+    async def _send(self, prompt: str) -> str:
+        try:
+            response = await get_client(self.url).post(
+                self.url, headers=self.headers(), json=self.request_body(prompt), timeout=LLM_TIMEOUT
+            )
+            response.raise_for_status()  # Raise an exception for bad status codes
+            return self.parse_completion(response.json())
+        except httpx.HTTPError as e:
+            raise self._error(e)
+
+    async def _send_stream(self, prompt: str) -> AsyncIterator[str]:
+        headers = self.headers()
+        data = self.request_body(prompt, stream=True)
+        client = get_client(self.url)
+        try:
+            async with client.stream("POST", self.url, headers=headers, json=data, timeout=LLM_TIMEOUT) as response:
+                response.raise_for_status()
+                async for event_type, event in aiter_raw_events(response.aiter_lines()):
+                    text, done = self.parse_stream_event(event_type, event)
+                    if done:
+                        break
+                    if text:
+                        yield text
+        except httpx.HTTPError as e:
+            raise self._error(e)
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI chat completions (/v1/chat/completions)."""
+
+    name = "openai"
+    title = "OpenAI"
+
+    @classmethod
+    def from_env(cls, max_tokens: Optional[int] = None) -> "OpenAIProvider":
+        return cls(
+            # Overridable so benchmarks can point the apps at a stub server
+            os.getenv("OPENAI_CHAT_URL", "https://api.openai.com/v1/chat/completions"),
+            os.getenv("OPENAI_API_KEY"),
+            "gpt-4-turbo",
+            max_tokens=max_tokens
+        )
+
+    def headers(self) -> Dict[str, str]:
+        if self.api_key == "your_openai_key":
+            raise ValueError("Please set the OPENAI_API_KEY environment variable")
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def request_body(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        data = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}]
+        }
+        if self.max_tokens:
+            data["max_tokens"] = self.max_tokens
+        if stream:
+            data["stream"] = True
+        return data
+
+    def parse_completion(self, data: Dict[str, Any]) -> str:
+        return data["choices"][0]["message"]["content"]
+
+    def parse_stream_event(self, event_type: Optional[str], data: str) -> Tuple[Optional[str], bool]:
+        if data == "[DONE]":
+            return None, True
+        choices = json.loads(data).get("choices") or [{}]
+        return choices[0].get("delta", {}).get("content"), False
+
+
+class AnthropicProvider(LLMProvider):
+    """Anthropic messages (/v1/messages)."""
+
+    name = "anthropic"
+    title = "Anthropic"
+
+    @classmethod
+    def from_env(cls, max_tokens: Optional[int] = None) -> "AnthropicProvider":
+        return cls(
+            os.getenv("ANTHROPIC_MESSAGES_URL", "https://api.anthropic.com/v1/messages"),
+            os.getenv("ANTHROPIC_API_KEY"),
+            "claude-3-opus-20240229",
+            max_tokens=max_tokens or 1000  # Required by the API
+        )
+
+    def headers(self) -> Dict[str, str]:
+        if self.api_key == "your_anthropic_key":
+            raise ValueError("Please set the ANTHROPIC_API_KEY environment variable")
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "anthropic-version": "2023-06-01"
+        }
+
+    def request_body(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        data = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.max_tokens
+        }
+        if stream:
+            data["stream"] = True
+        return data
+
+    def parse_completion(self, data: Dict[str, Any]) -> str:
+        return data["content"][0]["text"]
+
+    def parse_stream_event(self, event_type: Optional[str], data: str) -> Tuple[Optional[str], bool]:
+        if event_type == "message_stop":
+            return None, True
+        payload = json.loads(data)
+        if payload.get("type") == "error":
+            error = payload.get("error", {})
+            raise ProviderError(
+                f"Anthropic API request failed: {error.get('message')}",
+                retryable=error.get("type") in ("overloaded_error", "api_error")
+            )
+        if payload.get("type") == "content_block_delta":
+            return payload.get("delta", {}).get("text"), False
+        return None, False
+
+
+class StubLLM:
+    """
+    Deterministic stand-in for a model, shared by StubProvider and the stub
+    API server (scripts/fake_llm.py).
+
+    A completion echoes the tail of the prompt, so callers can correlate
+    requests end to end. It takes latency_ms (+/- jitter_ms) to start and is
+    then generated at tokens_per_second (instantly when None); a fraction
+    failure_rate of requests fail. Jitter and failures are drawn from a
+    generator seeded with `seed`, so a run is repeatable.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 50.0,
+        jitter_ms: float = 0.0,
+        tokens_per_second: Optional[float] = None,
+        failure_rate: float = 0.0,
+        seed: Optional[int] = 0
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+    def completion(self, prompt: str) -> str:
+        return f"Fake completion for: {prompt[-STUB_ECHO_CHARS:]}"
+
+    def should_fail(self) -> bool:
+        return self.failure_rate > 0 and self._random.random() < self.failure_rate
+
+    def first_token_delay(self) -> float:
+        jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def generation_delay(self, text: str) -> float:
+        """Seconds to generate `text` at tokens_per_second."""
+        if not self.tokens_per_second:
+            return 0.0
+        return estimate_tokens(text) / self.tokens_per_second
+
+    @staticmethod
+    def chunks(text: str) -> Iterator[str]:
+        """Split a completion into word-sized stream chunks."""
+        words = text.split(" ")
+        for index, word in enumerate(words):
+            yield word if index == len(words) - 1 else word + " "
+
+
+class StubProvider(LLMProvider):
+    """
+    In-process StubLLM: no network and no API costs, for load tests and
+    profiling the pipeline offline.
+    """
+
+    name = "stub"
+    title = "Stub"
+
+    def __init__(
+        self, model: str = "stub", stub: Optional[StubLLM] = None, max_tokens: Optional[int] = None
+    ):
+        super().__init__("", None, model, max_tokens)
+        self.stub = stub or StubLLM()
+
+    @classmethod
+    def from_env(cls, max_tokens: Optional[int] = None) -> "StubProvider":
+        """The stub as set in config, each setting overridable by the variable of the same name."""
+        tokens_per_second = os.getenv("LLM_STUB_TOKENS_PER_SECOND", LLM_STUB_TOKENS_PER_SECOND)
+        return cls(max_tokens=max_tokens, stub=StubLLM(
+            latency_ms=float(os.getenv("LLM_STUB_LATENCY_MS", LLM_STUB_LATENCY_MS)),
+            jitter_ms=float(os.getenv("LLM_STUB_JITTER_MS", LLM_STUB_JITTER_MS)),
+            tokens_per_second=float(tokens_per_second) if tokens_per_second else None,
+            failure_rate=float(os.getenv("LLM_STUB_FAILURE_RATE", LLM_STUB_FAILURE_RATE)),
+            seed=int(os.getenv("LLM_STUB_SEED", LLM_STUB_SEED))
+        ))
+
+    async def _send(self, prompt: str) -> str:
+        await asyncio.sleep(self.stub.first_token_delay())
+        if self.stub.should_fail():
+            raise ProviderError("Stub API request failed: injected failure", retryable=True)
+        text = self.stub.completion(prompt)
+        await asyncio.sleep(self.stub.generation_delay(text))
+        return text
+
+    async def _send_stream(self, prompt: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self.stub.first_token_delay())
+        if self.stub.should_fail():
+            raise ProviderError("Stub API request failed: injected failure", retryable=True)
+        for chunk in self.stub.chunks(self.stub.completion(prompt)):
+            yield chunk
+            await asyncio.sleep(self.stub.generation_delay(chunk))
+
+
+# Providers selectable by name in config
+PROVIDERS: Dict[str, Type[LLMProvider]] = {
+    OpenAIProvider.name: OpenAIProvider,
+    AnthropicProvider.name: AnthropicProvider,
+    StubProvider.name: StubProvider
+}
+
+
+def create_provider(name: str, max_tokens: Optional[int] = None) -> LLMProvider:
+    """
+    Build a registered provider from the environment (see LLMProvider.from_env).
+
+    Raises:
+        ValueError: If no provider is registered under `name`
+    """
+    provider = PROVIDERS.get(name)
+    if provider is None:
+        raise ValueError(f"Unknown LLM provider: {name} (expected one of {', '.join(PROVIDERS)})")
+    return provider.from_env(max_tokens)
+
+
+class CachedLLM:
+    """
+    A provider behind an LLM response cache: completions are keyed on model +
+    normalized prompt, so repeated and near-identical prompts skip the API
+    round-trip. With `enabled` false every call goes to the provider.
+    """
+
+    def __init__(self, provider: LLMProvider, cache: LLMCache, enabled: bool = True):
+        self.provider = provider
+        self.cache = cache
+        self.enabled = enabled
+
+    @property
+    def url(self) -> str:
+        return self.provider.url
+
+    @property
+    def model(self) -> str:
+        return self.provider.model
+
+    async def complete(self, prompt: str) -> str:
+        if not self.enabled:
+            return await self.provider.complete(prompt)
+        return await self.cache.get_or_call(self.model, prompt, lambda: self.provider.complete(prompt))
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Yield the completion for `prompt` in chunks as the provider generates it.
+        A cached completion is yielded whole; a streamed one is cached once complete.
+        """
+        key = cache_key(self.model, prompt) if self.enabled else None
+        if key is not None:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts = []
+        async for delta in self.provider.stream(prompt):
+            parts.append(delta)
+            yield delta
+        if key is not None:
+            self.cache.set(key, "".join(parts))
+
+
+def create_cached_llm(provider_env: str, default_provider: str, max_tokens: Optional[int] = None) -> CachedLLM:
+    """
+    Build an app's provider behind a response cache configured by the
+    LLM_CACHE_* settings.
+
+    Environment variables are first loaded from the .env file (DOTENV_PATH
+    overrides its location); the provider is the one named by the
+    `provider_env` variable, or `default_provider`.
+    """
+    load_dotenv(os.getenv("DOTENV_PATH", str(Path(__file__).parent.parent / ".env")))
+    provider = create_provider(os.getenv(provider_env, default_provider), max_tokens=max_tokens)
+    cache = LLMCache(
+        LLM_CACHE_MAX_ENTRIES,
+        LLM_CACHE_TTL_SECONDS,
+        db_path=LLM_CACHE_DB_PATH,
+        max_db_entries=LLM_CACHE_DB_MAX_ENTRIES
+    )
+    return CachedLLM(provider, cache, enabled=LLM_CACHE_ENABLED)
@@ -0,0 +1,346 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from config import (
+    MCP_PACKAGE_MAX_BYTES, MCP_PACKAGE_MAX_MEMORY_ITEMS, MCP_PACKAGE_MAX_TURNS,
+    MCP_PACKAGE_MAX_TEXT_CHARS
+)
+
+# Fields with a fixed type; any other top-level field is carried through as is
+TEXT_FIELDS = ("system", "current_task", "target_app", "source_app", "conversation_id")
+PACKAGE_FIELDS = TEXT_FIELDS + ("memory", "conversation")
+
+# Delivery priorities, most urgent first, and the one a package gets by default
+PRIORITIES = ("high", "normal", "low")
+DEFAULT_PRIORITY = "normal"
+
+# Fields a conversation session keeps between packages
+SESSION_FIELDS = ("conversation_id", "system", "memory", "conversation", "current_task")
+
+
+class PackageError(ValueError):
+    """Raised when an MCP package is malformed or over the size limits."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UnknownConversation(Exception):
+    """Raised by a sender when the MCP server refuses a delta (409) for a conversation it does not have."""
+
+
+class Turn:
+    """One conversation message of an MCP package."""
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+
+class MCPPackage:
+    """
+    An MCP package: system prompt, memory items, conversation and task, plus
+    optional routing fields and the id of the conversation (session) it
+    belongs to. Fields other than these (e.g. App C's `message` and
+    `analysis`, or `delta`) are kept in `extra`.
+
+    A typed builder for the senders: from_dict() validates a decoded
+    package and to_dict() gives the wire form, leaving out empty fields.
+    Packages travel and are stored as plain dicts (the MCP server keeps
+    their encoded bytes), not as MCPPackage objects.
+    """
+
+    __slots__ = (
+        "system", "memory", "conversation", "current_task", "target_app",
+        "source_app", "conversation_id", "extra"
+    )
+
+    def __init__(
+        self,
+        system: str = "",
+        memory: Optional[List[str]] = None,
+        conversation: Optional[List[Turn]] = None,
+        current_task: str = "",
+        target_app: Optional[str] = None,
+        source_app: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        extra: Optional[Dict[str, Any]] = None
+    ):
+        self.system = system
+        self.memory = memory or []
+        self.conversation = conversation or []
+        self.current_task = current_task
+        self.target_app = target_app
+        self.source_app = source_app
+        self.conversation_id = conversation_id
+        self.extra = extra or {}
+
+    @classmethod
+    def from_dict(cls, data: Any) -> "MCPPackage":
+        """
+        Validate and convert a decoded package.
+
+        Raises:
+            PackageError: If validate_package() rejects `data`
+        """
+        validate_package(data)
+        return cls(
+            system=data.get("system", ""),
+            memory=list(data.get("memory", ())),
+            conversation=[Turn(t["role"], t["content"]) for t in data.get("conversation", ())],
+            current_task=data.get("current_task", ""),
+            target_app=data.get("target_app"),
+            source_app=data.get("source_app"),
+            conversation_id=data.get("conversation_id"),
+            extra={k: v for k, v in data.items() if k not in PACKAGE_FIELDS}
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The package as sent over the wire; empty fields are left out."""
+        package: Dict[str, Any] = {}
+        if self.system:
+            package["system"] = self.system
+        if self.memory:
+            package["memory"] = self.memory
+        if self.conversation:
+            package["conversation"] = [turn.to_dict() for turn in self.conversation]
+        if self.current_task:
+            package["current_task"] = self.current_task
+        if self.target_app:
+            package["target_app"] = self.target_app
+        if self.source_app:
+            package["source_app"] = self.source_app
+        if self.conversation_id:
+            package["conversation_id"] = self.conversation_id
+        package.update(self.extra)
+        return package
+
+
+def _check_text(value: Any, field: str) -> None:
+    if not isinstance(value, str):
+        raise PackageError(f"{field} must be a string")
+    if len(value) > MCP_PACKAGE_MAX_TEXT_CHARS:
+        raise PackageError(
+            f"{field} is longer than {MCP_PACKAGE_MAX_TEXT_CHARS} characters", 413
+        )
+
+
+def validate_package(data: Any, encoded_size: Optional[int] = None) -> None:
+    """
+    Check a decoded MCP package against the schema and size limits without
+    building an MCPPackage, so ingest can reject it before storing it.
+
+    Args:
+        data: The decoded package
+        encoded_size: Size of the package's encoding, checked against
+            MCP_PACKAGE_MAX_BYTES when given
+
+    Raises:
+        PackageError: With status_code 413 for oversize packages, 400 otherwise
+    """
+    if not isinstance(data, dict):
+        raise PackageError("Context must be a JSON object")
+    if encoded_size is not None and encoded_size > MCP_PACKAGE_MAX_BYTES:
+        raise PackageError(f"Context is larger than {MCP_PACKAGE_MAX_BYTES} bytes", 413)
+
+    for field in TEXT_FIELDS + ("topic",):
+        value = data.get(field)
+        if value is not None:
+            _check_text(value, field)
+    priority = data.get("priority")
+    if priority is not None and priority not in PRIORITIES:
+        raise PackageError(f"priority must be one of {', '.join(PRIORITIES)}")
+    deadline = data.get("deadline")
+    if deadline is not None and (isinstance(deadline, bool) or not isinstance(deadline, (int, float))):
+        raise PackageError("deadline must be a Unix timestamp")
+    if data.get("delta") is not None:
+        if not isinstance(data["delta"], bool):
+            raise PackageError("delta must be true or false")
+        if data["delta"] and not data.get("conversation_id"):
+            raise PackageError("A delta package needs a conversation_id")
+
+    memory = data.get("memory")
+    if memory is not None:
+        if not isinstance(memory, list):
+            raise PackageError("memory must be a list of strings")
+        if len(memory) > MCP_PACKAGE_MAX_MEMORY_ITEMS:
+            raise PackageError(f"memory has more than {MCP_PACKAGE_MAX_MEMORY_ITEMS} items", 413)
+        for item in memory:
+            _check_text(item, "memory item")
+
+    conversation = data.get("conversation")
+    if conversation is not None:
+        if not isinstance(conversation, list):
+            raise PackageError("conversation must be a list of messages")
+        if len(conversation) > MCP_PACKAGE_MAX_TURNS:
+            raise PackageError(f"conversation has more than {MCP_PACKAGE_MAX_TURNS} messages", 413)
+        for turn in conversation:
+            if not isinstance(turn, dict) or "role" not in turn or "content" not in turn:
+                raise PackageError("conversation messages need a role and content")
+            _check_text(turn["role"], "conversation role")
+            _check_text(turn["content"], "conversation content")
+
+
+def delta_package(previous: Optional[Dict[str, Any]], package: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The smallest package that turns `previous` into `package` on the MCP
+    server's session store: a delta carrying only the memory items and turns
+    appended since `previous` (and system / current_task when they changed),
+    or `package` itself when it does not extend `previous`.
+
+    Args:
+        previous: The last package sent for the same conversation, or None
+        package: The package to send, with a conversation_id
+
+    Returns:
+        The package to send
+    """
+    conversation_id = package.get("conversation_id")
+    if not conversation_id or previous is None or previous.get("conversation_id") != conversation_id:
+        return package
+    old_memory, new_memory = previous.get("memory", []), package.get("memory", [])
+    old_turns, new_turns = previous.get("conversation", []), package.get("conversation", [])
+    if new_memory[:len(old_memory)] != old_memory or new_turns[:len(old_turns)] != old_turns:
+        return package
+
+    delta: Dict[str, Any] = {"conversation_id": conversation_id, "delta": True}
+    if new_memory[len(old_memory):]:
+        delta["memory"] = new_memory[len(old_memory):]
+    if new_turns[len(old_turns):]:
+        delta["conversation"] = new_turns[len(old_turns):]
+    for field in ("system", "current_task"):
+        if package.get(field, "") != previous.get(field, ""):
+            delta[field] = package.get(field, "")
+    for field, value in package.items():
+        # Routing fields and extra fields apply to this package only
+        if field not in SESSION_FIELDS:
+            delta[field] = value
+    return delta
+
+
+class _ConversationLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # Senders holding or waiting for the lock
+
+
+class ConversationDeltas:
+    """
+    The last package a sender sent per conversation, so the next package of
+    that conversation can go out as a delta_package() of it.
+
+    Sends are serialized per conversation: a package is encoded only once
+    the previous one has been answered, so every delta extends a package
+    the server has accepted, and deltas of one conversation cannot reach the
+    server out of order.
+
+    Holds at most `max_conversations`, the least recently sent dropped
+    first; a dropped conversation's next package is sent in full.
+    """
+
+    def __init__(self, max_conversations: int):
+        self.max_conversations = max_conversations
+        self._last: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._locks: Dict[str, _ConversationLock] = {}
+        self.deltas = 0
+        self.resent = 0
+
+    def encode(self, package: Dict[str, Any]) -> Dict[str, Any]:
+        """Remember `package` as its conversation's last and return what to send for it."""
+        conversation_id = package.get("conversation_id")
+        if not conversation_id:
+            return package
+        previous = self._last.pop(conversation_id, None)
+        self._last[conversation_id] = package
+        while len(self._last) > self.max_conversations:
+            self._last.popitem(last=False)
+        return delta_package(previous, package)
+
+    def forget(self, package: Dict[str, Any]) -> None:
+        """Drop `package`'s conversation unless a later package has been sent for it."""
+        conversation_id = package.get("conversation_id")
+        if conversation_id and self._last.get(conversation_id) is package:
+            del self._last[conversation_id]
+
+    def _append(self, package: Dict[str, Any]) -> Dict[str, Any]:
+        """`package` with its turns appended to those of the last package sent for its conversation."""
+        previous = self._last.get(package["conversation_id"])
+        if previous is None:
+            return package
+        turns = previous.get("conversation", []) + package.get("conversation", [])
+        return {**package, "conversation": turns[-MCP_PACKAGE_MAX_TURNS:]}
+
+    async def send(
+        self,
+        package: Dict[str, Any],
+        send: Callable[[Dict[str, Any]], Awaitable[Any]],
+        append: bool = False
+    ) -> Any:
+        """
+        Send `package` with `send`, as a delta when it extends the last
+        package sent for its conversation.
+
+        A delta refused with UnknownConversation (the server has expired or
+        lost the conversation) is sent again in full. If sending fails
+        otherwise, the conversation is forgotten so its next package goes
+        out in full.
+
+        Args:
+            package: The package to send
+            send: Sends one package and returns the server's answer
+            append: Whether `package` only carries the conversation's new
+                turns, to be appended to those already sent for it
+
+        Returns:
+            What `send` returned
+        """
+        conversation_id = package.get("conversation_id")
+        if not conversation_id:
+            return await send(package)
+        entry = self._locks.get(conversation_id)
+        if entry is None:
+            entry = self._locks[conversation_id] = _ConversationLock()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                if append:
+                    package = self._append(package)
+                return await self._send(package, send)
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._locks[conversation_id]
+
+    async def _send(self, package: Dict[str, Any], send: Callable[[Dict[str, Any]], Awaitable[Any]]) -> Any:
+        to_send = self.encode(package)
+        try:
+            if to_send is package:
+                return await send(package)
+            self.deltas += 1
+            try:
+                return await send(to_send)
+            except UnknownConversation:
+                self.resent += 1
+                return await send(package)
+        except BaseException:
+            self.forget(package)
+            raise
+
+
+def priority_of(data: Dict[str, Any]) -> Tuple[str, Optional[float]]:
+    """
+    Delivery priority and deadline of a validated package.
+
+    Returns:
+        (priority, deadline as Unix time or None)
+    """
+    deadline = data.get("deadline")
+    return data.get("priority") or DEFAULT_PRIORITY, float(deadline) if deadline is not None else None
@@ -0,0 +1,288 @@
+import functools
+import math
+import time
+from bisect import bisect_left
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from fastapi import Response
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds (seconds) for request and upstream call latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Upper bounds (seconds) for in-process work such as parsing a request body
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values: str):
+        """
+        Return the child for one set of label values, creating it on first use.
+        Hot paths should look the child up once and keep it.
+        """
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: Tuple[str, ...], child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. requests served."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, e.g. inbox depth."""
+
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """Distribution of observations over fixed buckets, e.g. call latency."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def _render_child(self, values: Tuple[str, ...], child: _HistogramValue) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            le = 'le="%s"' % _format_value(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Named metrics of one process, rendered in the Prometheus text format.
+
+    Updates are plain attribute increments on pre-created children with no
+    locking: every metric is only written from the event loop thread, and
+    histograms are pre-bucketed so an observation is one bisect and three
+    additions.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric_type, name: str, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = metric_type(name, *args, **kwargs)
+        elif not isinstance(metric, metric_type):
+            raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry served by each service's /metrics endpoint
+REGISTRY = MetricsRegistry()
+
+# Outbound calls from the apps to the MCP server, by calling app and operation
+MCP_CLIENT_SECONDS = REGISTRY.histogram(
+    "mcp_client_request_seconds", "Latency of calls to the MCP server", ("app", "operation")
+)
+MCP_CLIENT_ERRORS = REGISTRY.counter(
+    "mcp_client_errors_total", "Failed calls to the MCP server", ("app", "operation")
+)
+
+# Upstream LLM API calls (cache hits are not counted)
+LLM_SECONDS = REGISTRY.histogram(
+    "llm_request_seconds", "Latency of LLM API calls", ("provider", "model")
+)
+LLM_ERRORS = REGISTRY.counter(
+    "llm_errors_total", "Failed LLM API calls", ("provider", "model")
+)
+
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "llm_first_token_seconds", "Time to the first streamed token of LLM API calls",
+    ("provider", "model")
+)
+LLM_RETRIES = REGISTRY.counter(
+    "llm_retries_total", "LLM API requests retried after a retryable failure", ("provider",)
+)
+LLM_HEDGES = REGISTRY.counter(
+    "llm_hedges_total", "Hedged LLM API requests sent, and those that answered first",
+    ("provider", "outcome")
+)
+LLM_CIRCUIT_STATE = REGISTRY.gauge(
+    "llm_circuit_state", "LLM provider circuit breaker state (0 closed, 1 half-open, 2 open)",
+    ("provider",)
+)
+LLM_CIRCUIT_REJECTED = REGISTRY.counter(
+    "llm_circuit_rejected_total", "LLM calls failed fast by an open circuit breaker", ("provider",)
+)
+
+
+def timed(
+    histogram: Histogram, errors: Optional[Counter], *label_values: str
+) -> Callable[[Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]]:
+    """
+    Decorate a coroutine function to observe its duration in `histogram` and
+    count the exceptions it raises in `errors`, under `label_values`.
+    """
+    observed = histogram.labels(*label_values)
+    failed = errors.labels(*label_values) if errors is not None else None
+
+    def decorator(fn: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                if failed is not None:
+                    failed.inc()
+                raise
+            finally:
+                observed.observe(time.perf_counter() - started)
+        return wrapper
+
+    return decorator
+
+
+def timed_stream(
+    histogram: Histogram,
+    first_item: Histogram,
+    errors: Optional[Counter],
+    *label_values: str
+) -> Callable[[Callable[..., AsyncIterator[Any]]], Callable[..., AsyncIterator[Any]]]:
+    """
+    Like timed(), for async generator functions: observes the time to the
+    first yielded item in `first_item` and the full duration in `histogram`.
+    """
+    observed = histogram.labels(*label_values)
+    observed_first = first_item.labels(*label_values)
+    failed = errors.labels(*label_values) if errors is not None else None
+
+    def decorator(fn: Callable[..., AsyncIterator[Any]]) -> Callable[..., AsyncIterator[Any]]:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            first = True
+            try:
+                async for item in fn(*args, **kwargs):
+                    if first:
+                        observed_first.observe(time.perf_counter() - started)
+                        first = False
+                    yield item
+            except Exception:
+                if failed is not None:
+                    failed.inc()
+                raise
+            finally:
+                observed.observe(time.perf_counter() - started)
+        return wrapper
+
+    return decorator
+
+
+def metrics_response() -> Response:
+    """A FastAPI response with the current contents of REGISTRY."""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
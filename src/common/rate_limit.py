@@ -0,0 +1,68 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate` tokens per second, holding
+    at most `capacity` tokens.
+
+    acquire() reserves tokens up front and sleeps off any shortfall, so
+    concurrent callers are served in arrival order without a lock.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    @classmethod
+    def per_minute(cls, limit: float) -> "TokenBucket":
+        """A bucket allowing `limit` tokens per minute, bursting up to `limit`."""
+        return cls(limit / 60.0, limit)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Take `amount` tokens if they are available right now."""
+        self._refill()
+        if self._tokens < amount:
+            return False
+        self._tokens -= amount
+        return True
+
+    def retry_after(self, amount: float = 1) -> float:
+        """Seconds until `amount` tokens will be available."""
+        self._refill()
+        return max(0.0, (amount - self._tokens) / self.rate)
+
+    async def acquire(self, amount: float = 1) -> None:
+        """Take `amount` tokens, waiting for the bucket to refill if needed."""
+        self._refill()
+        self._tokens -= amount
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits applied together."""
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None
+    ):
+        self.requests = TokenBucket.per_minute(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket.per_minute(tokens_per_minute) if tokens_per_minute else None
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Wait until one request costing `tokens` tokens may be sent."""
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None and tokens:
+            await self.tokens.acquire(min(tokens, self.tokens.capacity))
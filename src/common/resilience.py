@@ -0,0 +1,124 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+# Circuit breaker states, as exported on the llm_circuit_state gauge
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while an upstream is unhealthy.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    allow() refuses calls for `reset_timeout` seconds. Then it is half-open:
+    one trial call is let through, which closes the circuit on success or
+    opens it again on failure. A trial that never reports back (e.g. it was
+    cancelled) is replaced by another after `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, gauge: Optional[Any] = None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._gauge = gauge  # Optional metrics gauge child tracking the state
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now."""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self._opened_at < self.reset_timeout:
+            return False
+        self._opened_at = now  # Re-armed, so only this call is the trial
+        self._set_state(HALF_OPEN)
+        return True
+
+    def retry_after(self) -> float:
+        """Seconds until the next call will be let through."""
+        if self.state == CLOSED:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        if self._gauge is not None:
+            self._gauge.set(STATE_VALUES[state])
+
+
+class LatencyWindow:
+    """Durations of the last `size` calls, for latency quantiles."""
+
+    def __init__(self, size: int):
+        self._samples: deque = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """The `q` quantile (0-1) of the window, or None while it is empty."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def hedge(call: Callable[[], Awaitable[Any]], delay: float) -> Tuple[Any, bool]:
+    """
+    Await `call()`, starting a second `call()` if the first has not finished
+    after `delay` seconds; whichever succeeds first wins and the other is
+    cancelled.
+
+    An error before the hedge is sent is raised at once. Once both are
+    running, an error from one waits for the other, and the last error is
+    raised if both fail.
+
+    Returns:
+        (the result, whether it came from the hedged call)
+    """
+    first = asyncio.ensure_future(call())
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return first.result(), False
+        tasks.append(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), task is not first
+            if not pending:
+                return next(iter(done)).result()  # Both failed: raise the last error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,97 @@
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def encode_event(data: Dict[str, Any], event: Optional[str] = None) -> bytes:
+    """
+    Encode a JSON payload as a single Server-Sent Events frame.
+    
+    Args:
+        data: JSON-serializable payload
+        event: Optional event name
+        
+    Returns:
+        The encoded frame, terminated by a blank line
+    """
+    frame = f"event: {event}\n" if event else ""
+    frame += f"data: {json.dumps(data)}\n\n"
+    return frame.encode()
+
+
+def encode_raw_event(data: bytes, event: Optional[str] = None) -> bytes:
+    """
+    Encode an already JSON-encoded payload as an SSE frame, without decoding
+    it first. `data` must not contain newlines.
+    """
+    frame = b"event: %s\n" % event.encode() if event else b""
+    return frame + b"data: " + data + b"\n\n"
+
+
+def encode_comment(text: str) -> bytes:
+    """Encode an SSE comment, used as a keepalive that clients ignore."""
+    return f": {text}\n\n".encode()
+
+
+def iter_events(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Decode a stream of SSE lines into JSON payloads.
+    
+    Args:
+        lines: Decoded text lines, with or without trailing newlines
+        
+    Yields:
+        The JSON-decoded `data` of each complete event
+    """
+    data_lines: List[str] = []
+    for line in lines:
+        event = _feed_line(data_lines, line)
+        if event is not None:
+            yield event
+
+
+async def aiter_events(lines: AsyncIterable[str]) -> AsyncIterator[Dict[str, Any]]:
+    """Async counterpart of iter_events, for streaming HTTP responses."""
+    data_lines: List[str] = []
+    async for line in lines:
+        event = _feed_line(data_lines, line)
+        if event is not None:
+            yield event
+
+
+async def aiter_raw_events(lines: AsyncIterable[str]) -> AsyncIterator[Tuple[Optional[str], str]]:
+    """
+    Decode a stream of SSE lines without assuming JSON payloads, for
+    upstream streams such as the LLM providers' token streams.
+
+    Yields:
+        (event name or None, raw data) for each complete event
+    """
+    event: Optional[str] = None
+    data_lines: List[str] = []
+    async for line in lines:
+        line = line.rstrip("\r\n")
+        if not line:
+            if data_lines:
+                yield event, "\n".join(data_lines)
+            event = None
+            data_lines = []
+        elif line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+    if data_lines:
+        yield event, "\n".join(data_lines)
+
+
+def _feed_line(data_lines: List[str], line: str) -> Optional[Dict[str, Any]]:
+    """Accumulate one line; return the decoded event when a frame completes."""
+    line = line.rstrip("\r\n")
+    if not line:
+        if data_lines:
+            event = json.loads("\n".join(data_lines))
+            data_lines.clear()
+            return event
+    elif line.startswith("data:"):
+        data_lines.append(line[5:].lstrip())
+    # Comments (":") and other fields (event, id, retry) are ignored
+    return None
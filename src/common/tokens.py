@@ -0,0 +1,8 @@
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for budgeting and rate limiting.
+
+    Uses the common ~4 characters per token heuristic for English text; it
+    is deliberately cheap rather than tokenizer-exact.
+    """
+    return len(text) // 4 + 1 if text else 0
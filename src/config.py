@@ -16,3 +16,227 @@ APP_C_URL = f"http://localhost:{APP_C_PORT}"
 
 # Endpoints
 MCP_RECEIVE_CONTEXT_ENDPOINT = "/receive_context"
+
+# Long-poll retrieval: upper bound on ?wait= (seconds) and on the number of
+# requests that may be parked on a single app inbox at the same time
+MCP_LONG_POLL_MAX_WAIT = 30.0
+MCP_LONG_POLL_MAX_WAITERS = 64
+
+# Streaming subscriptions (GET /subscribe/{app_id}): contexts pulled from the
+# inbox ahead of the socket, max open streams per app, seconds a single send
+# may take before the subscriber is treated as slow and disconnected, and
+# seconds between keepalive comments on an idle stream
+MCP_SUBSCRIBER_BUFFER_SIZE = 32
+MCP_MAX_SUBSCRIBERS_PER_APP = 16
+MCP_SUBSCRIBER_SEND_TIMEOUT = 5.0
+MCP_SUBSCRIBER_KEEPALIVE = 15.0
+
+MCP_SUBSCRIBE_ENDPOINT = "/subscribe"
+
+# Inbox bounds: contexts held in memory per app, and what happens beyond that
+# ("drop_oldest", "reject" with 429, or "spill" to files under
+# MCP_INBOX_SPILL_DIR, a temporary directory when None)
+MCP_INBOX_MAX_DEPTH = 10000
+MCP_INBOX_OVERFLOW = "drop_oldest"
+MCP_INBOX_SPILL_DIR = None
+
+# MCP package limits, checked once at ingest: encoded size of one context
+# (larger ones are refused with 413), memory items, conversation messages and
+# characters in any single text field
+MCP_PACKAGE_MAX_BYTES = 256 * 1024
+MCP_PACKAGE_MAX_MEMORY_ITEMS = 256
+MCP_PACKAGE_MAX_TURNS = 512
+MCP_PACKAGE_MAX_TEXT_CHARS = 64 * 1024
+
+# Admission control on context ingest. Each sending app has a token bucket of
+# MCP_INGEST_RATE_PER_APP contexts per second bursting to
+# MCP_INGEST_BURST_PER_APP (None disables it); each worker ingests at most
+# MCP_INGEST_MAX_IN_FLIGHT requests at once (503 beyond that); and a target
+# inbox holding MCP_INGEST_BACKPRESSURE_DEPTH contexts or more (None disables
+# it) refuses new ones. Refusals carry Retry-After, at least
+# MCP_INGEST_RETRY_AFTER seconds when no better estimate exists.
+MCP_INGEST_RATE_PER_APP = 1000.0
+MCP_INGEST_BURST_PER_APP = 2000
+MCP_INGEST_MAX_IN_FLIGHT = 512
+MCP_INGEST_BACKPRESSURE_DEPTH = MCP_INBOX_MAX_DEPTH * 9 // 10
+MCP_INGEST_RETRY_AFTER = 1.0
+
+# Apps known to the MCP server at startup, and the topic patterns each is
+# subscribed to. A context with neither topic nor target_app is published on
+# "from.<sender>"; in a pattern "*" matches one dot-separated word and "#"
+# zero or more. More apps and subscriptions can be registered at runtime.
+MCP_APPS = ["AppA", "AppB", "AppC"]
+MCP_DEFAULT_SUBSCRIPTIONS = {
+    "AppA": ["from.AppB", "from.AppC"],
+    "AppB": ["from.AppA", "from.AppC"],
+    "AppC": ["from.AppB"]
+}
+
+# Conversation sessions: state the MCP server keeps per conversation_id so
+# senders can send delta packages. Conversations kept (least recently updated
+# evicted first), seconds each lives after its last update, and the memory
+# items / turns each holds (oldest trimmed first)
+MCP_SESSION_MAX_SESSIONS = 10000
+MCP_SESSION_TTL_SECONDS = 3600.0
+MCP_SESSION_MAX_MEMORY_ITEMS = 256
+MCP_SESSION_MAX_TURNS = 512
+
+# Conversations whose last sent package App A / App C remember, so the next
+# package of each is sent as a delta (least recently sent forgotten first)
+MCP_SEND_DELTA_CONVERSATIONS = 1000
+
+# Write-ahead log of the inboxes (disabled when MCP_WAL_DIR is None). Stored
+# contexts are acknowledged only once logged under MCP_WAL_FSYNC: "always"
+# (fsync per write), "group" (one fsync per MCP_WAL_GROUP_COMMIT_MS window) or
+# "none". Segments roll over at MCP_WAL_SEGMENT_BYTES and a checkpoint is
+# taken every MCP_WAL_CHECKPOINT_RECORDS records to bound recovery time.
+MCP_WAL_DIR = None
+MCP_WAL_FSYNC = "group"
+MCP_WAL_GROUP_COMMIT_MS = 5.0
+MCP_WAL_SEGMENT_BYTES = 64 * 1024 * 1024
+MCP_WAL_CHECKPOINT_RECORDS = 100000
+
+# MCP server worker processes. With more than one, main.py also starts an
+# inbox broker on MCP_BROKER_HOST:MCP_BROKER_PORT that holds the inboxes (and
+# the write-ahead log) for all workers.
+MCP_SERVER_WORKERS = 1
+MCP_BROKER_HOST = "127.0.0.1"
+MCP_BROKER_PORT = 9010
+
+# Leased retrieval (?lease=<seconds>): longest visibility timeout a consumer may
+# ask for, and the lease App B takes when pulling in bounded chunks
+MCP_MAX_LEASE_SECONDS = 300.0
+MCP_DEFAULT_LEASE_SECONDS = 60.0
+
+MCP_ACK_ENDPOINT = "/ack"
+
+# Batched sends to the MCP server: packages submitted through the buffered
+# sender are coalesced into one batch request of up to MCP_SEND_BATCH_SIZE
+# packages, waiting at most MCP_SEND_BATCH_DELAY seconds for the batch to fill
+MCP_SEND_BUFFERED = False
+MCP_SEND_BATCH_SIZE = 100
+MCP_SEND_BATCH_DELAY = 0.01
+MCP_BATCH_SUFFIX = "/batch"
+
+# Sends to the MCP server answered 429 or 503 are retried up to
+# MCP_SEND_MAX_RETRIES times, after the server's Retry-After or else an
+# exponential backoff from MCP_SEND_BACKOFF_BASE up to MCP_SEND_BACKOFF_MAX
+# seconds (with jitter). Until that wait is over, other sends from the same
+# process to that host wait too, so a producer slows down instead of failing.
+MCP_SEND_MAX_RETRIES = 5
+MCP_SEND_BACKOFF_BASE = 0.1
+MCP_SEND_BACKOFF_MAX = 10.0
+
+# Encoding of app <-> MCP server traffic: "json", or "msgpack" (MessagePack,
+# needs the msgpack package) for smaller bodies and cheaper parsing
+MCP_WIRE_FORMAT = "json"
+
+# Outbound HTTP: one pooled keep-alive client per upstream host, shared by
+# every call an app makes to that host
+HTTP_MAX_CONNECTIONS_PER_HOST = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY = 30.0
+HTTP_CONNECT_TIMEOUT = 5.0
+HTTP_READ_TIMEOUT = 120.0
+HTTP_WRITE_TIMEOUT = 30.0
+HTTP_POOL_TIMEOUT = 10.0
+
+# App A summarization jobs (POST /summarize?async=true): LLM workers running
+# at once, jobs that may wait for a worker before /summarize answers 429,
+# finished jobs kept for GET /jobs/{job_id}, and seconds a completion
+# callback may take
+APP_A_JOB_WORKERS = 8
+APP_A_JOB_QUEUE_SIZE = 1000
+APP_A_JOB_RESULTS_KEPT = 10000
+APP_A_JOB_CALLBACK_TIMEOUT = 10.0
+
+# Where job callbacks may go: a callback_url must use one of these schemes and
+# name one of these hosts (exactly, no wildcards), or /summarize answers 400.
+# The default allows none, so the server cannot be made to POST to arbitrary
+# (e.g. internal) addresses
+APP_A_JOB_CALLBACK_SCHEMES = ("https",)
+APP_A_JOB_CALLBACK_HOSTS = ()
+
+# App A summary micro-batching (off by default): emails arriving within
+# APP_A_SUMMARY_BATCH_DELAY seconds of each other are summarized together in
+# one OpenAI request of at most APP_A_SUMMARY_BATCH_SIZE emails and
+# APP_A_SUMMARY_BATCH_MAX_CHARS characters of email text
+APP_A_SUMMARY_BATCHING = False
+APP_A_SUMMARY_BATCH_SIZE = 8
+APP_A_SUMMARY_BATCH_DELAY = 0.05
+APP_A_SUMMARY_BATCH_MAX_CHARS = 24000
+
+# App B reply generation: Claude calls in flight at once per poll, and the
+# per-process request and token rate limits (None disables a limit)
+APP_B_LLM_CONCURRENCY = 8
+APP_B_LLM_REQUESTS_PER_MINUTE = 50
+APP_B_LLM_TOKENS_PER_MINUTE = 40000
+
+# App B prompt budget: estimated tokens a rendered prompt may use (oldest
+# conversation turns, then oldest memory items, are omitted beyond it; None
+# disables the limit), and threads whose rendered sections are cached
+APP_B_PROMPT_MAX_TOKENS = 8000
+APP_B_PROMPT_CACHE_SIZE = 256
+
+# App B near-duplicate replies (off by default): a prompt whose estimated
+# similarity to one answered in the last APP_B_DEDUP_WINDOW prompts (and
+# APP_B_DEDUP_TTL_SECONDS) is at least APP_B_DEDUP_THRESHOLD reuses that
+# reply instead of calling Claude. Similarity is MinHash over
+# APP_B_DEDUP_SHINGLE_SIZE-word shingles, ignoring case, punctuation and
+# numbers, with APP_B_DEDUP_NUM_HASHES hashes split into APP_B_DEDUP_BANDS
+# LSH bands. Prompts of fewer than APP_B_DEDUP_MIN_SHINGLES shingles are
+# always answered
+APP_B_DEDUP_ENABLED = False
+APP_B_DEDUP_THRESHOLD = 0.8
+APP_B_DEDUP_WINDOW = 1024
+APP_B_DEDUP_TTL_SECONDS = 600.0
+APP_B_DEDUP_SHINGLE_SIZE = 3
+APP_B_DEDUP_MIN_SHINGLES = 8
+APP_B_DEDUP_NUM_HASHES = 64
+APP_B_DEDUP_BANDS = 16
+
+# LLM backend of each app: "openai", "anthropic" or "stub" (an in-process
+# deterministic fake, for load tests and profiling without API calls). The
+# stub starts answering after LLM_STUB_LATENCY_MS (+/- LLM_STUB_JITTER_MS),
+# generates LLM_STUB_TOKENS_PER_SECOND tokens a second (None: instantly) and
+# fails a fraction LLM_STUB_FAILURE_RATE of requests, drawn from a generator
+# seeded with LLM_STUB_SEED
+APP_A_LLM_PROVIDER = "openai"
+APP_B_LLM_PROVIDER = "anthropic"
+LLM_STUB_LATENCY_MS = 50.0
+LLM_STUB_JITTER_MS = 0.0
+LLM_STUB_TOKENS_PER_SECOND = None
+LLM_STUB_FAILURE_RATE = 0.0
+LLM_STUB_SEED = 0
+
+# LLM call resilience (App A and App B), per provider:
+# - connect and read timeouts of each request
+# - retries of timeouts, connection errors, 429s and 5xx answers after the
+#   answer's Retry-After or a jittered exponential backoff (up to
+#   LLM_RETRY_BACKOFF_BASE * 2**attempt seconds, capped at
+#   LLM_RETRY_BACKOFF_MAX)
+# - hedging (off by default): once LLM_HEDGE_MIN_SAMPLES calls have
+#   succeeded, a completion still pending after the LLM_HEDGE_QUANTILE
+#   latency of the last LLM_LATENCY_WINDOW calls is requested a second time
+#   and the first answer wins (streams are not hedged)
+# - a circuit breaker failing calls fast for LLM_BREAKER_RESET_SECONDS after
+#   LLM_BREAKER_FAILURES consecutive failures, then letting one trial through
+LLM_CONNECT_TIMEOUT = 5.0
+LLM_READ_TIMEOUT = 60.0
+LLM_MAX_RETRIES = 2
+LLM_RETRY_BACKOFF_BASE = 0.5
+LLM_RETRY_BACKOFF_MAX = 8.0
+LLM_HEDGE_ENABLED = False
+LLM_HEDGE_QUANTILE = 0.95
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_LATENCY_WINDOW = 200
+LLM_BREAKER_FAILURES = 5
+LLM_BREAKER_RESET_SECONDS = 30.0
+
+# LLM response cache (App A and App B): in-memory LRU size and entry lifetime,
+# plus an optional SQLite file shared across restarts (None keeps it in memory)
+LLM_CACHE_ENABLED = True
+LLM_CACHE_MAX_ENTRIES = 1024
+LLM_CACHE_TTL_SECONDS = 3600.0
+LLM_CACHE_DB_PATH = None
+LLM_CACHE_DB_MAX_ENTRIES = 100000
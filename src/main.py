@@ -5,7 +5,10 @@ from pathlib import Path
 from dotenv import load_dotenv
 import signal
 import sys
-from config import MCP_SERVER_PORT, APP_A_PORT, APP_B_PORT, APP_C_PORT
+from config import (
+    MCP_SERVER_PORT, APP_A_PORT, APP_B_PORT, APP_C_PORT,
+    MCP_SERVER_WORKERS, MCP_BROKER_HOST, MCP_BROKER_PORT, MCP_APPS
+)
 
 # Add the project root to PYTHONPATH
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -14,15 +17,21 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 env_path = Path('.env')
 load_dotenv(env_path)
 
-def run_server(module, port):
+def run_server(module, port, workers=1):
     uvicorn.run(
         module, 
         host="127.0.0.1", 
         port=port,
         reload=False,
+        workers=workers,
         log_level="info"
     )
 
+def run_broker():
+    # Imported here so only the broker process builds the shared inboxes
+    from mcp_server.broker import run_broker as serve
+    serve(MCP_APPS, MCP_BROKER_HOST, MCP_BROKER_PORT)
+
 def signal_handler(sig, frame):
     print("\nStopping all servers...")
     sys.exit(0)
@@ -31,19 +40,26 @@ if __name__ == "__main__":
     # Set up signal handling for graceful shutdown
     signal.signal(signal.SIGINT, signal_handler)
     
-    # Start all three servers in separate processes
+    processes = []
+    if MCP_SERVER_WORKERS > 1:
+        # MCP server workers share their inboxes through the broker
+        broker = multiprocessing.Process(target=run_broker)
+        broker.start()
+        processes.append(broker)
+        print(f"Started inbox broker on {MCP_BROKER_HOST}:{MCP_BROKER_PORT}")
+
+    # Start all servers in separate processes
     servers = [
-        ("mcp_server.app:app", MCP_SERVER_PORT),
-        ("app_a.app:app", APP_A_PORT),
-        ("app_b.app:app", APP_B_PORT),
-        ("app_c.app:app", APP_C_PORT)
+        ("mcp_server.app:app", MCP_SERVER_PORT, MCP_SERVER_WORKERS),
+        ("app_a.app:app", APP_A_PORT, 1),
+        ("app_b.app:app", APP_B_PORT, 1),
+        ("app_c.app:app", APP_C_PORT, 1)
     ]
     
-    processes = []
-    for module, port in servers:
+    for module, port, workers in servers:
         process = multiprocessing.Process(
             target=run_server,
-            args=(module, port)
+            args=(module, port, workers)
         )
         process.start()
         processes.append(process)
@@ -1,9 +1,18 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
 from config import MCP_SERVER_PORT
+from mcp_server import router as mcp_router
 from mcp_server.router import router
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await mcp_router.backend.close()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(router)
 
 if __name__ == "__main__":
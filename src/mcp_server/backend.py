@@ -0,0 +1,361 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set
+from config import (
+    MCP_INBOX_MAX_DEPTH, MCP_INBOX_OVERFLOW, MCP_INBOX_SPILL_DIR,
+    MCP_WAL_DIR, MCP_WAL_FSYNC, MCP_WAL_GROUP_COMMIT_MS,
+    MCP_WAL_SEGMENT_BYTES, MCP_WAL_CHECKPOINT_RECORDS, MCP_SESSION_MAX_SESSIONS,
+    MCP_SESSION_TTL_SECONDS, MCP_SESSION_MAX_MEMORY_ITEMS, MCP_SESSION_MAX_TURNS,
+    MCP_DEFAULT_SUBSCRIPTIONS
+)
+from common.mcp_package import DEFAULT_PRIORITY
+from mcp_server.inbox import InboxStore
+from mcp_server.routing import RoutingTable
+from mcp_server.sessions import SessionStore
+from mcp_server.wal import WriteAheadLog
+
+
+class InboxBackend:
+    """
+    Where the MCP server keeps its inboxes.
+
+    The router only talks to this interface, so the inboxes can live in the
+    serving process (LocalBackend) or in a broker process shared by several
+    server workers (mcp_server.broker.BrokerBackend). Methods mirror
+    InboxStore, plus waiting for contexts to arrive and the registry of apps
+    and their topic subscriptions (see mcp_server.routing).
+    """
+
+    async def apps(self) -> List[str]:
+        """Registered app ids."""
+        raise NotImplementedError
+
+    async def add_app(self, app_id: str) -> bool:
+        """
+        Register an app and give it an inbox.
+
+        Returns:
+            True if the app was not registered before
+
+        Raises:
+            ValueError: If `app_id` is not a valid app id
+        """
+        raise NotImplementedError
+
+    async def subscribe(self, app_id: str, pattern: str) -> bool:
+        """Subscribe a registered app to a topic pattern; True if new."""
+        raise NotImplementedError
+
+    async def unsubscribe(self, app_id: str, pattern: str) -> bool:
+        """Drop a subscription; True if the app had it."""
+        raise NotImplementedError
+
+    async def subscriptions(self) -> Dict[str, List[str]]:
+        """Topic patterns per registered app."""
+        raise NotImplementedError
+
+    async def resolve(self, topic: str) -> List[str]:
+        """Apps subscribed to a topic."""
+        raise NotImplementedError
+
+    async def put(
+        self,
+        app_ids: List[str],
+        context: Dict[str, Any],
+        durable: bool = True,
+        payload: Optional[bytes] = None,
+        priority: str = DEFAULT_PRIORITY,
+        deadline: Optional[float] = None
+    ) -> None:
+        """
+        Queue a context for each app. With durable=True, return only once it
+        is journaled (when a journal is configured). `payload` is the context
+        already encoded as single-line JSON, stored instead of re-encoding it.
+        `priority` and `deadline` set how it is served (see InboxStore).
+
+        Raises:
+            InboxFull: If an app inbox is full under the reject policy
+        """
+        raise NotImplementedError
+
+    async def sync(self) -> None:
+        """Wait until every context queued so far is journaled."""
+        raise NotImplementedError
+
+    async def take(self, app_id: str, raw: bool = False) -> List[Any]:
+        """Drain an inbox; with raw=True contexts are their stored JSON bytes."""
+        raise NotImplementedError
+
+    async def pull(
+        self,
+        app_id: str,
+        max_messages: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        lease_seconds: Optional[float] = None,
+        raw: bool = False
+    ) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def ack(
+        self,
+        app_id: str,
+        lease_id: Optional[int] = None,
+        message_ids: Optional[List[int]] = None
+    ) -> int:
+        raise NotImplementedError
+
+    async def release(self, app_id: str, lease_id: int) -> int:
+        raise NotImplementedError
+
+    async def depth(self, app_id: str) -> int:
+        raise NotImplementedError
+
+    async def wait(self, app_id: str, timeout: float) -> bool:
+        """
+        Wait until the app has contexts available.
+
+        Returns:
+            True if the inbox is non-empty, False if the timeout expired first
+        """
+        raise NotImplementedError
+
+    def waiters(self, app_id: str) -> int:
+        """Number of requests currently parked in wait() for an app."""
+        raise NotImplementedError
+
+    async def record_session(self, package: Dict[str, Any]) -> Optional[int]:
+        """
+        Fold a package with a conversation_id into its session.
+
+        Returns:
+            The session's new version, or None for a delta to an unknown session
+        """
+        raise NotImplementedError
+
+    async def materialize(self, packages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Expand delta packages into full ones as of the version each was sent at."""
+        raise NotImplementedError
+
+    async def session(self, conversation_id: str, since: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """A session's state, or what changed after version `since`; None if unknown."""
+        raise NotImplementedError
+
+    async def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class InboxSignal:
+    """
+    Wakes long-poll requests parked on an app inbox.
+
+    Each waiter parks on its own future, created on the event loop that is
+    serving the request, so the signal is not tied to a single loop the way
+    asyncio.Condition is.
+    """
+
+    def __init__(self):
+        self._waiters: Set[asyncio.Future] = set()
+
+    @property
+    def waiters(self) -> int:
+        return len(self._waiters)
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Park until notify_all() is called or the timeout expires.
+
+        Returns:
+            True if woken by a notification, False on timeout
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters.discard(waiter)
+
+    def notify_all(self) -> None:
+        for waiter in list(self._waiters):
+            try:
+                waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                # The loop serving that request has already shut down
+                self._waiters.discard(waiter)
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(True)
+
+
+class LocalBackend(InboxBackend):
+    """
+    Inboxes, conversation sessions and the routing table held in this
+    process, the inboxes optionally journaled to a write-ahead log. Sessions
+    and runtime registrations are not journaled: a delta recovered from the
+    log after a restart is delivered as sent, and apps re-register.
+    """
+
+    def __init__(
+        self,
+        store: InboxStore,
+        wal: Optional[WriteAheadLog] = None,
+        sessions: Optional[SessionStore] = None,
+        routes: Optional[RoutingTable] = None
+    ):
+        self.store = store
+        self.wal = wal
+        self.routes = routes or RoutingTable(store.apps)
+        for app_id in self.routes.apps:
+            self.store.add_app(app_id)
+        self.sessions = sessions or SessionStore(
+            MCP_SESSION_MAX_SESSIONS, MCP_SESSION_TTL_SECONDS,
+            MCP_SESSION_MAX_MEMORY_ITEMS, MCP_SESSION_MAX_TURNS
+        )
+        self.signals: Dict[str, InboxSignal] = {}
+
+    def _signal(self, app_id: str) -> InboxSignal:
+        signal = self.signals.get(app_id)
+        if signal is None:
+            signal = self.signals[app_id] = InboxSignal()
+        return signal
+
+    async def apps(self) -> List[str]:
+        return self.routes.apps
+
+    async def add_app(self, app_id: str) -> bool:
+        added = self.routes.add_app(app_id)
+        self.store.add_app(app_id)
+        return added
+
+    async def subscribe(self, app_id: str, pattern: str) -> bool:
+        return self.routes.subscribe(app_id, pattern)
+
+    async def unsubscribe(self, app_id: str, pattern: str) -> bool:
+        return self.routes.unsubscribe(app_id, pattern)
+
+    async def subscriptions(self) -> Dict[str, List[str]]:
+        return self.routes.subscriptions()
+
+    async def resolve(self, topic: str) -> List[str]:
+        return self.routes.resolve(topic)
+
+    async def put(
+        self,
+        app_ids: List[str],
+        context: Dict[str, Any],
+        durable: bool = True,
+        payload: Optional[bytes] = None,
+        priority: str = DEFAULT_PRIORITY,
+        deadline: Optional[float] = None
+    ) -> None:
+        if isinstance(payload, str):
+            payload = payload.encode()  # Payloads cross the broker as text
+        self.store.put(app_ids, context, payload=payload, priority=priority, deadline=deadline)
+        for app_id in app_ids:
+            self._signal(app_id).notify_all()
+        if self.wal is not None:
+            self.wal.maybe_checkpoint()
+            if durable:
+                await self.wal.sync()
+
+    async def sync(self) -> None:
+        if self.wal is not None:
+            await self.wal.sync()
+
+    async def take(self, app_id: str, raw: bool = False) -> List[Any]:
+        return self.store.take(app_id, raw=raw)
+
+    async def pull(
+        self,
+        app_id: str,
+        max_messages: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        lease_seconds: Optional[float] = None,
+        raw: bool = False
+    ) -> Dict[str, Any]:
+        return self.store.pull(
+            app_id, max_messages=max_messages, max_bytes=max_bytes,
+            lease_seconds=lease_seconds, raw=raw
+        )
+
+    async def ack(
+        self,
+        app_id: str,
+        lease_id: Optional[int] = None,
+        message_ids: Optional[List[int]] = None
+    ) -> int:
+        return self.store.ack(app_id, lease_id=lease_id, message_ids=message_ids)
+
+    async def release(self, app_id: str, lease_id: int) -> int:
+        released = self.store.release(app_id, lease_id)
+        if released:
+            self._signal(app_id).notify_all()
+        return released
+
+    async def depth(self, app_id: str) -> int:
+        return self.store.depth(app_id)
+
+    async def wait(self, app_id: str, timeout: float) -> bool:
+        signal = self._signal(app_id)
+        deadline = time.monotonic() + timeout
+        while not self.store.depth(app_id):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await signal.wait(remaining)
+        return True
+
+    def waiters(self, app_id: str) -> int:
+        return self._signal(app_id).waiters
+
+    async def record_session(self, package: Dict[str, Any]) -> Optional[int]:
+        return self.sessions.apply(package)
+
+    async def materialize(self, packages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [self.sessions.materialize(package) for package in packages]
+
+    async def session(self, conversation_id: str, since: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        return self.sessions.get(conversation_id, since)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {**self.store.stats(), "sessions": self.sessions.stats()}
+
+    async def close(self) -> None:
+        if self.wal is not None:
+            self.wal.close()
+
+
+def create_local_backend(
+    apps: List[str], subscriptions: Optional[Dict[str, List[str]]] = None
+) -> LocalBackend:
+    """
+    Build the in-process backend from config, recovering from the WAL if
+    enabled. `subscriptions` defaults to MCP_DEFAULT_SUBSCRIPTIONS.
+    """
+    store = InboxStore(
+        apps,
+        max_depth=MCP_INBOX_MAX_DEPTH,
+        overflow=MCP_INBOX_OVERFLOW,
+        spill_dir=MCP_INBOX_SPILL_DIR
+    )
+    wal = None
+    if MCP_WAL_DIR:
+        wal = WriteAheadLog(
+            MCP_WAL_DIR,
+            fsync=MCP_WAL_FSYNC,
+            group_commit_ms=MCP_WAL_GROUP_COMMIT_MS,
+            segment_bytes=MCP_WAL_SEGMENT_BYTES,
+            checkpoint_records=MCP_WAL_CHECKPOINT_RECORDS
+        )
+        wal.attach(store)
+    routes = RoutingTable(
+        apps, MCP_DEFAULT_SUBSCRIPTIONS if subscriptions is None else subscriptions
+    )
+    return LocalBackend(store, wal, routes=routes)
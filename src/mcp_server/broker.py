@@ -0,0 +1,294 @@
+import asyncio
+import itertools
+import struct
+from typing import Any, Dict, List, Optional, Set
+from common.codec import dumps, loads
+from common.mcp_package import DEFAULT_PRIORITY
+from mcp_server.backend import InboxBackend, create_local_backend
+from mcp_server.inbox import InboxFull
+
+# Requests and responses are JSON objects framed by a 4-byte big-endian length.
+# Raw context payloads (JSON bytes) travel as strings.
+_LENGTH = struct.Struct(">I")
+
+# Backend methods a worker may invoke on the broker
+BROKER_METHODS = {
+    "put", "sync", "take", "pull", "ack", "release", "depth", "wait", "stats",
+    "record_session", "materialize", "session", "apps", "add_app", "subscribe",
+    "unsubscribe", "subscriptions", "resolve"
+}
+
+
+class BrokerError(Exception):
+    """Raised when the broker fails a request or the connection to it is lost."""
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    length, = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    return loads(await reader.readexactly(length))
+
+
+def _bytes_as_text(value: Any) -> str:
+    if isinstance(value, bytes):
+        return value.decode()
+    raise TypeError(f"Cannot send {type(value).__name__} to the broker")
+
+
+def _write_frame(writer: asyncio.StreamWriter, message: Dict[str, Any]) -> None:
+    data = dumps(message, default=_bytes_as_text)
+    writer.write(_LENGTH.pack(len(data)) + data)
+
+
+async def _dispatch(backend: InboxBackend, request: Dict[str, Any], writer: asyncio.StreamWriter) -> None:
+    response: Dict[str, Any] = {"id": request.get("id")}
+    method = request.get("method")
+    try:
+        if method not in BROKER_METHODS:
+            raise BrokerError(f"Unknown broker method: {method}")
+        response["result"] = await getattr(backend, method)(
+            *request.get("args", []), **request.get("kwargs", {})
+        )
+    except InboxFull as e:
+        response["error"] = "inbox_full"
+        response["app_id"] = e.app_id
+    except Exception as e:
+        response["error"] = str(e) or type(e).__name__
+    if not writer.is_closing():
+        _write_frame(writer, response)
+
+
+async def serve_broker(backend: InboxBackend, host: str, port: int) -> asyncio.AbstractServer:
+    """
+    Expose `backend` to MCP server workers over a local TCP socket.
+
+    Every request runs on the broker's single event loop, so stores, drains
+    and acks from all workers are applied one at a time against one set of
+    inboxes: per-app order is kept and each context is drained exactly once.
+    Requests on a connection are handled concurrently and answered by id, so
+    a parked wait() does not hold up other calls.
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        tasks: Set[asyncio.Task] = set()
+        try:
+            while True:
+                request = await _read_frame(reader)
+                task = asyncio.create_task(_dispatch(backend, request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+def run_broker(apps: List[str], host: str, port: int) -> None:
+    """Process entry point: serve a local backend for `apps` until killed."""
+    async def main():
+        backend = create_local_backend(apps)
+        server = await serve_broker(backend, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await backend.close()
+
+    asyncio.run(main())
+
+
+class _BrokerConnection:
+    """One multiplexed connection to the broker, owned by a single event loop."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.ids = itertools.count(1)
+        self.closed = False
+        self.reader_task = asyncio.get_running_loop().create_task(self._read_responses())
+
+    async def call(self, method: str, args: List[Any], kwargs: Dict[str, Any]) -> Any:
+        if self.closed:
+            raise BrokerError("Connection to broker closed")
+        request_id = next(self.ids)
+        response = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = response
+        try:
+            _write_frame(self.writer, {"id": request_id, "method": method, "args": args, "kwargs": kwargs})
+            await self.writer.drain()
+            return await response
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _read_responses(self) -> None:
+        error: Exception = BrokerError("Connection to broker closed")
+        try:
+            while True:
+                message = await _read_frame(self.reader)
+                response = self.pending.get(message["id"])
+                if response is None or response.done():
+                    continue
+                if "error" not in message:
+                    response.set_result(message.get("result"))
+                elif message["error"] == "inbox_full":
+                    response.set_exception(InboxFull(message["app_id"]))
+                else:
+                    response.set_exception(BrokerError(message["error"]))
+        except Exception as e:
+            if not isinstance(e, asyncio.IncompleteReadError):
+                error = BrokerError(f"Connection to broker failed: {e}")
+        finally:
+            self.closed = True
+            self.writer.close()
+            for response in self.pending.values():
+                if not response.done():
+                    response.set_exception(error)
+
+
+class BrokerBackend(InboxBackend):
+    """
+    Inboxes held by a broker process (see serve_broker), shared by every MCP
+    server worker that connects to it.
+
+    Each event loop gets its own connection, opened on first use and reopened
+    after the broker drops it. Long-poll waiter counts are tracked per worker.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._connections: Dict[asyncio.AbstractEventLoop, _BrokerConnection] = {}
+        self._connecting: Dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+
+    async def _connection(self) -> _BrokerConnection:
+        loop = asyncio.get_running_loop()
+        connection = self._connections.get(loop)
+        if connection is not None and not connection.closed:
+            return connection
+        for stale in [other for other in self._connections if other.is_closed()]:
+            del self._connections[stale]
+        connecting = self._connecting.get(loop)
+        if connecting is None:
+            connecting = loop.create_task(asyncio.open_connection(self.host, self.port))
+            self._connecting[loop] = connecting
+        try:
+            reader, writer = await asyncio.shield(connecting)
+        except OSError as e:
+            raise BrokerError(f"Cannot reach broker at {self.host}:{self.port}: {e}")
+        finally:
+            if self._connecting.get(loop) is connecting and connecting.done():
+                del self._connecting[loop]
+        connection = self._connections.get(loop)
+        if connection is None or connection.closed or connection.writer is not writer:
+            connection = _BrokerConnection(reader, writer)
+            self._connections[loop] = connection
+        return connection
+
+    async def _call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        connection = await self._connection()
+        return await connection.call(method, list(args), kwargs)
+
+    async def put(
+        self,
+        app_ids: List[str],
+        context: Dict[str, Any],
+        durable: bool = True,
+        payload: Optional[bytes] = None,
+        priority: str = DEFAULT_PRIORITY,
+        deadline: Optional[float] = None
+    ) -> None:
+        if payload is not None:
+            context = None  # The broker stores the payload as is; no need to send both
+        await self._call(
+            "put", app_ids, context,
+            durable=durable, payload=payload, priority=priority, deadline=deadline
+        )
+
+    async def sync(self) -> None:
+        await self._call("sync")
+
+    async def take(self, app_id: str, raw: bool = False) -> List[Any]:
+        messages = await self._call("take", app_id, raw=raw)
+        return [message.encode() for message in messages] if raw else messages
+
+    async def pull(
+        self,
+        app_id: str,
+        max_messages: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        lease_seconds: Optional[float] = None,
+        raw: bool = False
+    ) -> Dict[str, Any]:
+        batch = await self._call(
+            "pull", app_id,
+            max_messages=max_messages, max_bytes=max_bytes,
+            lease_seconds=lease_seconds, raw=raw
+        )
+        if raw:
+            batch["messages"] = [message.encode() for message in batch["messages"]]
+        return batch
+
+    async def ack(
+        self,
+        app_id: str,
+        lease_id: Optional[int] = None,
+        message_ids: Optional[List[int]] = None
+    ) -> int:
+        return await self._call("ack", app_id, lease_id=lease_id, message_ids=message_ids)
+
+    async def release(self, app_id: str, lease_id: int) -> int:
+        return await self._call("release", app_id, lease_id)
+
+    async def depth(self, app_id: str) -> int:
+        return await self._call("depth", app_id)
+
+    async def wait(self, app_id: str, timeout: float) -> bool:
+        self._waiters[app_id] = self._waiters.get(app_id, 0) + 1
+        try:
+            return await self._call("wait", app_id, timeout)
+        finally:
+            self._waiters[app_id] -= 1
+
+    def waiters(self, app_id: str) -> int:
+        return self._waiters.get(app_id, 0)
+
+    async def record_session(self, package: Dict[str, Any]) -> Optional[int]:
+        return await self._call("record_session", package)
+
+    async def materialize(self, packages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return await self._call("materialize", packages)
+
+    async def session(self, conversation_id: str, since: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        return await self._call("session", conversation_id, since)
+
+    async def apps(self) -> List[str]:
+        return await self._call("apps")
+
+    async def add_app(self, app_id: str) -> bool:
+        return await self._call("add_app", app_id)
+
+    async def subscribe(self, app_id: str, pattern: str) -> bool:
+        return await self._call("subscribe", app_id, pattern)
+
+    async def unsubscribe(self, app_id: str, pattern: str) -> bool:
+        return await self._call("unsubscribe", app_id, pattern)
+
+    async def subscriptions(self) -> Dict[str, List[str]]:
+        return await self._call("subscriptions")
+
+    async def resolve(self, topic: str) -> List[str]:
+        return await self._call("resolve", topic)
+
+    async def stats(self) -> Dict[str, Any]:
+        return await self._call("stats")
+
+    async def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        connection = self._connections.pop(loop, None)
+        if connection is not None:
+            connection.writer.close()
+            await asyncio.gather(connection.reader_task, return_exceptions=True)
@@ -0,0 +1,577 @@
+import os
+import tempfile
+import time
+from collections import deque
+from typing import Any, BinaryIO, Deque, Dict, Iterable, List, Optional, Tuple
+from common.codec import dumps, loads
+from common.mcp_package import DEFAULT_PRIORITY, PRIORITIES, priority_of
+
+# Overflow policies applied when an app inbox reaches max_depth
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_REJECT = "reject"
+OVERFLOW_SPILL = "spill"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_REJECT, OVERFLOW_SPILL)
+
+# Priority levels, served in this order (index 0 first)
+LEVELS = range(len(PRIORITIES))
+DEFAULT_LEVEL = PRIORITIES.index(DEFAULT_PRIORITY)
+
+
+class InboxFull(Exception):
+    """Raised when a context cannot be queued under the reject policy."""
+
+    def __init__(self, app_id: str):
+        super().__init__(f"Inbox for {app_id} is full")
+        self.app_id = app_id
+
+
+def encode_context(context: Dict[str, Any]) -> bytes:
+    return dumps(context)
+
+
+def decode_context(payload: bytes) -> Dict[str, Any]:
+    return loads(payload)
+
+
+class _Message:
+    """One stored context, shared by every inbox it was fanned out to."""
+
+    __slots__ = ("msg_id", "payload", "refs", "level", "deadline", "enqueued")
+
+    def __init__(
+        self,
+        msg_id: int,
+        payload: bytes,
+        level: int = DEFAULT_LEVEL,
+        deadline: Optional[float] = None
+    ):
+        self.msg_id = msg_id
+        self.payload = payload
+        self.refs = 0
+        self.level = level
+        self.deadline = deadline  # Wall-clock time after which it is not delivered
+        self.enqueued = time.monotonic()
+
+
+class _Lease:
+    """Messages handed to a consumer and hidden until acked or expired."""
+
+    __slots__ = ("lease_id", "deadline", "messages")
+
+    def __init__(self, lease_id: int, deadline: float):
+        self.lease_id = lease_id
+        self.deadline = deadline
+        self.messages: Dict[int, _Message] = {}
+
+
+class _AppInbox:
+    """
+    Per-app queues of message references, one FIFO per priority level, plus
+    the inbox's overflow and delivery bookkeeping.
+    """
+
+    __slots__ = (
+        "app_id", "queues", "queued", "leases", "leased_index", "spill_file",
+        "spill_path", "spill_offset", "spilled", "spilled_bytes", "dropped",
+        "rejected", "redelivered", "expired", "delivered", "waited"
+    )
+
+    def __init__(self, app_id: str):
+        self.app_id = app_id
+        self.queues: List[Deque[_Message]] = [deque() for _ in LEVELS]
+        self.queued = 0  # Messages across all levels
+        self.leases: Dict[int, _Lease] = {}
+        self.leased_index: Dict[int, _Lease] = {}  # msg_id -> lease holding it
+        self.spill_file: Optional[BinaryIO] = None
+        self.spill_path: Optional[str] = None
+        self.spill_offset = 0  # Read position; appends always go to the end
+        self.spilled = 0
+        self.spilled_bytes = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.redelivered = 0
+        self.expired = 0
+        self.delivered = [0 for _ in LEVELS]
+        self.waited = [0.0 for _ in LEVELS]  # Seconds queued, summed per level
+
+    def push(self, message: _Message) -> None:
+        self.queues[message.level].append(message)
+        self.queued += 1
+
+    def push_front(self, messages: List[_Message]) -> None:
+        """Put messages back ahead of everything queued at their level, in list order."""
+        for message in reversed(messages):
+            self.queues[message.level].appendleft(message)
+        self.queued += len(messages)
+
+    def head(self) -> Optional[_Message]:
+        """Next message to deliver: the oldest of the most urgent level."""
+        for queue in self.queues:
+            if queue:
+                return queue[0]
+        return None
+
+    def pop(self, message: _Message) -> None:
+        """Remove `message`, which must be the head of its level."""
+        self.queues[message.level].popleft()
+        self.queued -= 1
+
+    def pop_least_urgent(self) -> _Message:
+        """Remove the oldest message of the least urgent non-empty level."""
+        for queue in reversed(self.queues):
+            if queue:
+                self.queued -= 1
+                return queue.popleft()
+        raise IndexError("pop from an empty inbox")
+
+    def messages(self) -> Iterable[_Message]:
+        for queue in self.queues:
+            yield from queue
+
+
+class InboxStore:
+    """
+    Bounded per-app inboxes over a shared message store.
+
+    A context routed to several apps is encoded and stored once; each app
+    inbox holds a reference to it, and the store forgets the message once the
+    last inbox has released it. Enqueue and dequeue are O(1) deque operations.
+
+    Each inbox holds at most max_depth contexts in memory. Beyond that the
+    overflow policy applies:
+        drop_oldest: evict the oldest queued context
+        reject:      raise InboxFull, leaving every target inbox untouched
+        spill:       append to a per-app file on disk, read back in order as
+                     the in-memory queue drains
+
+    Retrieval either removes contexts outright or leases them: leased
+    contexts are invisible to other pulls until acked, and go back to the
+    front of the inbox if the lease expires or is released first.
+
+    Each inbox is served by priority ("high", then "normal", then "low"),
+    oldest first within a priority. drop_oldest evicts from the least urgent
+    priority first. A context whose deadline has passed when it reaches the
+    front is dropped rather than delivered. Spilled contexts are read back
+    in arrival order, so priority applies among the contexts held in memory.
+
+    If a journal is attached (see mcp_server.wal), every stored context is
+    recorded before it is queued and every context that leaves an inbox for
+    good (drained, acked or dropped) is recorded as removed.
+    """
+
+    def __init__(
+        self,
+        apps: Iterable[str],
+        max_depth: int,
+        overflow: str = OVERFLOW_DROP_OLDEST,
+        spill_dir: Optional[str] = None
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.max_depth = max_depth
+        self.overflow = overflow
+        self.spill_dir = spill_dir
+        self._next_id = 1
+        self._next_lease_id = 1
+        self._messages: Dict[int, _Message] = {}
+        self._payload_bytes = 0
+        self._inboxes: Dict[str, _AppInbox] = {}
+        self.journal = None
+        for app_id in apps:
+            self.add_app(app_id)
+
+    def add_app(self, app_id: str) -> None:
+        if app_id not in self._inboxes:
+            self._inboxes[app_id] = _AppInbox(app_id)
+
+    def __contains__(self, app_id: str) -> bool:
+        return app_id in self._inboxes
+
+    @property
+    def apps(self) -> List[str]:
+        return list(self._inboxes)
+
+    def depth(self, app_id: str) -> int:
+        """Number of contexts available to an app, in memory and spilled."""
+        inbox = self._inboxes[app_id]
+        if inbox.leases:
+            self._expire_leases(inbox)
+        return inbox.queued + inbox.spilled
+
+    def put(
+        self,
+        app_ids: List[str],
+        context: Dict[str, Any],
+        payload: Optional[bytes] = None,
+        priority: str = DEFAULT_PRIORITY,
+        deadline: Optional[float] = None
+    ) -> int:
+        """
+        Queue one context for one or more apps.
+
+        Args:
+            app_ids: Target apps; the context is stored once for all of them
+            context: The context to queue
+            payload: The context already encoded as single-line JSON (e.g. the
+                request body it was parsed from), stored as is instead of
+                encoding `context` again
+            priority: One of PRIORITIES
+            deadline: Unix time after which the context is dropped, not delivered
+
+        Returns:
+            The id assigned to the stored message
+
+        Raises:
+            InboxFull: If the reject policy applies and any target is full
+        """
+        if self.overflow == OVERFLOW_REJECT:
+            for app_id in app_ids:
+                if self.depth(app_id) >= self.max_depth:
+                    self._inboxes[app_id].rejected += 1
+                    raise InboxFull(app_id)
+
+        if payload is None:
+            payload = encode_context(context)
+        message = _Message(self._next_id, payload, PRIORITIES.index(priority), deadline)
+        if self.journal is not None:
+            self.journal.record_put(message.msg_id, app_ids, message.payload)
+        self._next_id += 1
+        for app_id in app_ids:
+            self._enqueue(self._inboxes[app_id], message)
+        return message.msg_id
+
+    def take(
+        self, app_id: str, limit: Optional[int] = None, raw: bool = False
+    ) -> List[Any]:
+        """
+        Remove and return up to `limit` contexts (all if None), oldest first.
+        With raw=True the contexts are returned as their stored JSON bytes.
+        """
+        return self.pull(app_id, max_messages=limit, raw=raw)["messages"]
+
+    def pull(
+        self,
+        app_id: str,
+        max_messages: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        lease_seconds: Optional[float] = None,
+        raw: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Retrieve a bounded batch of contexts, oldest first.
+
+        Args:
+            app_id: Inbox to pull from
+            max_messages: Most contexts to return (no limit if None)
+            max_bytes: Encoded-size budget for the batch; the first context is
+                always returned so an oversize one cannot wedge the inbox
+            lease_seconds: Lease the batch instead of removing it
+            raw: Return the stored JSON bytes of each context rather than
+                decoding it, for callers that splice them into a response
+
+        Returns:
+            Dict with the `messages`, their `message_ids`, the `lease_id`
+            (None when not leasing) and `has_more`
+        """
+        inbox = self._inboxes[app_id]
+        if inbox.leases:
+            self._expire_leases(inbox)
+
+        lease = None
+        if lease_seconds is not None:
+            lease = _Lease(self._next_lease_id, time.monotonic() + lease_seconds)
+            self._next_lease_id += 1
+
+        messages, message_ids, expired = [], [], []
+        batch_bytes = 0
+        now = time.time()
+        while inbox.queued or inbox.spilled:
+            if max_messages is not None and len(messages) >= max_messages:
+                break
+            if not inbox.queued:
+                self._unspill(inbox)
+            message = inbox.head()
+            if message.deadline is not None and message.deadline <= now:
+                inbox.pop(message)
+                self._release(message)
+                expired.append(message.msg_id)
+                continue
+            batch_bytes += len(message.payload)
+            if max_bytes is not None and messages and batch_bytes > max_bytes:
+                break
+            inbox.pop(message)
+            messages.append(message.payload if raw else decode_context(message.payload))
+            message_ids.append(message.msg_id)
+            inbox.delivered[message.level] += 1
+            inbox.waited[message.level] += time.monotonic() - message.enqueued
+            if lease is None:
+                self._release(message)
+            else:
+                lease.messages[message.msg_id] = message
+                inbox.leased_index[message.msg_id] = lease
+
+        if lease is not None and lease.messages:
+            inbox.leases[lease.lease_id] = lease
+        removed = expired + message_ids if lease is None else expired
+        if removed and self.journal is not None:
+            self.journal.record_remove(app_id, removed)
+        inbox.expired += len(expired)
+
+        return {
+            "messages": messages,
+            "message_ids": message_ids,
+            "lease_id": lease.lease_id if lease is not None and messages else None,
+            "has_more": bool(inbox.queued or inbox.spilled)
+        }
+
+    def ack(
+        self,
+        app_id: str,
+        lease_id: Optional[int] = None,
+        message_ids: Optional[Iterable[int]] = None
+    ) -> int:
+        """
+        Acknowledge leased contexts so they are never redelivered.
+
+        Args:
+            app_id: Inbox the contexts were pulled from
+            lease_id: Ack everything still outstanding under this lease
+            message_ids: Ack individual contexts by id
+
+        Returns:
+            Number of contexts acknowledged
+        """
+        inbox = self._inboxes[app_id]
+        acked = 0
+        if lease_id is not None:
+            lease = inbox.leases.get(lease_id)
+            if lease is not None:
+                acked += self._ack_ids(inbox, list(lease.messages))
+        if message_ids is not None:
+            acked += self._ack_ids(inbox, message_ids)
+        return acked
+
+    def release(self, app_id: str, lease_id: int) -> int:
+        """
+        Give up a lease early, returning its unacked contexts to the front.
+
+        Returns:
+            Number of contexts returned to the inbox
+        """
+        inbox = self._inboxes[app_id]
+        lease = inbox.leases.get(lease_id)
+        if lease is None:
+            return 0
+        self._return_leases(inbox, [lease])
+        return len(lease.messages)
+
+    def leased(self, app_id: str) -> int:
+        """Number of contexts currently leased out for an app."""
+        return len(self._inboxes[app_id].leased_index)
+
+    def snapshot(self) -> List[Tuple[int, List[str], bytes]]:
+        """
+        Every context still owed to some app, for checkpointing.
+
+        Leased contexts are included (they are redelivered after a restart).
+        Each app's inbox is ordered by message id, so restoring the entries in
+        id order rebuilds every inbox in its original order.
+
+        Returns:
+            (msg_id, app_ids, payload) tuples sorted by msg_id
+        """
+        holders: Dict[int, List[str]] = {}
+        payloads: Dict[int, bytes] = {}
+        for app_id, inbox in self._inboxes.items():
+            for message in inbox.messages():
+                holders.setdefault(message.msg_id, []).append(app_id)
+                payloads[message.msg_id] = message.payload
+            for lease in inbox.leases.values():
+                for message in lease.messages.values():
+                    holders.setdefault(message.msg_id, []).append(app_id)
+                    payloads[message.msg_id] = message.payload
+            for msg_id, payload in self._read_spill(inbox):
+                holders.setdefault(msg_id, []).append(app_id)
+                payloads[msg_id] = payload
+        return [(msg_id, holders[msg_id], payloads[msg_id]) for msg_id in sorted(holders)]
+
+    def restore(
+        self, entries: Iterable[Tuple[int, List[str], bytes]], next_id: int = 1
+    ) -> None:
+        """
+        Re-queue contexts recovered from a journal, in the order given.
+        Nothing is journaled and the reject policy does not apply. Priority
+        and deadline are read back from each payload.
+
+        Args:
+            entries: (msg_id, app_ids, payload) tuples, as from snapshot()
+            next_id: Lowest id to hand out to new contexts
+        """
+        self._next_id = max(self._next_id, next_id)
+        journal, self.journal = self.journal, None
+        try:
+            for msg_id, app_ids, payload in entries:
+                message = self._restored_message(msg_id, payload)
+                for app_id in app_ids:
+                    self.add_app(app_id)
+                    self._enqueue(self._inboxes[app_id], message)
+                self._next_id = max(self._next_id, msg_id + 1)
+        finally:
+            self.journal = journal
+
+    @property
+    def next_id(self) -> int:
+        return self._next_id
+
+    @staticmethod
+    def _restored_message(msg_id: int, payload: bytes) -> _Message:
+        try:
+            priority, deadline = priority_of(decode_context(payload))
+        except ValueError:
+            priority, deadline = DEFAULT_PRIORITY, None
+        return _Message(msg_id, payload, PRIORITIES.index(priority), deadline)
+
+    def stats(self) -> Dict[str, Any]:
+        """Depth, overflow counters and memory accounting for every inbox."""
+        return {
+            "max_depth": self.max_depth,
+            "overflow": self.overflow,
+            "stored_messages": len(self._messages),
+            "stored_bytes": self._payload_bytes,
+            "apps": {
+                app_id: {
+                    "depth": self.depth(app_id),
+                    "in_memory": inbox.queued,
+                    "leased": len(inbox.leased_index),
+                    "spilled": inbox.spilled,
+                    "spilled_bytes": inbox.spilled_bytes,
+                    "dropped": inbox.dropped,
+                    "rejected": inbox.rejected,
+                    "redelivered": inbox.redelivered,
+                    "expired": inbox.expired,
+                    "priorities": {
+                        name: {
+                            "depth": len(inbox.queues[level]),
+                            "delivered": inbox.delivered[level],
+                            "wait_seconds": inbox.waited[level]
+                        }
+                        for level, name in enumerate(PRIORITIES)
+                    }
+                }
+                for app_id, inbox in self._inboxes.items()
+            }
+        }
+
+    def _enqueue(self, inbox: _AppInbox, message: _Message) -> None:
+        # Once an inbox has spilled, newer contexts queue behind the spill
+        # file so delivery stays in order
+        if inbox.spilled or inbox.queued >= self.max_depth:
+            if self.overflow == OVERFLOW_SPILL:
+                self._spill(inbox, message)
+                return
+            if self.overflow == OVERFLOW_DROP_OLDEST and inbox.queued:
+                dropped = inbox.pop_least_urgent()
+                if self.journal is not None:
+                    self.journal.record_remove(inbox.app_id, [dropped.msg_id])
+                self._release(dropped)
+                inbox.dropped += 1
+        self._retain(message)
+        inbox.push(message)
+
+    def _ack_ids(self, inbox: _AppInbox, message_ids: Iterable[int]) -> int:
+        acked = []
+        for msg_id in message_ids:
+            lease = inbox.leased_index.pop(msg_id, None)
+            if lease is None:
+                continue
+            self._release(lease.messages.pop(msg_id))
+            if not lease.messages:
+                del inbox.leases[lease.lease_id]
+            acked.append(msg_id)
+        if acked and self.journal is not None:
+            self.journal.record_remove(inbox.app_id, acked)
+        return len(acked)
+
+    def _expire_leases(self, inbox: _AppInbox) -> None:
+        now = time.monotonic()
+        expired = [lease for lease in inbox.leases.values() if lease.deadline <= now]
+        if expired:
+            self._return_leases(inbox, expired)
+            inbox.redelivered += sum(len(lease.messages) for lease in expired)
+
+    def _return_leases(self, inbox: _AppInbox, leases: List[_Lease]) -> None:
+        """Put unacked leased messages back at the front of their priority, in message order."""
+        returned = []
+        for lease in leases:
+            del inbox.leases[lease.lease_id]
+            for msg_id, message in lease.messages.items():
+                del inbox.leased_index[msg_id]
+                returned.append(message)
+        # The store keeps its reference: a lease holds one just like the queue
+        returned.sort(key=lambda message: message.msg_id)
+        inbox.push_front(returned)
+
+    def _retain(self, message: _Message) -> None:
+        if message.refs == 0:
+            self._messages[message.msg_id] = message
+            self._payload_bytes += len(message.payload)
+        message.refs += 1
+
+    def _release(self, message: _Message) -> None:
+        message.refs -= 1
+        if message.refs == 0:
+            del self._messages[message.msg_id]
+            self._payload_bytes -= len(message.payload)
+
+    def _spill(self, inbox: _AppInbox, message: _Message) -> None:
+        if inbox.spill_file is None:
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix="mcp_spill_")
+            os.makedirs(self.spill_dir, exist_ok=True)
+            fd, inbox.spill_path = tempfile.mkstemp(suffix=".spill", dir=self.spill_dir)
+            inbox.spill_file = os.fdopen(fd, "w+b")
+        # One record per line: message id, priority level and deadline ("-"
+        # for none), then the JSON payload (stored payloads never contain a
+        # raw newline)
+        deadline = b"-" if message.deadline is None else repr(message.deadline).encode()
+        record = b"%d %d %s %s\n" % (message.msg_id, message.level, deadline, message.payload)
+        inbox.spill_file.seek(0, os.SEEK_END)
+        inbox.spill_file.write(record)
+        inbox.spilled += 1
+        inbox.spilled_bytes += len(message.payload)
+
+    @staticmethod
+    def _read_spill(inbox: _AppInbox) -> List[Tuple[int, bytes]]:
+        """The (msg_id, payload) records still waiting in an app's spill file."""
+        if inbox.spill_file is None:
+            return []
+        inbox.spill_file.seek(inbox.spill_offset)
+        records = []
+        for _ in range(inbox.spilled):
+            msg_id, _level, _deadline, payload = inbox.spill_file.readline().rstrip(b"\n").split(b" ", 3)
+            records.append((int(msg_id), payload))
+        return records
+
+    def _unspill(self, inbox: _AppInbox) -> None:
+        """Refill an empty in-memory queue from the front of the spill file."""
+        spill_file = inbox.spill_file
+        spill_file.seek(inbox.spill_offset)
+        while inbox.spilled and inbox.queued < self.max_depth:
+            msg_id, level, deadline, payload = spill_file.readline().rstrip(b"\n").split(b" ", 3)
+            # Share the stored copy if other inboxes still reference it
+            message = self._messages.get(int(msg_id)) or _Message(
+                int(msg_id), payload, int(level), None if deadline == b"-" else float(deadline)
+            )
+            self._retain(message)
+            inbox.push(message)
+            inbox.spilled -= 1
+            inbox.spilled_bytes -= len(payload)
+
+        if inbox.spilled:
+            inbox.spill_offset = spill_file.tell()
+        else:
+            spill_file.close()
+            os.remove(inbox.spill_path)
+            inbox.spill_file = None
+            inbox.spill_path = None
+            inbox.spill_offset = 0
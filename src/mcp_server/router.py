@@ -1,23 +1,441 @@
-from fastapi import APIRouter, Request, HTTPException, Response
-from typing import Dict, Any, Optional
+import asyncio
+import math
+import time
+from collections import deque
+import anyio
+from fastapi import APIRouter, Query, Request, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from typing import AsyncIterator, Deque, Dict, Any, List, Optional, Set, Tuple
+from common.codec import (
+    JSON_CONTENT_TYPE, MSGPACK_CONTENT_TYPE, decode_body, dumps, is_msgpack, loads,
+    pack, reusable_payload, splice_messages
+)
+from common.mcp_package import PackageError, priority_of, validate_package
+from common.metrics import FAST_BUCKETS, REGISTRY, metrics_response
+from common.rate_limit import TokenBucket
+from common.sse import encode_comment, encode_raw_event
+from config import (
+    MCP_LONG_POLL_MAX_WAIT, MCP_LONG_POLL_MAX_WAITERS,
+    MCP_SUBSCRIBER_BUFFER_SIZE, MCP_MAX_SUBSCRIBERS_PER_APP,
+    MCP_SUBSCRIBER_SEND_TIMEOUT, MCP_SUBSCRIBER_KEEPALIVE,
+    MCP_MAX_LEASE_SECONDS, MCP_SERVER_WORKERS, MCP_BROKER_HOST, MCP_BROKER_PORT,
+    MCP_PACKAGE_MAX_BYTES, MCP_APPS, MCP_INGEST_RATE_PER_APP, MCP_INGEST_BURST_PER_APP,
+    MCP_INGEST_MAX_IN_FLIGHT, MCP_INGEST_BACKPRESSURE_DEPTH, MCP_INGEST_RETRY_AFTER
+)
+from mcp_server.backend import InboxBackend, create_local_backend
+from mcp_server.broker import BrokerBackend
+from mcp_server.inbox import InboxFull
+from mcp_server.routing import APP_ID_PATTERN, check_pattern, check_topic, default_topic
 
 router = APIRouter()
 
-# Valid apps that can interact with MCP
-VALID_APPS = ["AppA", "AppB", "AppC"]
+# Apps that can interact with MCP at startup; more register at runtime
+VALID_APPS = list(MCP_APPS)
 
 # Fast MCP - minimal memory, stateless delivery 
-# Store messages for each app
-inbox: Dict[str, list] = {"AppA": [], "AppB": [], "AppC": []}
+# Bounded store of messages for each app. With several server workers the
+# inboxes live in a broker process (started by main.py) shared by all of them.
+backend: InboxBackend
+if MCP_SERVER_WORKERS > 1:
+    backend = BrokerBackend(MCP_BROKER_HOST, MCP_BROKER_PORT)
+else:
+    backend = create_local_backend(VALID_APPS)
+
+# Registered apps as last seen by this worker, refreshed from the backend
+# when a request names an app not in it
+known_apps: Set[str] = set(VALID_APPS)
+
+# Open streaming subscriptions per app (per worker)
+subscribers: Dict[str, int] = {}
+
+# Admission control (per worker): a token bucket per sending app, and the
+# number of ingest requests being handled right now
+ingest_buckets: Dict[str, TokenBucket] = {}
+ingest_in_flight = 0
+
+# Inbox traffic and request parsing, exported on /metrics
+ENQUEUED = REGISTRY.counter("mcp_enqueued_total", "Contexts queued per app inbox", ("app",))
+DRAINED = REGISTRY.counter("mcp_drained_total", "Contexts delivered from each app inbox", ("app",))
+PARSE_SECONDS = REGISTRY.histogram(
+    "mcp_request_parse_seconds", "Time to parse context request bodies", ("endpoint",),
+    buckets=FAST_BUCKETS
+)
+INBOX_GAUGES = {
+    key: REGISTRY.gauge(f"mcp_inbox_{key}", f"Inbox {key} per app (from /inbox/stats)", ("app",))
+    for key in ("depth", "leased", "spilled")
+}
+INBOX_COUNTERS = {
+    key: REGISTRY.counter(f"mcp_inbox_{key}_total", f"Contexts {key} per app inbox", ("app",))
+    for key in ("dropped", "rejected", "redelivered", "expired")
+}
+PRIORITY_DEPTH = REGISTRY.gauge(
+    "mcp_inbox_priority_depth", "Contexts queued in memory per app and priority", ("app", "priority")
+)
+PRIORITY_DELIVERED = REGISTRY.counter(
+    "mcp_inbox_delivered_total", "Contexts delivered per app and priority", ("app", "priority")
+)
+PRIORITY_WAIT = REGISTRY.counter(
+    "mcp_inbox_wait_seconds_total", "Seconds delivered contexts spent queued, per app and priority",
+    ("app", "priority")
+)
+INGEST_REFUSED = REGISTRY.counter(
+    "mcp_ingest_refused_total", "Contexts refused by admission control per sending app",
+    ("app", "reason")
+)
+STORED_BYTES = REGISTRY.gauge("mcp_stored_bytes", "Bytes of context payloads held in memory")
+
+_enqueued: Dict[str, Any] = {}
+_drained: Dict[str, Any] = {}
+_parse_single = PARSE_SECONDS.labels("receive_context")
+_parse_batch = PARSE_SECONDS.labels("batch")
+_parse_ndjson = PARSE_SECONDS.labels("batch_ndjson_line")
+
+
+async def _is_app(app_id: str) -> bool:
+    """Whether `app_id` is registered, asking the backend on a miss."""
+    if app_id in known_apps:
+        return True
+    known_apps.update(await backend.apps())
+    return app_id in known_apps
+
+
+def _count_enqueued(app_id: str, count: int = 1) -> None:
+    counter = _enqueued.get(app_id)
+    if counter is None:
+        counter = _enqueued[app_id] = ENQUEUED.labels(app_id)
+    counter.inc(count)
+
+
+def _count_drained(app_id: str, count: int = 1) -> None:
+    counter = _drained.get(app_id)
+    if counter is None:
+        counter = _drained[app_id] = DRAINED.labels(app_id)
+    counter.inc(count)
+
+
+def _rate_limited(app_id: str, count: int = 1) -> Optional[float]:
+    """
+    Charge `count` contexts to the sending app's token bucket.
+
+    Returns:
+        None if they are admitted, else seconds until they would be
+    """
+    if MCP_INGEST_RATE_PER_APP is None:
+        return None
+    bucket = ingest_buckets.get(app_id)
+    if bucket is None:
+        bucket = ingest_buckets[app_id] = TokenBucket(MCP_INGEST_RATE_PER_APP, MCP_INGEST_BURST_PER_APP)
+    count = min(count, bucket.capacity)
+    if bucket.try_acquire(count):
+        return None
+    INGEST_REFUSED.labels(app_id, "rate").inc(count)
+    return bucket.retry_after(count)
+
+
+def _refuse(response: Response, status_code: int, error: str, retry_after: float) -> Dict[str, Any]:
+    """Answer a refused ingest with Retry-After (whole seconds, at least 1)."""
+    response.status_code = status_code
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return {"error": error, "retry_after": retry_after}
+
+
+async def _wait_for_messages(app_id: str, wait: float) -> bool:
+    """
+    Block until the app inbox is non-empty or `wait` seconds have passed.
+
+    Returns:
+        False if the app already has the maximum number of parked waiters
+    """
+    if backend.waiters(app_id) >= MCP_LONG_POLL_MAX_WAITERS:
+        return False
+    await backend.wait(app_id, min(wait, MCP_LONG_POLL_MAX_WAIT))
+    return True
+
+
+async def _event_stream(app_id: str, max_events: Optional[int]) -> AsyncIterator[bytes]:
+    """
+    Push contexts for an app as SSE frames as soon as they are routed.
+
+    At most MCP_SUBSCRIBER_BUFFER_SIZE contexts are leased from the inbox
+    ahead of the socket, and each is acked once it has been written. Anything
+    still buffered when the stream ends (client gone, slow consumer,
+    max_events reached) goes back to the front of the inbox.
+    """
+    buffer: Deque[Tuple[int, bytes]] = deque()
+    lease_id = None
+    sent = 0
+    try:
+        while max_events is None or sent < max_events:
+            if not buffer:
+                limit = MCP_SUBSCRIBER_BUFFER_SIZE
+                if max_events is not None:
+                    limit = min(limit, max_events - sent)
+                batch = await backend.pull(
+                    app_id,
+                    max_messages=limit,
+                    lease_seconds=MCP_SUBSCRIBER_SEND_TIMEOUT * MCP_SUBSCRIBER_BUFFER_SIZE,
+                    raw=True
+                )
+                buffer.extend(zip(batch["message_ids"], batch["messages"]))
+                lease_id = batch["lease_id"]
+            if not buffer:
+                if not await backend.wait(app_id, MCP_SUBSCRIBER_KEEPALIVE):
+                    yield encode_comment("keepalive")
+                continue
+
+            msg_id, payload = buffer.popleft()
+            yield encode_raw_event(payload, event="context")
+            # Resumed only once the frame was sent (see _SubscriberStream)
+            await backend.ack(app_id, message_ids=[msg_id])
+            _count_drained(app_id)
+            sent += 1
+    finally:
+        if lease_id is not None:
+            await backend.release(app_id, lease_id)
+
+
+class _SubscriberStream(StreamingResponse):
+    """
+    SSE response of one subscription: each send must finish within
+    MCP_SUBSCRIBER_SEND_TIMEOUT seconds, so a subscriber whose socket stops
+    draining is disconnected (and its leased contexts released) instead of
+    holding them until the lease expires. Counted in `subscribers` from
+    creation until the response is done.
+    """
+
+    def __init__(self, app_id: str, content: AsyncIterator[bytes]):
+        super().__init__(content, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+        self.app_id = app_id
+        subscribers[app_id] = subscribers.get(app_id, 0) + 1
+
+    async def stream_response(self, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        try:
+            async for chunk in self.body_iterator:
+                await asyncio.wait_for(
+                    send({"type": "http.response.body", "body": chunk, "more_body": True}),
+                    MCP_SUBSCRIBER_SEND_TIMEOUT
+                )
+        except asyncio.TimeoutError:
+            return  # Slow consumer: drop it so others can take over
+        finally:
+            # Shielded: on disconnect this runs cancelled, and the leased
+            # contexts must still be released
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            subscribers[self.app_id] -= 1
+
+
+@router.get("/subscribe/{app_id}")
+async def subscribe(app_id: str, response: Response, max_events: Optional[int] = None):
+    """
+    Stream contexts for an app over Server-Sent Events.
+    Each routed context is pushed as a `context` event instead of waiting to be
+    polled. Pass max_events to close the stream after that many contexts.
+    """
+    if not await _is_app(app_id):
+        response.status_code = 400
+        return {"error": f"Invalid app ID: {app_id}"}
+    if subscribers.get(app_id, 0) >= MCP_MAX_SUBSCRIBERS_PER_APP:
+        response.status_code = 429
+        return {"error": f"Too many subscribers for {app_id}"}
+
+    # Counted from here, before the stream starts, so the cap holds for
+    # subscriptions opened at the same time
+    return _SubscriberStream(app_id, _event_stream(app_id, max_events))
+
+
+def _messages_response(payloads: List[bytes], fields: Dict[str, Any], accept: Optional[str]) -> Response:
+    """
+    Encode a retrieval response around the stored JSON payloads. They are
+    spliced into the JSON body as is; only a MessagePack response decodes them.
+    """
+    if is_msgpack(accept):
+        body = {"messages": [loads(payload) for payload in payloads], **fields}
+        return Response(pack(body), media_type=MSGPACK_CONTENT_TYPE)
+    return Response(splice_messages(payloads, fields), media_type=JSON_CONTENT_TYPE)
+
+
+_SESSION_VERSION = b'"session_version"'
+
+
+async def _materialize(payloads: List[bytes]) -> List[bytes]:
+    """
+    Replace delta packages among stored payloads with their full contexts.
+    Stored deltas are re-encoded with their session_version stamp (see
+    _route), so only payloads containing it are decoded; the rest stay
+    spliced as stored.
+    """
+    candidates = [index for index, payload in enumerate(payloads) if _SESSION_VERSION in payload]
+    if not candidates:
+        return payloads
+    contexts = {index: loads(payloads[index]) for index in candidates}
+    deltas = [index for index in candidates if contexts[index].get("delta")]
+    if not deltas:
+        return payloads
+    expanded = await backend.materialize([contexts[index] for index in deltas])
+    payloads = list(payloads)
+    for index, context in zip(deltas, expanded):
+        payloads[index] = dumps(context)
+    return payloads
+
+
+async def _retrieve(
+    app_id: str,
+    max_messages: Optional[int],
+    max_bytes: Optional[int],
+    lease: Optional[float],
+    accept: Optional[str] = None,
+    materialize: bool = False
+) -> Response:
+    """Build a retrieval response, paged and/or leased when asked to."""
+    if max_messages is None and max_bytes is None and lease is None:
+        payloads = await backend.take(app_id, raw=True)  # Clear after retrieval
+        _count_drained(app_id, len(payloads))
+        if materialize and payloads:
+            payloads = await _materialize(payloads)
+        return _messages_response(payloads, {}, accept)
+
+    batch = await backend.pull(
+        app_id,
+        max_messages=max_messages,
+        max_bytes=max_bytes,
+        lease_seconds=min(lease, MCP_MAX_LEASE_SECONDS) if lease else None,
+        raw=True
+    )
+    _count_drained(app_id, len(batch["messages"]))
+    if materialize and batch["messages"]:
+        batch["messages"] = await _materialize(batch["messages"])
+    fields = {"message_ids": batch["message_ids"], "has_more": batch["has_more"]}
+    if lease:
+        # Passing this back as ?cursor= acks the page and fetches the next one
+        fields["next_cursor"] = batch["lease_id"]
+    return _messages_response(batch["messages"], fields, accept)
+
+
+async def _route(
+    app_id: str, context: Any, durable: bool = True, payload: Optional[bytes] = None
+) -> Tuple[int, Dict[str, Any]]:
+    """
+    Validate one context from `app_id` and queue it for its target app(s).
+    With durable=False the caller must sync the backend before acknowledging.
+    `payload` is the JSON the context was parsed from, stored verbatim when set.
+
+    A context goes to its target_app when it names one; otherwise to the apps
+    subscribed to its topic (default "from.<sender>"), never back to the
+    sender.
+
+    The context is checked against the MCP package schema and size limits
+    here, once, so malformed or oversize packages never reach an inbox.
+
+    Returns:
+        The HTTP status code for this context and its result body
+    """
+    if not context:
+        return 400, {"error": "Missing request data"}
+    if payload is None and isinstance(context, dict):
+        payload = dumps(context)  # Encoded here once to check its size
+    try:
+        validate_package(context, len(payload) if payload is not None else None)
+    except PackageError as e:
+        return e.status_code, {"error": str(e)}
+
+    # Handle message routing based on target or topic subscriptions
+    target_app = context.get("target_app")
+    if target_app:
+        if not await _is_app(target_app):
+            return 400, {"error": f"Invalid target app: {target_app}"}
+            
+        # Route to specific target
+        targets = [target_app]
+    else:
+        topic = context.get("topic") or default_topic(app_id)
+        try:
+            check_topic(topic)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        targets = [app for app in await backend.resolve(topic) if app != app_id]
+        if not targets:
+            return 404, {"error": f"No subscribers for topic: {topic}"}
+
+    if MCP_INGEST_BACKPRESSURE_DEPTH is not None:
+        # Refuse while a target is backed up, before its inbox overflows
+        for target in targets:
+            if await backend.depth(target) >= MCP_INGEST_BACKPRESSURE_DEPTH:
+                INGEST_REFUSED.labels(app_id, "backpressure").inc()
+                return 429, {
+                    "error": f"Inbox for {target} is backed up",
+                    "retry_after": MCP_INGEST_RETRY_AFTER
+                }
+
+    if context.get("conversation_id"):
+        version = await backend.record_session(context)
+        if version is None:
+            conversation_id = context["conversation_id"]
+            return 409, {"error": f"Unknown conversation {conversation_id}; send the full package"}
+        if context.get("delta"):
+            # Stamped so retrieval can expand it to the context it extends
+            context = {**context, "session_version": version}
+            payload = dumps(context)
+
+    priority, deadline = priority_of(context)
+    try:
+        await backend.put(
+            targets, context,
+            durable=durable, payload=payload, priority=priority, deadline=deadline
+        )
+    except InboxFull as e:
+        return 429, {"error": str(e), "retry_after": MCP_INGEST_RETRY_AFTER}
+    for target in targets:
+        _count_enqueued(target)
+    return 200, {"status": "success"}
+
 
 @router.post("/receive_context/{app_id}")
-async def receive_context(app_id: str, request: Request, response: Response):
+async def receive_context(
+    app_id: str,
+    request: Request,
+    response: Response,
+    wait: Optional[float] = None,
+    max_messages: Optional[int] = Query(None, ge=1),
+    max_bytes: Optional[int] = Query(None, ge=1),
+    lease: Optional[float] = Query(None, gt=0),
+    cursor: Optional[int] = None,
+    materialize: bool = False
+):
     """
     Handle context reception and retrieval.
     If request body is provided, store the context.
-    If no request body, return stored messages.
+    If no request body, return stored messages. With `wait` (seconds), an
+    empty inbox holds the request open until a message arrives or the wait
+    expires instead of returning immediately.
+
+    Retrieval can be bounded with `max_messages` / `max_bytes`. With `lease`
+    (seconds) the returned messages are hidden rather than removed, and are
+    redelivered unless acked before the lease expires; `cursor` acks the
+    page returned by the previous leased pull.
+
+    Contexts carrying a conversation_id update that conversation's session;
+    with "delta": true they only carry what was appended since the previous
+    package. Retrieval with `materialize=true` expands deltas back into full
+    contexts.
+
+    Contexts may be sent as MessagePack (Content-Type: application/msgpack),
+    and retrievals answer in MessagePack when the Accept header asks for it.
+
+    Ingest is refused with 429 and Retry-After while the sender is over its
+    rate or a target inbox is backed up, and with 503 while the worker is
+    already handling MCP_INGEST_MAX_IN_FLIGHT ingest requests.
     """
-    if app_id not in VALID_APPS:
+    global ingest_in_flight
+    if not await _is_app(app_id):
         response.status_code = 400
         return {"error": f"Invalid app ID: {app_id}"}
 
@@ -25,40 +443,297 @@ async def receive_context(app_id: str, request: Request, response: Response):
         body = await request.body()
         if not body:
             # No body means it's a retrieval request
-            messages = inbox[app_id]
-            inbox[app_id] = []  # Clear after retrieval
-            return {"messages": messages}
+            if cursor is not None:
+                await backend.ack(app_id, lease_id=cursor)
+
+            if wait and wait > 0 and not await backend.depth(app_id):
+                if not await _wait_for_messages(app_id, wait):
+                    response.status_code = 429
+                    return {"error": f"Too many long-poll waiters for {app_id}"}
+
+            return await _retrieve(
+                app_id, max_messages, max_bytes, lease, request.headers.get("accept"), materialize
+            )
 
+        if len(body) > MCP_PACKAGE_MAX_BYTES:
+            response.status_code = 413
+            return {"error": f"Context is larger than {MCP_PACKAGE_MAX_BYTES} bytes"}
+        if ingest_in_flight >= MCP_INGEST_MAX_IN_FLIGHT:
+            INGEST_REFUSED.labels(app_id, "in_flight").inc()
+            return _refuse(response, 503, "Server busy", MCP_INGEST_RETRY_AFTER)
+        retry_after = _rate_limited(app_id)
+        if retry_after is not None:
+            return _refuse(response, 429, f"Rate limit exceeded for {app_id}", retry_after)
+
+        content_type = request.headers.get("content-type")
+        started = time.perf_counter()
         try:
-            context = await request.json()
+            context = decode_body(body, content_type)
         except ValueError:
             response.status_code = 400
             return {"error": "Invalid JSON data"}
+        finally:
+            _parse_single.observe(time.perf_counter() - started)
 
-        if not context:
-            response.status_code = 400
-            return {"error": "Missing request data"}
+        # A JSON body is stored as received rather than re-encoded
+        payload = None if is_msgpack(content_type) else reusable_payload(body)
+        ingest_in_flight += 1
+        try:
+            response.status_code, result = await _route(app_id, context, payload=payload)
+        finally:
+            ingest_in_flight -= 1
+        if "retry_after" in result:
+            return _refuse(response, response.status_code, result["error"], result["retry_after"])
+        return result
+    except Exception as e:
+        response.status_code = 500
+        return {"error": str(e)}
 
-        # Handle message routing based on source app and target
-        target_app = context.get("target_app")
-        if target_app:
-            if target_app not in VALID_APPS:
-                response.status_code = 400
-                return {"error": f"Invalid target app: {target_app}"}
-                
-            # Route to specific target
-            inbox[target_app].append(context)
+
+async def _iter_ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+    """Yield non-blank lines of an NDJSON body as they arrive."""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
+
+
+@router.post("/receive_context/{app_id}/batch")
+async def receive_context_batch(app_id: str, request: Request, response: Response):
+    """
+    Ingest many contexts in one request.
+    The body is a JSON array of contexts, a MessagePack array when sent as
+    application/msgpack, or NDJSON (one context per line) when sent as
+    application/x-ndjson. Each context is routed exactly as by
+    /receive_context/{app_id}, and `results` holds one status per item, in
+    request order.
+
+    Admission control applies per context: an array over the sender's rate
+    is refused whole, NDJSON lines are refused one by one. When no context
+    is accepted and some were refused for now, the request answers 429 with
+    Retry-After so it can be retried as a whole.
+    """
+    global ingest_in_flight
+    if not await _is_app(app_id):
+        response.status_code = 400
+        return {"error": f"Invalid app ID: {app_id}"}
+    if ingest_in_flight >= MCP_INGEST_MAX_IN_FLIGHT:
+        INGEST_REFUSED.labels(app_id, "in_flight").inc()
+        return _refuse(response, 503, "Server busy", MCP_INGEST_RETRY_AFTER)
+
+    results = []
+
+    def record(status_code: int, result: Dict[str, Any]) -> None:
+        results.append({"index": len(results), "status_code": status_code, **result})
+
+    ingest_in_flight += 1
+    try:
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("application/x-ndjson"):
+            async for line in _iter_ndjson_lines(request):
+                started = time.perf_counter()
+                try:
+                    context = loads(line)
+                except ValueError:
+                    record(400, {"error": "Invalid JSON data"})
+                    continue
+                finally:
+                    _parse_ndjson.observe(time.perf_counter() - started)
+                retry_after = _rate_limited(app_id)
+                if retry_after is not None:
+                    record(429, {"error": f"Rate limit exceeded for {app_id}", "retry_after": retry_after})
+                    continue
+                record(*await _route(
+                    app_id, context, durable=False, payload=reusable_payload(line)
+                ))
         else:
-            # Default routing (AppA -> AppB, others broadcast except to self)
-            if app_id == "AppA":
-                inbox["AppB"].append(context)
-            else:
-                # Broadcast to all except sender
-                for app in VALID_APPS:
-                    if app != app_id:
-                        inbox[app].append(context)
-        
-        return {"status": "success"}
+            body = await request.body()
+            started = time.perf_counter()
+            try:
+                contexts = decode_body(body, content_type)
+            except ValueError:
+                response.status_code = 400
+                return {"error": "Invalid JSON data"}
+            finally:
+                _parse_batch.observe(time.perf_counter() - started)
+            if not isinstance(contexts, list):
+                response.status_code = 400
+                return {"error": "Expected a JSON array of contexts"}
+            retry_after = _rate_limited(app_id, len(contexts)) if contexts else None
+            if retry_after is not None:
+                return _refuse(response, 429, f"Rate limit exceeded for {app_id}", retry_after)
+            for context in contexts:
+                record(*await _route(app_id, context, durable=False))
     except Exception as e:
         response.status_code = 500
         return {"error": str(e)}
+    finally:
+        ingest_in_flight -= 1
+
+    if not results:
+        response.status_code = 400
+        return {"error": "Missing request data"}
+
+    accepted = sum(1 for result in results if result["status_code"] == 200)
+    if accepted:
+        await backend.sync()
+    retry_after = max((result["retry_after"] for result in results if "retry_after" in result), default=None)
+    if not accepted and retry_after is not None:
+        return _refuse(response, 429, "No contexts accepted; retry later", retry_after)
+    return {
+        "status": "success" if accepted == len(results) else "partial",
+        "accepted": accepted,
+        "results": results
+    }
+
+
+@router.post("/ack/{app_id}")
+async def ack_context(app_id: str, request: Request, response: Response):
+    """
+    Acknowledge leased contexts.
+    Body: {"cursor": <next_cursor of a leased pull>} and/or
+    {"message_ids": [...]}. With "release": true, any message_ids are acked
+    and the cursor's remaining contexts are returned to the inbox
+    immediately instead of being acked.
+    """
+    if not await _is_app(app_id):
+        response.status_code = 400
+        return {"error": f"Invalid app ID: {app_id}"}
+
+    try:
+        ack = await request.json()
+    except ValueError:
+        response.status_code = 400
+        return {"error": "Invalid JSON data"}
+    if not isinstance(ack, dict) or ("cursor" not in ack and "message_ids" not in ack):
+        response.status_code = 400
+        return {"error": "Missing cursor or message_ids"}
+
+    if ack.get("release"):
+        acked = await backend.ack(app_id, message_ids=ack.get("message_ids"))
+        released = await backend.release(app_id, ack["cursor"]) if "cursor" in ack else 0
+        return {"status": "success", "acked": acked, "released": released}
+
+    acked = await backend.ack(app_id, lease_id=ack.get("cursor"), message_ids=ack.get("message_ids"))
+    return {"status": "success", "acked": acked}
+
+
+@router.post("/apps/{app_id}")
+async def register_app(app_id: str, request: Request, response: Response):
+    """
+    Register an app so it can send and receive contexts. The optional body
+    {"subscriptions": [<topic pattern>, ...]} subscribes it at the same time.
+    Registering an app again adds the subscriptions to its existing ones.
+    """
+    if not APP_ID_PATTERN.match(app_id):
+        response.status_code = 400
+        return {"error": f"Invalid app ID: {app_id}"}
+    body = await request.body()
+    try:
+        registration = loads(body) if body else {}
+    except ValueError:
+        response.status_code = 400
+        return {"error": "Invalid JSON data"}
+    patterns = registration.get("subscriptions", []) if isinstance(registration, dict) else None
+    if not isinstance(patterns, list):
+        response.status_code = 400
+        return {"error": "subscriptions must be a list of topic patterns"}
+    try:
+        for pattern in patterns:
+            check_pattern(pattern)
+    except ValueError as e:
+        response.status_code = 400
+        return {"error": str(e)}
+
+    created = await backend.add_app(app_id)
+    for pattern in patterns:
+        await backend.subscribe(app_id, pattern)
+    known_apps.add(app_id)
+    if created:
+        response.status_code = 201
+    subscriptions = await backend.subscriptions()
+    return {"status": "success", "app_id": app_id, "subscriptions": subscriptions[app_id]}
+
+
+@router.post("/subscriptions/{app_id}")
+async def add_subscription(app_id: str, request: Request, response: Response):
+    """Subscribe a registered app to a topic pattern. Body: {"pattern": "..."}."""
+    if not await _is_app(app_id):
+        response.status_code = 400
+        return {"error": f"Invalid app ID: {app_id}"}
+    try:
+        subscription = await request.json()
+    except ValueError:
+        response.status_code = 400
+        return {"error": "Invalid JSON data"}
+    pattern = subscription.get("pattern") if isinstance(subscription, dict) else None
+    try:
+        check_pattern(pattern)
+    except ValueError as e:
+        response.status_code = 400
+        return {"error": str(e)}
+    added = await backend.subscribe(app_id, pattern)
+    return {"status": "success", "added": added}
+
+
+@router.delete("/subscriptions/{app_id}")
+async def remove_subscription(app_id: str, pattern: str, response: Response):
+    """Unsubscribe an app from a topic pattern (?pattern=...)."""
+    if not await _is_app(app_id):
+        response.status_code = 400
+        return {"error": f"Invalid app ID: {app_id}"}
+    if not await backend.unsubscribe(app_id, pattern):
+        response.status_code = 404
+        return {"error": f"{app_id} is not subscribed to {pattern}"}
+    return {"status": "success"}
+
+
+@router.get("/subscriptions")
+async def list_subscriptions():
+    """Topic patterns each registered app is subscribed to."""
+    return await backend.subscriptions()
+
+
+@router.get("/sessions/{conversation_id}")
+async def get_session(conversation_id: str, response: Response, since: Optional[int] = None):
+    """
+    Current state of a conversation session. With `since` (a version the
+    caller already has), only the memory items and turns added after it are
+    returned, marked "delta": true, when that version is still known.
+    """
+    state = await backend.session(conversation_id, since)
+    if state is None:
+        response.status_code = 404
+        return {"error": f"Unknown conversation: {conversation_id}"}
+    return state
+
+
+@router.get("/inbox/stats")
+async def inbox_stats():
+    """Report per-app inbox depth, overflow counters and memory use."""
+    return await backend.stats()
+
+
+@router.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics: inbox depth and traffic per app (and per priority,
+    with the time delivered contexts waited), parse timings.
+    """
+    stats = await backend.stats()
+    STORED_BYTES.labels().set(stats["stored_bytes"])
+    for app_id, app_stats in stats["apps"].items():
+        for key, gauge in INBOX_GAUGES.items():
+            gauge.labels(app_id).set(app_stats[key])
+        for key, counter in INBOX_COUNTERS.items():
+            counter.labels(app_id).set(app_stats[key])
+        for priority, priority_stats in app_stats["priorities"].items():
+            PRIORITY_DEPTH.labels(app_id, priority).set(priority_stats["depth"])
+            PRIORITY_DELIVERED.labels(app_id, priority).set(priority_stats["delivered"])
+            PRIORITY_WAIT.labels(app_id, priority).set(priority_stats["wait_seconds"])
+    return metrics_response()
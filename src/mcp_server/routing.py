@@ -0,0 +1,174 @@
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+# Topics are dot-separated words, e.g. "mail.reply.urgent". In a
+# subscription pattern "*" matches exactly one word and "#" zero or more.
+WILDCARD_ONE = "*"
+WILDCARD_ANY = "#"
+
+# App ids registered at runtime: letters, digits, "_" and "-"
+APP_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Resolved topics remembered between changes to the subscriptions
+ROUTE_CACHE_SIZE = 4096
+
+
+def default_topic(app_id: str) -> str:
+    """Topic of a context sent by `app_id` without a topic or target_app."""
+    return f"from.{app_id}"
+
+
+def check_pattern(pattern: str) -> None:
+    """
+    Raises:
+        ValueError: If `pattern` is not a valid topic pattern
+    """
+    if not isinstance(pattern, str) or not pattern or any(not word for word in pattern.split(".")):
+        raise ValueError(f"Invalid topic pattern: {pattern!r}")
+
+
+def check_topic(topic: str) -> None:
+    """
+    Raises:
+        ValueError: If `topic` is not a valid topic to publish on (a pattern
+            without wildcards)
+    """
+    check_pattern(topic)
+    words = topic.split(".")
+    if WILDCARD_ONE in words or WILDCARD_ANY in words:
+        raise ValueError(f"Invalid topic: {topic!r} (wildcards are for subscriptions)")
+
+
+class _Node:
+    """One word position of the wildcard trie."""
+
+    __slots__ = ("children", "apps")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.apps: Set[str] = set()
+
+
+class RoutingTable:
+    """
+    Registered apps and the topic patterns each subscribes to.
+
+    Patterns without wildcards go into a dict from topic to subscribers, so
+    resolving a plain topic is one lookup; wildcard patterns go into a trie
+    walked word by word, so resolution costs O(topic depth) however many
+    apps subscribe. Resolved topics are also cached until the subscriptions
+    next change.
+    """
+
+    def __init__(self, apps: Iterable[str] = (), subscriptions: Optional[Dict[str, List[str]]] = None):
+        self._apps: Dict[str, List[str]] = {}  # app_id -> its patterns, in registration order
+        self._exact: Dict[str, Set[str]] = {}
+        self._trie = _Node()
+        self._cache: Dict[str, List[str]] = {}
+        for app_id in apps:
+            self.add_app(app_id)
+        for app_id, patterns in (subscriptions or {}).items():
+            self.add_app(app_id)
+            for pattern in patterns:
+                self.subscribe(app_id, pattern)
+
+    def __contains__(self, app_id: str) -> bool:
+        return app_id in self._apps
+
+    @property
+    def apps(self) -> List[str]:
+        return list(self._apps)
+
+    def add_app(self, app_id: str) -> bool:
+        """
+        Register an app id.
+
+        Returns:
+            True if the app was not registered before
+
+        Raises:
+            ValueError: If `app_id` is not a valid app id
+        """
+        if app_id in self._apps:
+            return False
+        if not APP_ID_PATTERN.match(app_id):
+            raise ValueError(f"Invalid app ID: {app_id}")
+        self._apps[app_id] = []
+        return True
+
+    def subscribe(self, app_id: str, pattern: str) -> bool:
+        """
+        Subscribe a registered app to a topic pattern.
+
+        Returns:
+            True if the subscription is new
+        """
+        check_pattern(pattern)
+        patterns = self._apps[app_id]
+        if pattern in patterns:
+            return False
+        patterns.append(pattern)
+        self._subscribers(pattern, create=True).add(app_id)
+        self._cache.clear()
+        return True
+
+    def unsubscribe(self, app_id: str, pattern: str) -> bool:
+        """
+        Returns:
+            True if the app was subscribed to `pattern`
+        """
+        patterns = self._apps.get(app_id)
+        if not patterns or pattern not in patterns:
+            return False
+        patterns.remove(pattern)
+        self._subscribers(pattern, create=False).discard(app_id)
+        self._cache.clear()
+        return True
+
+    def subscriptions(self) -> Dict[str, List[str]]:
+        return {app_id: list(patterns) for app_id, patterns in self._apps.items()}
+
+    def resolve(self, topic: str) -> List[str]:
+        """Apps subscribed to `topic`, in registration order."""
+        apps = self._cache.get(topic)
+        if apps is not None:
+            return apps
+        matched = set(self._exact.get(topic, ()))
+        self._match(self._trie, topic.split("."), 0, matched)
+        apps = [app_id for app_id in self._apps if app_id in matched]
+        if len(self._cache) >= ROUTE_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[topic] = apps
+        return apps
+
+    def _subscribers(self, pattern: str, create: bool) -> Set[str]:
+        words = pattern.split(".")
+        if WILDCARD_ONE not in words and WILDCARD_ANY not in words:
+            if create:
+                return self._exact.setdefault(pattern, set())
+            return self._exact.get(pattern, set())
+        node = self._trie
+        for word in words:
+            child = node.children.get(word)
+            if child is None:
+                if not create:
+                    return set()
+                child = node.children[word] = _Node()
+            node = child
+        return node.apps
+
+    def _match(self, node: _Node, words: List[str], index: int, matched: Set[str]) -> None:
+        any_words = node.children.get(WILDCARD_ANY)
+        if any_words is not None:
+            # "#" swallows zero or more of the remaining words
+            for rest in range(index, len(words) + 1):
+                self._match(any_words, words, rest, matched)
+        if index == len(words):
+            matched.update(node.apps)
+            return
+        child = node.children.get(words[index])
+        if child is not None:
+            self._match(child, words, index + 1, matched)
+        one_word = node.children.get(WILDCARD_ONE)
+        if one_word is not None:
+            self._match(one_word, words, index + 1, matched)
@@ -0,0 +1,197 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from common.mcp_package import SESSION_FIELDS
+
+# (memory end, conversation end, system, current_task) as of one version.
+# Ends are absolute positions, counting items trimmed from the front.
+_Mark = Tuple[int, int, str, str]
+
+
+class _Session:
+    """Materialized state of one conversation plus the marks of recent versions."""
+
+    __slots__ = (
+        "system", "current_task", "memory", "conversation", "memory_base",
+        "conversation_base", "version", "marks", "touched"
+    )
+
+    def __init__(self):
+        self.system = ""
+        self.current_task = ""
+        self.memory: List[Any] = []
+        self.conversation: List[Any] = []
+        self.memory_base = 0  # Items trimmed from the front of memory
+        self.conversation_base = 0
+        self.version = 0
+        self.marks: "OrderedDict[int, _Mark]" = OrderedDict()
+        self.touched = time.monotonic()
+
+    def mark(self) -> _Mark:
+        return (
+            self.memory_base + len(self.memory),
+            self.conversation_base + len(self.conversation),
+            self.system,
+            self.current_task
+        )
+
+
+class SessionStore:
+    """
+    Conversation state kept by the MCP server so senders can send deltas.
+
+    A package with a conversation_id replaces that conversation's state; a
+    package that also sets "delta": true appends its memory items and turns
+    to the state instead (and replaces system / current_task if it carries
+    them). Each change bumps the conversation's version, and the state as of
+    the last max_versions versions can be materialized back into a full
+    package, so a queued delta expands to the context it was sent against.
+
+    At most max_sessions conversations are kept (least recently updated are
+    evicted first), each for ttl seconds after its last update, holding at
+    most max_memory_items memory items and max_turns turns (oldest trimmed).
+    """
+
+    def __init__(
+        self,
+        max_sessions: int,
+        ttl: float,
+        max_memory_items: int,
+        max_turns: int,
+        max_versions: int = 256
+    ):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_memory_items = max_memory_items
+        self.max_turns = max_turns
+        self.max_versions = max_versions
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def apply(self, package: Dict[str, Any]) -> Optional[int]:
+        """
+        Fold a package into its conversation.
+
+        Args:
+            package: A validated package with a conversation_id
+
+        Returns:
+            The conversation's new version, or None for a delta whose
+            conversation is unknown (never started, or expired)
+        """
+        conversation_id = package["conversation_id"]
+        session = self._get(conversation_id)
+        if package.get("delta"):
+            if session is None:
+                return None
+            session.memory.extend(package.get("memory", ()))
+            session.conversation.extend(package.get("conversation", ()))
+        else:
+            if session is None:
+                session = _Session()
+            # Earlier versions describe the replaced state, so forget them
+            session.memory = list(package.get("memory", ()))
+            session.conversation = list(package.get("conversation", ()))
+            session.memory_base = session.conversation_base = 0
+            session.marks.clear()
+        if "system" in package or not package.get("delta"):
+            session.system = package.get("system", "")
+        if "current_task" in package or not package.get("delta"):
+            session.current_task = package.get("current_task", "")
+        self._trim(session)
+
+        session.version += 1
+        session.marks[session.version] = session.mark()
+        while len(session.marks) > self.max_versions:
+            session.marks.popitem(last=False)
+        session.touched = time.monotonic()
+        self._sessions[conversation_id] = session
+        self._sessions.move_to_end(conversation_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+        return session.version
+
+    def materialize(self, package: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Expand a stamped delta (see apply) into the full package as of its
+        version. Anything else, or a delta whose state is no longer held, is
+        returned unchanged.
+        """
+        if not package.get("delta"):
+            return package
+        session = self._get(package.get("conversation_id"))
+        mark = session.marks.get(package.get("session_version")) if session else None
+        if mark is None:
+            return package
+        memory_end, conversation_end, system, current_task = mark
+        full = {field: value for field, value in package.items() if field not in SESSION_FIELDS}
+        del full["delta"]
+        full.update(
+            conversation_id=package["conversation_id"],
+            system=system,
+            memory=session.memory[:max(0, memory_end - session.memory_base)],
+            conversation=session.conversation[:max(0, conversation_end - session.conversation_base)],
+            current_task=current_task
+        )
+        return full
+
+    def get(self, conversation_id: str, since: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Current state of a conversation, whole or as a delta.
+
+        Args:
+            conversation_id: The conversation
+            since: A version the caller already holds; only what was appended
+                after it is returned, unless it is too old to diff against
+
+        Returns:
+            The state with its `version` (and `delta`: true when diffed), or
+            None for an unknown conversation
+        """
+        session = self._get(conversation_id)
+        if session is None:
+            return None
+        state = {
+            "conversation_id": conversation_id,
+            "version": session.version,
+            "system": session.system,
+            "current_task": session.current_task
+        }
+        mark = session.marks.get(since) if since is not None else None
+        if (
+            mark is not None
+            and mark[0] >= session.memory_base
+            and mark[1] >= session.conversation_base
+        ):
+            state["delta"] = True
+            state["memory"] = session.memory[mark[0] - session.memory_base:]
+            state["conversation"] = session.conversation[mark[1] - session.conversation_base:]
+        else:
+            state["memory"] = list(session.memory)
+            state["conversation"] = list(session.conversation)
+        return state
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sessions": len(self._sessions), "evicted": self.evicted}
+
+    def _get(self, conversation_id: Optional[str]) -> Optional[_Session]:
+        session = self._sessions.get(conversation_id)
+        if session is not None and time.monotonic() - session.touched > self.ttl:
+            del self._sessions[conversation_id]
+            self.evicted += 1
+            return None
+        return session
+
+    def _trim(self, session: _Session) -> None:
+        extra = len(session.memory) - self.max_memory_items
+        if extra > 0:
+            del session.memory[:extra]
+            session.memory_base += extra
+        extra = len(session.conversation) - self.max_turns
+        if extra > 0:
+            del session.conversation[:extra]
+            session.conversation_base += extra
@@ -0,0 +1,366 @@
+import asyncio
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+# How appends reach the disk
+FSYNC_ALWAYS = "always"  # fsync inside every append
+FSYNC_GROUP = "group"    # a background thread fsyncs pending appends together
+FSYNC_NONE = "none"      # leave it to the OS page cache
+
+# Record types
+OP_PUT = b"P"         # a context stored for one or more apps
+OP_REMOVE = b"R"      # contexts that left an app's inbox for good
+OP_CHECKPOINT = b"C"  # first record of a checkpoint file
+
+# Every record is framed as <body length><CRC32 of body>, big-endian
+_FRAME = struct.Struct(">II")
+
+_SEGMENT_NAME = re.compile(r"^wal-(\d+)\.log$")
+_CHECKPOINT_NAME = re.compile(r"^checkpoint-(\d+)\.ckpt$")
+
+
+def _segment_name(number: int) -> str:
+    return f"wal-{number:06d}.log"
+
+
+def _checkpoint_name(number: int) -> str:
+    return f"checkpoint-{number:06d}.ckpt"
+
+
+def encode_record(op: bytes, header: Dict[str, Any], payload: bytes = b"") -> bytes:
+    """Frame one record: op byte, JSON header line, then the raw payload."""
+    body = op + json.dumps(header, separators=(",", ":")).encode() + b"\n" + payload
+    return _FRAME.pack(len(body), zlib.crc32(body)) + body
+
+
+def iter_records(data: bytes) -> Iterator[Tuple[bytes, Dict[str, Any], bytes]]:
+    """
+    Decode the records in `data`, stopping at the first torn or corrupt one
+    (a crash mid-append leaves at most one at the end of a segment).
+
+    Yields:
+        (op, header, payload) tuples
+    """
+    offset = 0
+    while offset + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(data, offset)
+        body = data[offset + _FRAME.size:offset + _FRAME.size + length]
+        if len(body) < length or zlib.crc32(body) != crc:
+            return
+        header, payload = body[1:].split(b"\n", 1)
+        yield body[:1], json.loads(header), payload
+        offset += _FRAME.size + length
+
+
+def _fsync_dir(directory: str) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+    """
+    Append-only, segmented journal of an InboxStore.
+
+    Attached to a store (store.journal = wal), it records each context before
+    the store queues it and each context that leaves an inbox. Segments roll
+    over at segment_bytes. A checkpoint writes every live context to a
+    checkpoint file and deletes the segments it covers, so recovery only
+    replays the log written since the last checkpoint.
+
+    Appends get a log sequence number (LSN); `await sync(lsn)` returns once
+    that record is on disk. With the group policy one fsync covers every
+    append made during the preceding group_commit_ms, so many concurrent
+    requests share a single disk flush; a segment that rolls over is handed
+    to the group-commit thread to fsync, so appends never wait on the disk.
+    maybe_checkpoint() snapshots the store and writes the checkpoint on a
+    background thread, so ingest does not stall on it either.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        fsync: str = FSYNC_GROUP,
+        group_commit_ms: float = 5.0,
+        segment_bytes: int = 64 * 1024 * 1024,
+        checkpoint_records: int = 100000
+    ):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_GROUP, FSYNC_NONE):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fsync = fsync
+        self.group_commit = group_commit_ms / 1000.0
+        self.segment_bytes = segment_bytes
+        self.checkpoint_records = checkpoint_records
+        self.store = None
+
+        self._lock = threading.Lock()
+        self._lsn = 0
+        self._durable_lsn = 0
+        self._waiters: List[Tuple[int, asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._records_since_checkpoint = 0
+        self._retired: List[Any] = []  # Rolled-over segment files the flusher has yet to fsync
+        self._checkpointer: Optional[threading.Thread] = None
+        self.fsyncs = 0
+
+        segments = self._numbers(_SEGMENT_NAME)
+        self._segment_number = segments[-1] + 1 if segments else 1
+        self._file = open(self._path(_segment_name(self._segment_number)), "ab")
+        self._segment_size = 0
+
+        self._closed = False
+        self._dirty = threading.Event()
+        self._flusher = None
+        if fsync == FSYNC_GROUP:
+            self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+            self._flusher.start()
+
+    @property
+    def last_lsn(self) -> int:
+        return self._lsn
+
+    # Journal hooks called by InboxStore
+
+    def record_put(self, msg_id: int, app_ids: List[str], payload: bytes) -> None:
+        self._append(encode_record(OP_PUT, {"id": msg_id, "apps": list(app_ids)}, payload))
+
+    def record_remove(self, app_id: str, message_ids: List[int]) -> None:
+        self._append(encode_record(OP_REMOVE, {"app": app_id, "ids": list(message_ids)}))
+
+    async def sync(self, lsn: Optional[int] = None) -> None:
+        """Wait until every record up to `lsn` (default: the latest) is durable."""
+        lsn = self._lsn if lsn is None else lsn
+        with self._lock:
+            if self._durable_lsn >= lsn:
+                return
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._waiters.append((lsn, loop, waiter))
+        await waiter
+
+    def attach(self, store) -> int:
+        """
+        Recover `store` from the log, then journal its changes from now on.
+
+        Returns:
+            Number of contexts restored
+        """
+        entries, next_id = self._load()
+        store.restore(entries, next_id=next_id)
+        self.store = store
+        store.journal = self
+        self.checkpoint()
+        return len(entries)
+
+    def maybe_checkpoint(self) -> None:
+        """
+        Start a background checkpoint once checkpoint_records records have
+        been appended since the last one (unless one is still being written).
+        """
+        if (
+            self.store is not None
+            and self._records_since_checkpoint >= self.checkpoint_records
+            and (self._checkpointer is None or not self._checkpointer.is_alive())
+        ):
+            self.checkpoint(background=True)
+
+    def checkpoint(self, background: bool = False) -> None:
+        """
+        Write the attached store's live contexts to a checkpoint file and
+        delete the segments (and older checkpoint) it supersedes.
+
+        Must be called between store mutations, never from inside a journal
+        hook, so the snapshot and the log agree. Only the snapshot is taken
+        here; with `background` the file is written on a separate thread.
+        """
+        with self._lock:
+            self._rotate()
+            number = self._segment_number
+            self._records_since_checkpoint = 0
+            next_id = self.store.next_id
+            entries = self.store.snapshot()
+        if background:
+            self._checkpointer = threading.Thread(
+                target=self._write_checkpoint, args=(number, next_id, entries), daemon=True
+            )
+            self._checkpointer.start()
+        else:
+            self._write_checkpoint(number, next_id, entries)
+
+    def _write_checkpoint(self, number: int, next_id: int, entries: List[Tuple[int, List[str], bytes]]) -> None:
+        path = self._path(_checkpoint_name(number))
+        with open(path + ".tmp", "wb") as f:
+            f.write(encode_record(OP_CHECKPOINT, {"next_id": next_id}))
+            for msg_id, app_ids, payload in entries:
+                f.write(encode_record(OP_PUT, {"id": msg_id, "apps": app_ids}, payload))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        _fsync_dir(self.directory)
+
+        for old in self._numbers(_SEGMENT_NAME):
+            if old < number:
+                os.remove(self._path(_segment_name(old)))
+        for old in self._numbers(_CHECKPOINT_NAME):
+            if old < number:
+                os.remove(self._path(_checkpoint_name(old)))
+
+    def close(self) -> None:
+        """
+        Flush and fsync outstanding records, and stop the group-commit thread
+        once any checkpoint being written has finished.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._checkpointer is not None:
+            self._checkpointer.join()
+        self._dirty.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            self._sync_retired()
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._mark_durable(self._lsn)
+
+    def _append(self, record: bytes) -> None:
+        with self._lock:
+            if self._segment_size >= self.segment_bytes:
+                self._rotate()
+            self._file.write(record)
+            self._segment_size += len(record)
+            self._lsn += 1
+            self._records_since_checkpoint += 1
+            lsn = self._lsn
+            if self.fsync != FSYNC_GROUP:
+                self._file.flush()
+                if self.fsync == FSYNC_ALWAYS:
+                    os.fsync(self._file.fileno())
+                    self.fsyncs += 1
+                self._durable_lsn = lsn
+        if self.fsync == FSYNC_GROUP:
+            self._dirty.set()
+
+    def _rotate(self) -> None:
+        # Caller holds the lock. Records in the old segment may not have been
+        # fsynced yet under the group policy; the group-commit thread syncs
+        # the segment before it next marks anything durable.
+        self._file.flush()
+        if self.fsync == FSYNC_GROUP:
+            self._retired.append(self._file)
+            self._dirty.set()
+        else:
+            self._file.close()  # Already synced by each append, or never
+        self._segment_number += 1
+        self._file = open(self._path(_segment_name(self._segment_number)), "ab")
+        self._segment_size = 0
+
+    def _run_flusher(self) -> None:
+        while True:
+            self._dirty.wait()
+            if self._closed:
+                return
+            # Let concurrent appends pile up so one fsync covers all of them
+            threading.Event().wait(self.group_commit)
+            with self._lock:
+                if self._closed:
+                    return  # close() flushes whatever is left
+                self._dirty.clear()
+                self._file.flush()
+                lsn = self._lsn
+                retired, self._retired = self._retired, []
+                fd = os.dup(self._file.fileno())
+            try:
+                for old in retired:
+                    os.fsync(old.fileno())
+                    old.close()
+                    self.fsyncs += 1
+                os.fsync(fd)
+                self.fsyncs += 1
+            finally:
+                os.close(fd)
+            self._mark_durable(lsn)
+
+    def _sync_retired(self) -> None:
+        # Caller holds the lock
+        for old in self._retired:
+            os.fsync(old.fileno())
+            old.close()
+            self.fsyncs += 1
+        self._retired = []
+
+    def _mark_durable(self, lsn: int) -> None:
+        with self._lock:
+            self._durable_lsn = max(self._durable_lsn, lsn)
+            ready = [w for w in self._waiters if w[0] <= self._durable_lsn]
+            self._waiters = [w for w in self._waiters if w[0] > self._durable_lsn]
+        for _, loop, waiter in ready:
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+            except RuntimeError:
+                pass  # The request's event loop has already closed
+
+    def _load(self) -> Tuple[List[Tuple[int, List[str], bytes]], int]:
+        """Rebuild the live contexts from the latest checkpoint plus later segments."""
+        live: Dict[int, Tuple[bytes, Set[str]]] = {}
+        next_id = 1
+        checkpoints = self._numbers(_CHECKPOINT_NAME)
+        start = checkpoints[-1] if checkpoints else 0
+        if checkpoints:
+            for op, header, payload in self._read(_checkpoint_name(start)):
+                if op == OP_CHECKPOINT:
+                    next_id = header["next_id"]
+                elif op == OP_PUT:
+                    live[header["id"]] = (payload, set(header["apps"]))
+
+        for number in self._numbers(_SEGMENT_NAME):
+            if number < start:
+                continue
+            for op, header, payload in self._read(_segment_name(number)):
+                if op == OP_PUT:
+                    live[header["id"]] = (payload, set(header["apps"]))
+                    next_id = max(next_id, header["id"] + 1)
+                elif op == OP_REMOVE:
+                    for msg_id in header["ids"]:
+                        entry = live.get(msg_id)
+                        if entry is not None:
+                            entry[1].discard(header["app"])
+                            if not entry[1]:
+                                del live[msg_id]
+
+        entries = [
+            (msg_id, sorted(apps), payload)
+            for msg_id, (payload, apps) in sorted(live.items())
+        ]
+        return entries, next_id
+
+    def _read(self, name: str) -> Iterator[Tuple[bytes, Dict[str, Any], bytes]]:
+        with open(self._path(name), "rb") as f:
+            data = f.read()
+        return iter_records(data)
+
+    def _numbers(self, pattern: "re.Pattern") -> List[int]:
+        return sorted(
+            int(match.group(1))
+            for match in map(pattern.match, os.listdir(self.directory))
+            if match
+        )
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
@@ -42,3 +42,155 @@ def test_summarize_endpoint_invalid_json(app_a_client):
         headers={"Content-Type": "application/json"}
     )
     assert response.status_code == 422  # FastAPI validation error
+
+@patch('src.app_a.app.send_mcp_to_server')
+def test_summarize_endpoint_streams_summary(mock_send, app_a_client, test_email):
+    """Test ?stream=true streams the summary and sends it once complete."""
+    async def fake_stream(prompt):
+        for chunk in ("Refund ", "request"):
+            yield chunk
+
+    mock_send.return_value = {"status": "success"}
+    with patch('src.app_a.app.stream_openai_chat', new=fake_stream):
+        response = app_a_client.post("/summarize?stream=true", json={"email": test_email})
+    assert response.status_code == 200
+    assert response.text.count("event: token") == 2
+    assert 'event: done\ndata: {"status": "sent", "summary": "Refund request"}' in response.text
+    mock_send.assert_called_once()
+
+
+@patch('src.app_a.app.send_mcp_to_server')
+def test_summarize_async_job(mock_send, test_email):
+    """Test ?async=true returns a job id at once and the job finishes in the background."""
+    import time
+    from src.app_a.app import app
+
+    async def fake_chat(prompt):
+        return "Refund request"
+
+    mock_send.return_value = {"status": "success"}
+    with patch('src.app_a.app.call_openai_chat', new=fake_chat), TestClient(app) as client:
+        response = client.post("/summarize?async=true", json={"email": test_email})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        for _ in range(100):
+            job = client.get(f"/jobs/{job_id}").json()
+            if job["status"] == "done":
+                break
+            time.sleep(0.01)
+        assert job["result"] == {"status": "sent", "summary": "Refund request"}
+        assert client.get("/jobs/unknown").status_code == 404
+    mock_send.assert_called_once()
+
+def test_summaries_micro_batched():
+    """Test emails sent together share one OpenAI request and get their own summary."""
+    import asyncio
+    import json
+    from src.app_a import summarizer
+
+    prompts = []
+
+    async def fake_chat(prompt):
+        prompts.append(prompt)
+        return "```json\n" + json.dumps(["First", "Second", "Third"]) + "\n```"
+
+    async def run():
+        return await asyncio.gather(*(
+            summarizer.summarize_batched(f"Batched email {n}") for n in range(3)
+        ))
+
+    with patch.object(summarizer, "call_openai_chat", new=fake_chat):
+        assert asyncio.run(run()) == ["First", "Second", "Third"]
+    assert len(prompts) == 1 and "Email 3:" in prompts[0]
+    assert summarizer.parse_batch_summaries('["only one"]', 2) is None
+
+def test_thread_summaries_sent_as_deltas():
+    """Test later summaries of a thread go out as deltas and reach App B in full."""
+    import asyncio
+    import json
+    import httpx
+    from mcp_server import router as mcp_router
+    from mcp_server.sessions import SessionStore
+    from src.app_a import app as app_a_app
+    from src.app_b import mcp_handler as app_b_mcp
+    from src.mcp_server.app import app as mcp_app
+
+    transport = httpx.ASGITransport(app=mcp_app)
+    sent = []
+
+    async def post(url, **kwargs):
+        sent.append(json.loads(kwargs["content"]))
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.post(url, **kwargs)
+
+    def summarize(summary):
+        request = app_a_app.EmailRequest(email="Where is my order?", conversation_id="thread-e2e")
+        return app_a_app._send_summary(summary, request)
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            with patch.object(app_b_mcp, "get_client", return_value=client):
+                await app_b_mcp.poll_mcp_server()  # Drain App B's inbox
+                await summarize("First")
+                await summarize("Second")
+                polled = await app_b_mcp.poll_mcp_server()
+                # The server forgets the conversation: the delta is refused and resent whole
+                forgetful = SessionStore(max_sessions=10, ttl=60, max_memory_items=10, max_turns=10)
+                with patch.object(mcp_router.backend, "sessions", forgetful):
+                    await summarize("Third")
+                return polled["messages"]
+
+    with patch("app_a.mcp_handler.post_with_backoff", new=post):
+        messages = asyncio.run(run())
+
+    turns = [{"role": "user", "content": text} for text in ("First", "Second", "Third")]
+    assert sent[0]["conversation"] == turns[:1] and "delta" not in sent[0]
+    assert sent[1] == {"conversation_id": "thread-e2e", "delta": True, "conversation": turns[1:2]}
+    assert [m["conversation"] for m in messages] == [turns[:1], turns[:2]]
+    assert messages[1]["system"] == "You are a CRM assistant." and "delta" not in messages[1]
+    assert sent[2]["delta"] is True and sent[3]["conversation"] == turns and "delta" not in sent[3]
+
+def test_job_callbacks_limited_to_allowed_hosts():
+    """Test callback URLs off the allowlist are refused and callbacks share one client."""
+    import asyncio
+    import httpx
+    from src.app_a.jobs import JobQueue
+
+    async def handler(payload):
+        return {"summary": payload}
+
+    async def run():
+        queue = JobQueue(handler, workers=1, max_queued=10, max_kept=10, callback_hosts=["hooks.example.com"])
+        for url in (
+            "http://hooks.example.com/done", "https://169.254.169.254/latest",
+            "https://localhost/done", "https://user@hooks.example.com/done", "not a url"
+        ):
+            with pytest.raises(ValueError):
+                queue.submit("email", callback_url=url)
+        posted = []
+
+        async def post(url, json):
+            posted.append((url, json["status"]))
+            return httpx.Response(200, request=httpx.Request("POST", url))
+
+        job = queue.submit("email", callback_url="https://hooks.example.com/done")
+        client = queue._client
+        with patch.object(client, "post", new=post):
+            for _ in range(100):
+                if posted:
+                    break
+                await asyncio.sleep(0.01)
+        await queue.close()
+        return job, posted, client
+
+    job, posted, client = asyncio.run(run())
+    assert posted == [("https://hooks.example.com/done", "done")] and job.result == {"summary": "email"}
+    assert client.is_closed
+
+def test_summarize_rejects_disallowed_callback(app_a_client, test_email):
+    """Test /summarize?async=true answers 400 for a callback_url off the allowlist."""
+    response = app_a_client.post(
+        "/summarize?async=true", json={"email": test_email, "callback_url": "http://127.0.0.1:8001/admin"}
+    )
+    assert response.status_code == 400
+    assert "callback_url" in response.json()["detail"]
@@ -1,6 +1,11 @@
+import asyncio
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch
+from src.app_b.dedup import NearDuplicateIndex
+from src.app_b.prompt_builder import PromptBuilder
+from src.common.sse import iter_events
 
 @patch('src.app_b.app.poll_mcp_server')
 def test_poll_endpoint_no_messages(mock_poll, app_b_client):
@@ -46,3 +51,268 @@ def test_poll_endpoint_method_not_allowed(app_b_client):
     """Test polling with incorrect HTTP method."""
     response = app_b_client.post("/poll")
     assert response.status_code == 405  # Method not allowed
+
+@patch('src.app_b.app.poll_mcp_server')
+def test_poll_endpoint_passes_wait(mock_poll, app_b_client):
+    """Test the long-poll wait is forwarded to the MCP server poll."""
+    mock_poll.return_value = {"messages": []}
+    response = app_b_client.get("/poll?wait=2.5")
+    assert response.status_code == 200
+    mock_poll.assert_called_once_with(wait=2.5, max_messages=None, lease=None)
+
+@patch('src.app_b.app.ack_mcp_messages')
+@patch('src.app_b.app.call_claude')
+@patch('src.app_b.app.poll_mcp_server')
+def test_poll_endpoint_acks_leased_chunk(mock_poll, mock_claude, mock_ack, app_b_client):
+    """Test a bounded poll acks its lease once every reply is generated."""
+    mock_poll.return_value = {
+        "messages": [{"current_task": "Reply"}],
+        "message_ids": [7],
+        "has_more": True,
+        "next_cursor": 3
+    }
+    mock_claude.return_value = "Done"
+    response = app_b_client.get("/poll?max_messages=1")
+    assert response.status_code == 200
+    assert response.json()["has_more"] is True
+    mock_ack.assert_called_once_with(3)
+
+@patch('src.app_b.app.ack_mcp_messages')
+@patch('src.app_b.app.call_claude')
+@patch('src.app_b.app.poll_mcp_server')
+def test_poll_endpoint_reports_per_message_errors(mock_poll, mock_claude, mock_ack, app_b_client):
+    """Test one failed reply does not abort the rest of the batch."""
+    messages = [{"current_task": f"Task {n}"} for n in range(3)]
+    mock_poll.return_value = {
+        "messages": messages,
+        "message_ids": [10, 11, 12],
+        "next_cursor": 4
+    }
+
+    async def fake_claude(prompt):
+        if "Task 1" in prompt:
+            raise RuntimeError("Anthropic API request failed: 529")
+        return prompt.split("Task: ")[1]
+
+    mock_claude.side_effect = fake_claude
+    response = app_b_client.get("/poll?max_messages=3")
+    data = response.json()
+    assert data["replies"] == ["Task 0", None, "Task 2"]
+    assert data["errors"] == [{"index": 1, "error": "Anthropic API request failed: 529"}]
+    assert "529" in data["claude_error"]
+    # Successful replies are acked, the failed one goes back for redelivery
+    mock_ack.assert_called_once_with(4, release=True, message_ids=[10, 12])
+
+@patch('src.app_b.app.call_claude')
+@patch('src.app_b.app.poll_mcp_server')
+def test_poll_endpoint_generates_replies_concurrently(mock_poll, mock_claude, app_b_client):
+    """Test Claude calls for a batch overlap instead of running one by one."""
+    mock_poll.return_value = {"messages": [{"current_task": str(n)} for n in range(5)]}
+    in_flight = {"now": 0, "peak": 0}
+
+    async def slow_claude(prompt):
+        in_flight["now"] += 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        await asyncio.sleep(0.05)
+        in_flight["now"] -= 1
+        return "ok"
+
+    mock_claude.side_effect = slow_claude
+    response = app_b_client.get("/poll")
+    assert response.json()["replies"] == ["ok"] * 5
+    assert in_flight["peak"] > 1
+
+def test_cache_stats_endpoint(app_b_client):
+    """Test the LLM cache counters are exposed."""
+    response = app_b_client.get("/cache/stats")
+    assert response.status_code == 200
+    assert {"hits", "misses", "evictions"} <= response.json().keys()
+
+@patch('src.app_b.app.ack_mcp_messages')
+@patch('src.app_b.app.poll_mcp_server')
+def test_poll_endpoint_streams_replies(mock_poll, mock_ack, app_b_client):
+    """Test replies stream as SSE token events and the page is acked at the end."""
+    mock_poll.return_value = {
+        "messages": [{"current_task": "A"}, {"current_task": "B"}],
+        "message_ids": [1, 2],
+        "next_cursor": 9
+    }
+
+    async def fake_stream(prompt):
+        for chunk in ("Hel", "lo"):
+            yield chunk
+
+    with patch('src.app_b.app.stream_claude', new=fake_stream):
+        response = app_b_client.get("/poll?max_messages=2&stream=true")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text.count("event: token") == 4
+    events = list(iter_events(response.text.splitlines()))
+    assert events[0] == {"received_messages": mock_poll.return_value["messages"]}
+    assert "".join(e["text"] for e in events if e.get("index") == 0 and "text" in e) == "Hello"
+    assert events[-1] == {"replies": 2, "errors": 0}
+    mock_ack.assert_called_once_with(9)
+
+def test_stream_claude_parses_provider_events():
+    """Test Anthropic SSE deltas are yielded as text chunks."""
+    from src.common import llm_providers
+
+    body = (
+        'event: message_start\ndata: {"type": "message_start"}\n\n'
+        'event: content_block_delta\ndata: {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Hi"}}\n\n'
+        'event: content_block_delta\ndata: {"type": "content_block_delta", "delta": {"type": "text_delta", "text": " there"}}\n\n'
+        'event: message_stop\ndata: {"type": "message_stop"}\n\n'
+    )
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body.encode()))
+
+    async def collect():
+        client = httpx.AsyncClient(transport=transport)
+        provider = llm_providers.AnthropicProvider("http://llm.test/v1/messages", "key", "claude")
+        with patch.object(llm_providers, "get_client", return_value=client):
+            return [chunk async for chunk in provider.stream("prompt")]
+
+    assert asyncio.run(collect()) == ["Hi", " there"]
+
+def test_prompt_builder_renders_and_budgets():
+    """Test prompts render in the package layout and drop the oldest turns over budget."""
+    package = {
+        "system": "You are a CRM assistant.",
+        "memory": ["Frequent buyer"],
+        "conversation": [{"role": "user", "content": "Hello"}],
+        "current_task": "Reply"
+    }
+    built = PromptBuilder().build(package)
+    assert built.text == (
+        "System: You are a CRM assistant.\n\nContext:\n- Frequent buyer\n\n"
+        "Conversation:\nuser: Hello\n\nTask: Reply"
+    )
+    assert set(built.sections) == {"system", "memory", "conversation", "task"}
+
+    turns = [{"role": "user", "content": f"turn {n} " + "x" * 400} for n in range(20)]
+    built = PromptBuilder(max_tokens=600).build({**package, "conversation": turns})
+    assert built.tokens <= 600
+    assert built.omitted_turns > 0
+    assert "turn 19" in built.text and "turn 0 " not in built.text
+    assert f"[{built.omitted_turns} earlier messages omitted]" in built.text
+
+def test_prompt_builder_renders_only_new_turns():
+    """Test a growing thread reuses the turns rendered for its earlier packages."""
+    builder = PromptBuilder()
+    turns = [{"role": "user", "content": "first"}]
+    builder.build({"conversation_id": "t1", "conversation": turns})
+    rendered = builder._conversations["t1"]
+    turns = turns + [{"role": "assistant", "content": "second"}]
+    built = builder.build({"conversation_id": "t1", "conversation": turns})
+    assert builder._conversations["t1"].lines[0] is rendered.lines[0]
+    assert built.text == "Conversation:\nuser: first\nassistant: second\n"
+    edited = [{"role": "user", "content": "changed"}] + turns[1:]
+    assert "user: changed" in builder.build({"conversation_id": "t1", "conversation": edited}).text
+
+@patch('src.app_b.app.APP_B_DEDUP_ENABLED', True)
+@patch('src.app_b.app.call_claude')
+@patch('src.app_b.app.poll_mcp_server')
+def test_near_duplicate_prompts_reuse_reply(mock_poll, mock_claude, app_b_client):
+    """Test prompts differing only in greeting and order number share one Claude call."""
+    email = (
+        "{greeting}, the customer is asking for a refund on order #{order} because the "
+        "blender arrived with a cracked jug and a motor that stops after a few seconds. "
+        "They have been buying from us for years and would like a replacement shipped "
+        "quickly, ideally before the weekend, along with a prepaid label to return the "
+        "broken unit. They also asked whether the extended warranty covers this."
+    )
+    other = "Customer wants to move next week's subscription box delivery to their new office downtown."
+    mock_poll.return_value = {"messages": [
+        {"conversation": [{"role": "user", "content": email.format(greeting="Hi John", order=12345)}]},
+        {"conversation": [{"role": "user", "content": email.format(greeting="Hello John", order=99881)}]},
+        {"conversation": [{"role": "user", "content": other}]}
+    ]}
+
+    async def claude(prompt):
+        await asyncio.sleep(0.01)
+        return "refund" if "refund" in prompt else "delivery"
+
+    mock_claude.side_effect = claude
+    index = NearDuplicateIndex(threshold=0.7, window=16, ttl=60)
+    with patch('src.app_b.app.reply_index', index):
+        response = app_b_client.get("/poll")
+    assert response.json()["replies"] == ["refund", "refund", "delivery"]
+    assert mock_claude.call_count == 2
+    assert index.stats() == {"hits": 1, "misses": 2, "entries": 2}
+    assert index.sign("too short") is None
+
+def test_near_duplicate_waiter_survives_cancelled_call():
+    """Test a near-duplicate waiting on a cancelled call makes its own instead of being cancelled."""
+    prompt = " ".join(f"word{chr(97 + n % 26)}{chr(97 + n // 26)}" for n in range(40))
+    index = NearDuplicateIndex(threshold=0.8, window=16, ttl=60)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "reply"
+
+    async def run():
+        leader = asyncio.create_task(index.get_or_call(prompt, call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(index.get_or_call(prompt, call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == "reply"
+    assert len(calls) == 2
+
+@patch('src.app_b.app.stream_claude')
+def test_stream_reply_tasks_end_when_client_disconnects(mock_stream):
+    """Test reply tasks blocked on a full event buffer finish once the stream is closed."""
+    from src.app_b import app as app_b_module
+
+    async def endless(prompt):
+        while True:
+            yield "chunk"
+
+    mock_stream.side_effect = endless
+
+    async def run():
+        events = app_b_module.stream_reply_events({}, [{"current_task": "A"}, {"current_task": "B"}])
+        await events.__anext__()
+        await asyncio.sleep(0.01)  # Let the replies fill the buffer
+        before = asyncio.all_tasks()
+        await events.aclose()
+        await asyncio.sleep(0.01)
+        return [task for task in before if not task.done() and task is not asyncio.current_task()]
+
+    assert asyncio.run(run()) == []
+
+def test_prompt_builder_extends_cached_turns_and_keeps_role():
+    """Test a growing thread extends its cached render and a cut turn keeps its role."""
+    builder = PromptBuilder()
+    turns = [{"role": "user", "content": f"turn {n}"} for n in range(3)]
+    builder.build({"conversation_id": "t2", "conversation": turns[:2]})
+    rendered = builder._conversations["t2"]
+    builder.build({"conversation_id": "t2", "conversation": turns})
+    assert builder._conversations["t2"] is rendered and len(rendered.lines) == 3
+    earlier = builder.build({"conversation_id": "t2", "conversation": turns[:1]})
+    assert earlier.text == "Conversation:\nuser: turn 0\n" and len(rendered.lines) == 3
+
+    long_turn = [{"role": "assistant", "content": "x" * 1000 + " the end"}]
+    built = PromptBuilder(max_tokens=20).build({"conversation": long_turn})
+    assert "\nassistant: x" in built.text and built.text.rstrip().endswith("the end")
+    assert built.tokens <= 20
+
+def test_prompt_builder_keeps_threads_with_shared_ends_apart():
+    """Test threads sharing their first and last turns never reuse each other's middle turns."""
+    builder = PromptBuilder()
+
+    def thread(middle):
+        return [
+            {"role": "user", "content": "hi"},
+            {"role": "assistant", "content": middle},
+            {"role": "user", "content": "thanks"}
+        ]
+
+    builder.build({"conversation": thread("Your refund for order 1 is approved, Alice")})
+    built = builder.build({"conversation": thread("We cannot ship to Bob")})
+    assert "assistant: We cannot ship to Bob" in built.text and "Alice" not in built.text
+    earlier = builder.build({"conversation": thread("Something else")[:1] + thread("Other")[2:]})
+    assert earlier.text == "Conversation:\nuser: hi\nuser: thanks\n"
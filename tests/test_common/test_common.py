@@ -0,0 +1,382 @@
+import asyncio
+import time
+import httpx
+import pytest
+from unittest.mock import patch
+from src.common.batching import BufferedSender
+from src.common.codec import decode_body, dumps, loads, pack, splice_messages
+from src.common import http_client
+from src.common.http_client import close_clients, get_client, long_poll_timeout, post_with_backoff
+from src.common.llm_cache import LLMCache, cache_key
+from src.common import llm_providers
+from src.common.llm_providers import CachedLLM, OpenAIProvider, StubLLM, StubProvider, create_provider
+from src.common.mcp_package import MCPPackage, PackageError, validate_package
+from src.common.metrics import MetricsRegistry, timed
+from src.common.rate_limit import TokenBucket
+from src.common.resilience import CircuitBreaker, hedge
+from src.common.sse import encode_comment, encode_event, iter_events
+
+def test_sse_round_trip():
+    """Test encoded SSE frames decode back to their payloads."""
+    frames = (
+        encode_event({"summary": "one"}, event="context")
+        + encode_comment("keepalive")
+        + encode_event({"summary": "two", "memory": ["a\nb"]})
+    )
+    events = list(iter_events(frames.decode().splitlines()))
+    assert events == [{"summary": "one"}, {"summary": "two", "memory": ["a\nb"]}]
+
+def test_buffered_sender_coalesces_and_scatters():
+    """Test items sent together share one batch and get their own results."""
+    batches = []
+
+    async def send_batch(items):
+        batches.append(items)
+        return [{"error": "bad"} if item.get("bad") else {"status": "success"} for item in items]
+
+    async def run():
+        sender = BufferedSender(send_batch, max_batch=10, max_delay=0.01)
+        return await asyncio.gather(
+            sender.send({"n": 0}),
+            sender.send({"n": 1, "bad": True}),
+            sender.send({"n": 2}),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert len(batches) == 1
+    assert results[0] == {"status": "success"}
+    assert isinstance(results[1], Exception)
+    assert results[2] == {"status": "success"}
+
+def test_buffered_sender_flushes_when_full():
+    """Test a full buffer is sent without waiting for the delay."""
+    batches = []
+
+    async def send_batch(items):
+        batches.append(len(items))
+        return [{"status": "success"} for _ in items]
+
+    async def run():
+        sender = BufferedSender(send_batch, max_batch=2, max_delay=60)
+        await asyncio.gather(*(sender.send({"n": n}) for n in range(4)))
+
+    asyncio.run(asyncio.wait_for(run(), timeout=5))
+    assert batches == [2, 2]
+
+def test_buffered_sender_bounds_batch_weight():
+    """Test batches are cut before their items' total weight passes max_weight."""
+    batches = []
+
+    async def send_batch(items):
+        batches.append([item["text"] for item in items])
+        return [{"status": "success"} for _ in items]
+
+    async def run():
+        sender = BufferedSender(
+            send_batch, max_batch=10, max_delay=0.01, max_weight=6, weigh=lambda item: len(item["text"])
+        )
+        await asyncio.gather(*(sender.send({"text": text}) for text in ("abc", "de", "fgh", "ijklmnop")))
+
+    asyncio.run(asyncio.wait_for(run(), timeout=5))
+    assert batches == [["abc", "de"], ["fgh"], ["ijklmnop"]]
+
+def test_http_client_pooled_per_host():
+    """Test one shared client is kept per upstream host."""
+    async def run():
+        first = get_client("http://localhost:9002/receive_context/AppB")
+        again = get_client("http://localhost:9002/ack/AppB")
+        other = get_client("https://api.openai.com/v1/chat/completions")
+        assert first is again
+        assert first is not other
+        await close_clients()
+        assert get_client("http://localhost:9002/") is not first
+        await close_clients()
+
+    asyncio.run(run())
+
+def test_post_with_backoff_retries_refused_sends():
+    """Test a 429 is retried after its Retry-After and the final response returned."""
+    statuses = [429, 503, 200]
+    seen = []
+
+    def handler(request):
+        seen.append(request.url.host)
+        return httpx.Response(statuses.pop(0), headers={"Retry-After": "0"}, json={})
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with patch.object(http_client, "get_client", return_value=client):
+            return await post_with_backoff("http://mcp.test/receive_context/AppA", json={})
+
+    assert asyncio.run(run()).status_code == 200
+    assert len(seen) == 3
+
+def test_stub_provider_is_deterministic():
+    """Test the stub echoes prompts, streams in chunks and injects failures repeatably."""
+    async def run(provider):
+        text = await provider.complete("Hello there")
+        chunks = [chunk async for chunk in provider.stream("Hello there")]
+        return text, chunks
+
+    text, chunks = asyncio.run(run(StubProvider(stub=StubLLM(latency_ms=0))))
+    assert text == "Fake completion for: Hello there" == "".join(chunks)
+    assert len(chunks) == 5
+
+    first, second = StubLLM(failure_rate=0.5, seed=7), StubLLM(failure_rate=0.5, seed=7)
+    assert [first.should_fail() for _ in range(20)] == [second.should_fail() for _ in range(20)]
+    assert StubLLM(tokens_per_second=10).generation_delay("a" * 80) == 2.1
+    with pytest.raises(ValueError):
+        create_provider("unknown")
+
+def test_provider_retries_then_breaker_fails_fast():
+    """Test 5xx answers are retried and repeated failures open the circuit breaker."""
+    statuses = [503, 200, 500, 500, 500]
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        status = statuses.pop(0)
+        return httpx.Response(status, headers={"Retry-After": "0"}, json={
+            "choices": [{"message": {"content": "Summary"}}]
+        })
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        provider = OpenAIProvider("http://llm.test/v1/chat/completions", "key", "gpt")
+        provider.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        with patch.object(llm_providers, "get_client", return_value=client):
+            assert await provider.complete("prompt") == "Summary"
+            with pytest.raises(llm_providers.CircuitOpenError):
+                await provider.complete("prompt")  # Two 500s open the breaker before the last retry
+            with pytest.raises(llm_providers.CircuitOpenError):
+                await provider.complete("prompt")
+
+    asyncio.run(run())
+    assert len(seen) == 4
+    assert seen[0].extensions["timeout"]["read"] == llm_providers.LLM_READ_TIMEOUT
+
+def test_circuit_breaker_half_open_trial():
+    """Test an open breaker lets one trial through after the reset timeout."""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert not breaker.allow()  # Only one trial at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+def test_hedge_takes_first_answer():
+    """Test a slow call is hedged after the delay and the faster answer wins."""
+    delays = [1.0, 0.0]
+    cancelled = []
+
+    async def call():
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    async def run():
+        start = time.monotonic()
+        result = await hedge(call, 0.01)
+        return result, time.monotonic() - start
+
+    (result, hedged), elapsed = asyncio.run(run())
+    assert result == 0.0 and hedged
+    assert elapsed < 0.5
+    assert cancelled == [1.0]
+
+def test_long_poll_timeout_covers_wait():
+    """Test the read timeout is stretched past the long-poll wait."""
+    client = httpx.AsyncClient(timeout=httpx.Timeout(5.0))
+    assert long_poll_timeout(client, 0) == client.timeout
+    assert long_poll_timeout(client, 30).read > 30
+
+def test_token_bucket_limits_and_refills():
+    """Test a bucket refuses beyond capacity and reports when to retry."""
+    bucket = TokenBucket(rate=100, capacity=2)
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert 0 < bucket.retry_after() <= 0.01
+
+    async def run():
+        start = time.monotonic()
+        await bucket.acquire(2)
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.015
+
+def test_llm_cache_normalizes_and_evicts():
+    """Test whitespace-only prompt differences hit and the LRU is bounded."""
+    cache = LLMCache(max_entries=2, ttl=60)
+    cache.set(cache_key("model", "Reply  to\nthis "), "cached")
+    assert asyncio.run(cache.get(cache_key("model", "Reply to this"))) == "cached"
+    assert asyncio.run(cache.get(cache_key("other-model", "Reply to this"))) is None
+
+    cache.set(cache_key("model", "b"), "b")
+    cache.set(cache_key("model", "c"), "c")
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+    assert stats["memory_entries"] == 2
+
+def test_llm_cache_disk_tier_and_ttl(tmp_path):
+    """Test completions survive in SQLite and expire after the TTL."""
+    db_path = str(tmp_path / "cache.sqlite")
+    cache = LLMCache(max_entries=4, ttl=60, db_path=db_path)
+    cache.set(cache_key("m", "p"), "saved")
+    cache.flush()
+    fresh = LLMCache(max_entries=4, ttl=60, db_path=db_path)
+    assert asyncio.run(fresh.get(cache_key("m", "p"))) == "saved"
+    fresh.flush()
+    assert fresh.stats()["disk_hits"] == 1
+    assert fresh.stats()["disk_entries"] == 1
+
+    expiring = LLMCache(max_entries=4, ttl=0.01)
+    expiring.set(cache_key("m", "p"), "stale")
+    time.sleep(0.02)
+    assert asyncio.run(expiring.get(cache_key("m", "p"))) is None
+
+def test_llm_cache_collapses_concurrent_misses():
+    """Test identical in-flight prompts share one upstream call."""
+    cache = LLMCache(max_entries=4, ttl=60)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "reply"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_call("m", "same prompt", call) for _ in range(3)))
+
+    assert asyncio.run(run()) == ["reply"] * 3
+    assert len(calls) == 1
+
+def test_llm_cache_cancelled_call_does_not_cancel_waiters():
+    """Test callers sharing a cancelled call retry it instead of being cancelled."""
+    cache = LLMCache(max_entries=4, ttl=60)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "reply"
+
+    async def run():
+        leader = asyncio.create_task(cache.get_or_call("m", "p", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_call("m", "p", call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == "reply"
+    assert len(calls) == 2
+
+def test_metrics_render_prometheus_text():
+    """Test counters and cumulative histogram buckets render in exposition format."""
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests", ("app",)).labels("AppB").inc(2)
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.labels().observe(value)
+
+    text = registry.render()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{app="AppB"} 2' in text
+    assert 'latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{le="1.0"} 3' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+    assert 'latency_seconds_count 4' in text
+
+def test_timed_counts_latency_and_errors():
+    """Test the timed decorator observes every call and counts failures."""
+    registry = MetricsRegistry()
+    seconds = registry.histogram("call_seconds", "Calls", ("op",))
+    errors = registry.counter("call_errors_total", "Errors", ("op",))
+
+    @timed(seconds, errors, "poll")
+    async def call(fail):
+        if fail:
+            raise RuntimeError("boom")
+        return "ok"
+
+    assert asyncio.run(call(False)) == "ok"
+    with pytest.raises(RuntimeError):
+        asyncio.run(call(True))
+    assert seconds.labels("poll").count == 2
+    assert errors.labels("poll").value == 1
+
+def test_codec_splices_encoded_messages():
+    """Test stored payloads spliced into a response decode like a re-encoded one."""
+    contexts = [{"summary": "caf\u00e9"}, {"memory": ["a\nb"], "n": 2}]
+    assert loads(dumps(contexts[0])) == contexts[0]
+    body = splice_messages([dumps(c) for c in contexts], {"has_more": False, "next_cursor": 7})
+    assert loads(body) == {"messages": contexts, "has_more": False, "next_cursor": 7}
+    assert loads(splice_messages([])) == {"messages": []}
+    with pytest.raises(ValueError):
+        loads(b"{not json")
+
+def test_codec_msgpack_round_trip():
+    """Test MessagePack bodies decode by Content-Type and reject garbage."""
+    pytest.importorskip("msgpack")
+    context = {"summary": "packed", "memory": ["x"], "n": 1}
+    assert decode_body(pack(context), "application/msgpack") == context
+    assert decode_body(dumps(context), "application/json") == context
+    with pytest.raises(ValueError):
+        decode_body(b"\xc1", "application/x-msgpack")
+
+def test_mcp_package_round_trip_and_validation():
+    """Test packages convert to the slotted model and back, and bad ones are refused."""
+    data = {
+        "system": "You are a CRM assistant.",
+        "memory": ["Frequent buyer"],
+        "conversation": [{"role": "user", "content": "Hi"}],
+        "current_task": "Reply",
+        "source_app": "AppA",
+        "analysis": {"score": 1}
+    }
+    package = MCPPackage.from_dict(data)
+    assert package.conversation[0].content == "Hi"
+    assert package.extra == {"analysis": {"score": 1}}
+    assert package.to_dict() == data
+    for bad in ([], {"memory": "not a list"}, {"conversation": [{"role": "user"}]}, {"system": 1}):
+        with pytest.raises(PackageError) as error:
+            validate_package(bad)
+        assert error.value.status_code == 400
+    with pytest.raises(PackageError) as error:
+        validate_package({"memory": ["x"] * 100000})
+    assert error.value.status_code == 413
+
+def test_cached_llm_serves_calls_and_streams_from_cache():
+    """Test a completion or stream is produced once and then answered from the cache."""
+    class Provider:
+        model, url = "m", "http://llm"
+        calls = 0
+
+        async def complete(self, prompt):
+            Provider.calls += 1
+            return f"reply to {prompt}"
+
+        async def stream(self, prompt):
+            Provider.calls += 1
+            for part in ("re", "ply"):
+                yield part
+
+    async def run():
+        llm = CachedLLM(Provider(), LLMCache(10, 60))
+        assert await llm.complete("hi") == await llm.complete("hi ") == "reply to hi"
+        first = [part async for part in llm.stream("other")]
+        again = [part async for part in llm.stream("other")]
+        return first, again
+
+    assert asyncio.run(run()) == (["re", "ply"], ["reply"])
+    assert Provider.calls == 2
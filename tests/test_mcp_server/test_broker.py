@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from src.mcp_server.backend import InboxStore, LocalBackend
+from src.mcp_server.broker import BrokerBackend, InboxFull, serve_broker
+
+APPS = ["AppA", "AppB", "AppC"]
+
+async def _with_broker(test, max_depth=100, overflow="drop_oldest"):
+    local = LocalBackend(InboxStore(APPS, max_depth=max_depth, overflow=overflow))
+    server = await serve_broker(local, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    workers = [BrokerBackend("127.0.0.1", port) for _ in range(3)]
+    try:
+        await test(workers)
+    finally:
+        for worker in workers:
+            await worker.close()
+        server.close()
+        await server.wait_closed()
+
+def test_workers_share_ordered_inboxes():
+    """Test contexts put through different workers drain once, in order."""
+    async def test(workers):
+        for n in range(30):
+            await workers[n % 3].put(["AppB"], {"n": n})
+        drained = await asyncio.gather(*(worker.take("AppB") for worker in workers))
+        assert sorted(len(batch) for batch in drained) == [0, 0, 30]
+        assert max(drained, key=len) == [{"n": n} for n in range(30)]
+    asyncio.run(_with_broker(test))
+
+def test_leases_and_acks_across_workers():
+    """Test a page leased via one worker can be acked via another."""
+    async def test(workers):
+        for n in range(3):
+            await workers[0].put(["AppB"], {"n": n})
+        page = await workers[1].pull("AppB", max_messages=2, lease_seconds=30)
+        assert page["messages"] == [{"n": 0}, {"n": 1}]
+        assert await workers[2].ack("AppB", lease_id=page["lease_id"]) == 2
+        assert await workers[0].take("AppB") == [{"n": 2}]
+    asyncio.run(_with_broker(test))
+
+def test_wait_wakes_on_put_from_other_worker():
+    """Test a worker parked on an empty inbox wakes when another worker stores."""
+    async def test(workers):
+        waiting = asyncio.create_task(workers[0].wait("AppB", 5))
+        await asyncio.sleep(0.05)
+        assert workers[0].waiters("AppB") == 1
+        await workers[1].put(["AppB"], {"n": 0})
+        assert await asyncio.wait_for(waiting, 1) is True
+        assert await workers[2].wait("AppC", 0.01) is False
+    asyncio.run(_with_broker(test))
+
+def test_inbox_full_crosses_broker():
+    """Test the reject policy surfaces as InboxFull in the worker."""
+    async def test(workers):
+        await workers[0].put(["AppB"], {"n": 0})
+        with pytest.raises(InboxFull):
+            await workers[1].put(["AppB"], {"n": 1})
+    asyncio.run(_with_broker(test, max_depth=1, overflow="reject"))
+
+def test_raw_payloads_cross_broker():
+    """Test pre-encoded payloads are stored and drained as bytes via the broker."""
+    async def test(workers):
+        await workers[0].put(["AppB"], None, payload=b'{"n":0}')
+        await workers[1].put(["AppB"], {"n": 1})
+        page = await workers[2].pull("AppB", max_messages=1, raw=True)
+        assert page["messages"] == [b'{"n":0}']
+        assert await workers[0].take("AppB", raw=True) == [b'{"n":1}']
+    asyncio.run(_with_broker(test))
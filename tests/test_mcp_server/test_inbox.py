@@ -0,0 +1,119 @@
+import time
+import pytest
+from src.mcp_server.inbox import InboxFull, InboxStore
+
+APPS = ["AppA", "AppB", "AppC"]
+
+def test_broadcast_is_stored_once():
+    """Test fan-out to several inboxes keeps a single stored copy."""
+    store = InboxStore(APPS, max_depth=10)
+    store.put(["AppA", "AppB"], {"summary": "shared"})
+    stats = store.stats()
+    assert stats["stored_messages"] == 1
+    assert stats["apps"]["AppA"]["depth"] == 1
+    assert stats["apps"]["AppB"]["depth"] == 1
+
+    assert store.take("AppA") == [{"summary": "shared"}]
+    assert store.stats()["stored_messages"] == 1  # AppB still holds it
+    assert store.take("AppB") == [{"summary": "shared"}]
+    assert store.stats()["stored_messages"] == 0
+    assert store.stats()["stored_bytes"] == 0
+
+def test_drop_oldest_policy():
+    """Test the oldest context is evicted when an inbox is full."""
+    store = InboxStore(APPS, max_depth=2)
+    for n in range(3):
+        store.put(["AppB"], {"n": n})
+    assert store.take("AppB") == [{"n": 1}, {"n": 2}]
+    assert store.stats()["apps"]["AppB"]["dropped"] == 1
+
+def test_reject_policy_leaves_all_targets_untouched():
+    """Test a rejected broadcast is not queued for any target."""
+    store = InboxStore(APPS, max_depth=1, overflow="reject")
+    store.put(["AppB"], {"n": 0})
+    with pytest.raises(InboxFull):
+        store.put(["AppA", "AppB"], {"n": 1})
+    assert store.depth("AppA") == 0
+    assert store.take("AppB") == [{"n": 0}]
+
+def test_spill_policy_preserves_order(tmp_path):
+    """Test contexts beyond max_depth spill to disk and drain in order."""
+    store = InboxStore(APPS, max_depth=2, overflow="spill", spill_dir=str(tmp_path))
+    for n in range(5):
+        store.put(["AppB", "AppC"], {"n": n})
+    assert store.stats()["apps"]["AppB"]["spilled"] == 3
+    assert store.depth("AppB") == 5
+
+    assert store.take("AppB", limit=3) == [{"n": 0}, {"n": 1}, {"n": 2}]
+    store.put(["AppB"], {"n": 5})
+    assert store.take("AppB") == [{"n": 3}, {"n": 4}, {"n": 5}]
+    assert [c["n"] for c in store.take("AppC")] == [0, 1, 2, 3, 4]
+    assert list(tmp_path.iterdir()) == []
+
+def test_pull_respects_message_and_byte_limits():
+    """Test pulls are bounded by count and encoded size."""
+    store = InboxStore(APPS, max_depth=10)
+    for n in range(4):
+        store.put(["AppB"], {"body": "x" * 100, "n": n})
+    batch = store.pull("AppB", max_messages=3, max_bytes=250)
+    assert [m["n"] for m in batch["messages"]] == [0, 1]
+    assert batch["has_more"] is True
+    # An oversize first message is still delivered on its own
+    batch = store.pull("AppB", max_bytes=10)
+    assert [m["n"] for m in batch["messages"]] == [2]
+
+def test_leased_messages_redelivered_after_expiry():
+    """Test unacked leased contexts return to the front of the inbox."""
+    store = InboxStore(APPS, max_depth=10)
+    for n in range(3):
+        store.put(["AppB"], {"n": n})
+    batch = store.pull("AppB", max_messages=2, lease_seconds=0.01)
+    assert store.depth("AppB") == 1
+    assert store.leased("AppB") == 2
+
+    time.sleep(0.02)
+    assert [m["n"] for m in store.take("AppB")] == [0, 1, 2]
+    assert store.stats()["apps"]["AppB"]["redelivered"] == 2
+
+def test_acked_messages_are_not_redelivered():
+    """Test acking by lease and by message id frees the contexts."""
+    store = InboxStore(APPS, max_depth=10)
+    for n in range(3):
+        store.put(["AppB"], {"n": n})
+    first = store.pull("AppB", max_messages=2, lease_seconds=60)
+    second = store.pull("AppB", lease_seconds=60)
+    assert store.ack("AppB", lease_id=first["lease_id"]) == 2
+    assert store.ack("AppB", message_ids=second["message_ids"]) == 1
+    assert store.leased("AppB") == 0
+    assert store.stats()["stored_messages"] == 0
+
+def test_priorities_served_first_and_expired_dropped():
+    """Test urgent contexts jump the queue and expired ones are never delivered."""
+    store = InboxStore(APPS, max_depth=10)
+    store.put(["AppB"], {"n": 0}, priority="low")
+    store.put(["AppB"], {"n": 1})
+    store.put(["AppB"], {"n": 2}, priority="high")
+    store.put(["AppB"], {"n": 3}, priority="high", deadline=time.time() - 1)
+    batch = store.pull("AppB", max_messages=2, lease_seconds=30)
+    assert batch["messages"] == [{"n": 2}, {"n": 1}]
+    store.release("AppB", batch["lease_id"])
+    assert store.take("AppB") == [{"n": 2}, {"n": 1}, {"n": 0}]
+    stats = store.stats()["apps"]["AppB"]
+    assert stats["expired"] == 1
+    assert stats["priorities"]["high"]["delivered"] == 2  # Once leased, once taken
+    assert stats["priorities"]["low"]["depth"] == 0
+
+def test_drop_oldest_sheds_low_priority_first(tmp_path):
+    """Test eviction prefers bulk traffic, and spilled contexts keep their priority."""
+    store = InboxStore(APPS, max_depth=2)
+    store.put(["AppB"], {"n": 0}, priority="high")
+    store.put(["AppB"], {"n": 1}, priority="low")
+    store.put(["AppB"], {"n": 2})
+    assert store.take("AppB") == [{"n": 0}, {"n": 2}]
+
+    store = InboxStore(APPS, max_depth=1, overflow="spill", spill_dir=str(tmp_path))
+    store.put(["AppB"], {"n": 0}, priority="low")
+    store.put(["AppB"], {"n": 1}, priority="high", deadline=time.time() + 60)
+    store.put(["AppB"], {"n": 2}, priority="low", deadline=time.time() - 1)
+    assert store.take("AppB") == [{"n": 0}, {"n": 1}]
+    assert store.stats()["apps"]["AppB"]["expired"] == 1
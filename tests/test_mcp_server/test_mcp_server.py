@@ -1,5 +1,11 @@
+import asyncio
+import threading
+import time
 import pytest
+from fastapi import Response
 from fastapi.testclient import TestClient
+from unittest.mock import patch
+from src.common.sse import iter_events
 
 def test_receive_context_success(mcp_client):
     """Test successful context reception from an app."""
@@ -83,4 +89,293 @@ def test_context_flow(mcp_client):
     assert len(messages) > 0
     assert messages[0]["summary"] == context_a["summary"]
     assert messages[0]["sentiment"] == context_a["sentiment"]
-    assert messages[0]["urgency"] == context_a["urgency"]
\ No newline at end of file
+    assert messages[0]["urgency"] == context_a["urgency"]
+
+def test_long_poll_times_out_empty(mcp_client):
+    """Test long-poll retrieval returns an empty list once the wait expires."""
+    mcp_client.post("/receive_context/AppC")  # Drain anything left over
+    start = time.monotonic()
+    response = mcp_client.post("/receive_context/AppC?wait=0.2")
+    assert response.status_code == 200
+    assert response.json()["messages"] == []
+    assert time.monotonic() - start >= 0.2
+
+def test_long_poll_wakes_on_new_context(mcp_client):
+    """Test a parked long-poll returns as soon as a context is routed."""
+    with mcp_client:
+        mcp_client.post("/receive_context/AppB")  # Drain anything left over
+        result = {}
+
+        def long_poll():
+            result["response"] = mcp_client.post("/receive_context/AppB?wait=5")
+
+        poller = threading.Thread(target=long_poll)
+        start = time.monotonic()
+        poller.start()
+        time.sleep(0.1)
+        mcp_client.post("/receive_context/AppA", json={"summary": "Wake up"})
+        poller.join(timeout=5)
+
+        assert time.monotonic() - start < 2
+        messages = result["response"].json()["messages"]
+        assert [m["summary"] for m in messages] == ["Wake up"]
+
+def test_subscribe_streams_routed_contexts(mcp_client):
+    """Test a subscriber receives routed contexts as SSE events."""
+    mcp_client.post("/receive_context/AppB")  # Drain anything left over
+    mcp_client.post("/receive_context/AppA", json={"summary": "First"})
+    mcp_client.post("/receive_context/AppA", json={"summary": "Second"})
+
+    response = mcp_client.get("/subscribe/AppB?max_events=1")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = list(iter_events(response.text.splitlines()))
+    assert [e["summary"] for e in events] == ["First"]
+
+    # Contexts the stream did not deliver stay queued
+    remaining = mcp_client.post("/receive_context/AppB").json()["messages"]
+    assert [m["summary"] for m in remaining] == ["Second"]
+
+def test_subscribe_drops_stalled_consumer(mcp_client):
+    """Test a send that never completes disconnects the subscriber and releases its contexts."""
+    from mcp_server import router as mcp_router
+
+    mcp_client.post("/receive_context/AppB")  # Drain anything left over
+    mcp_client.post("/receive_context/AppA", json={"summary": "Stuck"})
+
+    async def stalled_send(message):
+        if message["type"] == "http.response.body":
+            await asyncio.sleep(60)
+
+    async def run():
+        stream = mcp_router._SubscriberStream("AppB", mcp_router._event_stream("AppB", None))
+        assert mcp_router.subscribers["AppB"] == 1
+        await stream.stream_response(stalled_send)
+
+    with patch.object(mcp_router, "MCP_SUBSCRIBER_SEND_TIMEOUT", 0.05):
+        asyncio.run(asyncio.wait_for(run(), 5))
+    mcp_router.subscribers["AppB"] = 0
+    remaining = mcp_client.post("/receive_context/AppB").json()["messages"]
+    assert [m["summary"] for m in remaining] == ["Stuck"]
+
+def test_subscribe_counts_streams_before_they_start(mcp_client):
+    """Test the subscriber cap holds for subscriptions opened at the same time."""
+    from mcp_server import router as mcp_router
+
+    async def run():
+        first = await mcp_router.subscribe("AppB", Response())
+        refused = Response()
+        second = await mcp_router.subscribe("AppB", refused)
+        await first.body_iterator.aclose()
+        return second, refused.status_code
+
+    with patch.object(mcp_router, "MCP_MAX_SUBSCRIBERS_PER_APP", 1):
+        second, status = asyncio.run(run())
+    mcp_router.subscribers["AppB"] = 0
+    assert status == 429 and "error" in second
+
+def test_subscribe_invalid_app(mcp_client):
+    """Test subscribing with an invalid app ID."""
+    response = mcp_client.get("/subscribe/InvalidApp")
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+def test_inbox_stats(mcp_client):
+    """Test inbox depth and memory accounting are reported."""
+    mcp_client.post("/receive_context/AppB")  # Drain anything left over
+    mcp_client.post("/receive_context/AppA", json={"summary": "Counted"})
+    response = mcp_client.get("/inbox/stats")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["apps"]["AppB"]["depth"] == 1
+    assert data["stored_bytes"] > 0
+
+def test_metrics(mcp_client):
+    """Test inbox traffic and depth are exported in Prometheus format."""
+    mcp_client.post("/receive_context/AppB")  # Drain anything left over
+    mcp_client.post("/receive_context/AppA", json={"summary": "Measured"})
+    response = mcp_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'mcp_inbox_depth{app="AppB"} 1' in response.text
+    assert 'mcp_enqueued_total{app="AppB"}' in response.text
+    assert 'mcp_request_parse_seconds_count{endpoint="receive_context"}' in response.text
+
+def test_leased_pagination_with_cursor(mcp_client):
+    """Test bounded leased pulls page through a backlog and ack via cursor."""
+    mcp_client.post("/receive_context/AppB")  # Drain anything left over
+    for n in range(5):
+        mcp_client.post("/receive_context/AppA", json={"n": n})
+
+    seen, cursor = [], None
+    while True:
+        params = {"max_messages": 2, "lease": 30}
+        if cursor is not None:
+            params["cursor"] = cursor
+        data = mcp_client.post("/receive_context/AppB", params=params).json()
+        seen.extend(m["n"] for m in data["messages"])
+        cursor = data["next_cursor"]
+        if not data["has_more"]:
+            break
+    assert seen == [0, 1, 2, 3, 4]
+
+    response = mcp_client.post("/ack/AppB", json={"cursor": cursor})
+    assert response.json() == {"status": "success", "acked": 1}
+    stats = mcp_client.get("/inbox/stats").json()["apps"]["AppB"]
+    assert stats["depth"] == 0
+    assert stats["leased"] == 0
+
+def test_released_lease_is_redelivered(mcp_client):
+    """Test releasing a lease puts its contexts back for the next pull."""
+    mcp_client.post("/receive_context/AppB")  # Drain anything left over
+    mcp_client.post("/receive_context/AppA", json={"summary": "Retry me"})
+    data = mcp_client.post("/receive_context/AppB?lease=30").json()
+    assert mcp_client.post("/receive_context/AppB").json()["messages"] == []
+
+    mcp_client.post("/ack/AppB", json={"cursor": data["next_cursor"], "release": True})
+    messages = mcp_client.post("/receive_context/AppB").json()["messages"]
+    assert [m["summary"] for m in messages] == ["Retry me"]
+
+def test_receive_context_batch(mcp_client):
+    """Test a batch is routed item by item with per-item status."""
+    mcp_client.post("/receive_context/AppB")  # Drain anything left over
+    response = mcp_client.post(
+        "/receive_context/AppA/batch",
+        json=[{"n": 0}, {}, {"n": 1, "target_app": "Nowhere"}, {"n": 2}]
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "partial"
+    assert data["accepted"] == 2
+    assert [r["status_code"] for r in data["results"]] == [200, 400, 400, 200]
+
+    messages = mcp_client.post("/receive_context/AppB").json()["messages"]
+    assert [m["n"] for m in messages] == [0, 2]
+
+def test_receive_context_batch_ndjson(mcp_client):
+    """Test NDJSON batches are accepted and invalid lines reported."""
+    mcp_client.post("/receive_context/AppB")  # Drain anything left over
+    body = b'{"n": 0}\nnot json\n{"n": 1}\n'
+    response = mcp_client.post(
+        "/receive_context/AppA/batch",
+        content=body,
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+    data = response.json()
+    assert [r["status_code"] for r in data["results"]] == [200, 400, 200]
+    messages = mcp_client.post("/receive_context/AppB").json()["messages"]
+    assert [m["n"] for m in messages] == [0, 1]
+
+def test_receive_context_batch_requires_array(mcp_client):
+    """Test a non-array JSON batch is rejected."""
+    response = mcp_client.post("/receive_context/AppA/batch", json={"n": 0})
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+def test_receive_context_stores_body_verbatim(mcp_client):
+    """Test a JSON body is stored as sent and spliced back out on retrieval."""
+    body = b'{"summary": "as sent",  "memory": []}'
+    mcp_client.post("/receive_context/AppA", content=body, headers={"Content-Type": "application/json"})
+    response = mcp_client.post("/receive_context/AppB")
+    assert response.headers["content-type"] == "application/json"
+    assert response.content == b'{"messages":[' + body + b"]}"
+
+def test_msgpack_ingest_and_retrieval(mcp_client):
+    """Test MessagePack contexts in, and MessagePack pages out when accepted."""
+    msgpack = pytest.importorskip("msgpack")
+    packed = {"Content-Type": "application/msgpack"}
+    mcp_client.post("/receive_context/AppA", content=msgpack.packb({"n": 0}), headers=packed)
+    response = mcp_client.post(
+        "/receive_context/AppA/batch", content=msgpack.packb([{"n": 1}, {"n": 2}]), headers=packed
+    )
+    assert response.json()["accepted"] == 2
+    response = mcp_client.post(
+        "/receive_context/AppB", params={"max_messages": 2},
+        headers={"Accept": "application/msgpack"}
+    )
+    assert response.headers["content-type"] == "application/msgpack"
+    page = msgpack.unpackb(response.content)
+    assert page["messages"] == [{"n": 0}, {"n": 1}]
+    assert page["has_more"] is True
+    assert mcp_client.post("/receive_context/AppB").json()["messages"] == [{"n": 2}]
+
+def test_malformed_and_oversize_packages_rejected(mcp_client):
+    """Test schema and size limits are enforced at ingest, per batch item too."""
+    response = mcp_client.post("/receive_context/AppA", json={"conversation": "hello"})
+    assert response.status_code == 400
+    response = mcp_client.post("/receive_context/AppA", json={"system": "x" * 300000})
+    assert response.status_code == 413
+    response = mcp_client.post(
+        "/receive_context/AppA/batch", json=[{"memory": [1]}, {"current_task": "ok"}]
+    )
+    assert [r["status_code"] for r in response.json()["results"]] == [400, 200]
+    assert mcp_client.post("/receive_context/AppB").json()["messages"] == [{"current_task": "ok"}]
+
+def test_delta_packages_materialize_on_retrieval(mcp_client):
+    """Test delta packages are stored small and expanded when asked to."""
+    full = {"conversation_id": "thread-1", "system": "S", "conversation": [{"role": "user", "content": "a"}]}
+    delta = {"conversation_id": "thread-1", "delta": True, "conversation": [{"role": "user", "content": "b"}]}
+    assert mcp_client.post("/receive_context/AppA", json=full).status_code == 200
+    assert mcp_client.post("/receive_context/AppA", json=delta).status_code == 200
+    unknown = {**delta, "conversation_id": "thread-2"}
+    assert mcp_client.post("/receive_context/AppA", json=unknown).status_code == 409
+
+    messages = mcp_client.post("/receive_context/AppB", params={"materialize": "true"}).json()["messages"]
+    assert messages[0] == full
+    assert messages[1]["conversation"] == full["conversation"] + delta["conversation"]
+    assert "delta" not in messages[1]
+
+    state = mcp_client.get("/sessions/thread-1", params={"since": 1}).json()
+    assert state["delta"] is True and state["conversation"] == delta["conversation"]
+    assert mcp_client.get("/sessions/thread-2").status_code == 404
+
+def test_priority_and_deadline_fields(mcp_client):
+    """Test contexts are delivered by priority and invalid fields are refused."""
+    mcp_client.post("/receive_context/AppA", json={"n": 0, "priority": "low"})
+    mcp_client.post("/receive_context/AppA", json={"n": 1, "priority": "high"})
+    mcp_client.post("/receive_context/AppA", json={"n": 2, "deadline": 1})
+    assert mcp_client.post("/receive_context/AppA", json={"priority": "urgent"}).status_code == 400
+    messages = mcp_client.post("/receive_context/AppB").json()["messages"]
+    assert [m["n"] for m in messages] == [1, 0]
+    assert 'mcp_inbox_priority_depth{app="AppB",priority="high"}' in mcp_client.get("/metrics").text
+
+def test_topic_subscriptions(mcp_client):
+    """Test apps registered at runtime receive contexts on topics they subscribe to."""
+    registered = mcp_client.post("/apps/AppD", json={"subscriptions": ["alerts.*"]})
+    assert registered.status_code == 201
+    assert registered.json()["subscriptions"] == ["alerts.*"]
+    assert mcp_client.post("/subscriptions/AppB", json={"pattern": "alerts.#"}).json()["added"] is True
+
+    assert mcp_client.post("/receive_context/AppA", json={"topic": "alerts.disk", "n": 1}).status_code == 200
+    assert mcp_client.post("/receive_context/AppA", json={"topic": "alerts.disk.full", "n": 2}).status_code == 200
+    assert mcp_client.post("/receive_context/AppA", json={"topic": "nobody.listens"}).status_code == 404
+    assert mcp_client.post("/receive_context/AppA", json={"topic": "alerts.*"}).status_code == 400
+    assert [m["n"] for m in mcp_client.post("/receive_context/AppD").json()["messages"]] == [1]
+    assert [m["n"] for m in mcp_client.post("/receive_context/AppB").json()["messages"]] == [1, 2]
+
+    assert mcp_client.delete("/subscriptions/AppB", params={"pattern": "alerts.#"}).status_code == 200
+    assert mcp_client.get("/subscriptions").json()["AppB"] == ["from.AppA", "from.AppC"]
+    assert mcp_client.post("/apps/bad app").status_code == 400
+
+def test_admission_control(mcp_client, monkeypatch):
+    """Test senders over their rate or into a backed-up inbox get 429 with Retry-After."""
+    from common.rate_limit import TokenBucket
+    from mcp_server import router as mcp_router
+
+    monkeypatch.setitem(mcp_router.ingest_buckets, "AppC", TokenBucket(rate=0.5, capacity=1))
+    assert mcp_client.post("/receive_context/AppC", json={"n": 1}).status_code == 200
+    refused = mcp_client.post("/receive_context/AppC", json={"n": 2})
+    assert refused.status_code == 429
+    assert refused.headers["Retry-After"] == "2"
+
+    monkeypatch.setattr(mcp_router, "MCP_INGEST_BACKPRESSURE_DEPTH", 1)
+    refused = mcp_client.post("/receive_context/AppA", json={"n": 3})
+    assert refused.status_code == 429 and "Retry-After" in refused.headers
+    batch = mcp_client.post("/receive_context/AppA/batch", json=[{"n": 4}])
+    assert batch.status_code == 429
+
+    mcp_client.post("/receive_context/AppA")
+    mcp_client.post("/receive_context/AppB")
+    assert mcp_client.post("/receive_context/AppA", json={"n": 5}).status_code == 200
+    assert mcp_client.post("/receive_context/AppB").json()["messages"] == [{"n": 5}]
+    assert 'mcp_ingest_refused_total{app="AppC",reason="rate"}' in mcp_client.get("/metrics").text
@@ -0,0 +1,33 @@
+import pytest
+from src.mcp_server.routing import RoutingTable, check_topic
+
+def test_resolve_exact_and_wildcard_patterns():
+    """Test exact topics, "*" (one word) and "#" (any words) subscriptions."""
+    table = RoutingTable(["A", "B", "C"], {"A": ["mail.new"], "B": ["mail.*"], "C": ["mail.#"]})
+    assert table.resolve("mail.new") == ["A", "B", "C"]
+    assert table.resolve("mail.new.urgent") == ["C"]
+    assert table.resolve("mail") == ["C"]
+    assert table.resolve("chat.new") == []
+
+def test_subscriptions_change_at_runtime():
+    """Test new apps and subscriptions take effect, including on cached topics."""
+    table = RoutingTable(["A"], {"A": ["#.urgent"]})
+    assert table.resolve("mail.urgent") == ["A"]
+    assert table.add_app("D") is True and table.add_app("D") is False
+    table.subscribe("D", "mail.urgent")
+    assert table.resolve("mail.urgent") == ["A", "D"]
+    assert table.unsubscribe("A", "#.urgent") is True
+    assert table.unsubscribe("A", "#.urgent") is False
+    assert table.resolve("mail.urgent") == ["D"]
+    assert table.subscriptions() == {"A": [], "D": ["mail.urgent"]}
+
+def test_invalid_names_rejected():
+    """Test malformed app ids, patterns and published topics raise ValueError."""
+    table = RoutingTable()
+    with pytest.raises(ValueError):
+        table.add_app("no spaces")
+    table.add_app("A")
+    with pytest.raises(ValueError):
+        table.subscribe("A", "mail..new")
+    with pytest.raises(ValueError):
+        check_topic("mail.*")
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from src.common.mcp_package import ConversationDeltas, UnknownConversation, delta_package
+from src.mcp_server.sessions import SessionStore
+
+def _store(**kwargs):
+    options = {"max_sessions": 10, "ttl": 60, "max_memory_items": 10, "max_turns": 10}
+    options.update(kwargs)
+    return SessionStore(**options)
+
+def _turn(n):
+    return {"role": "user", "content": f"turn {n}"}
+
+def test_deltas_materialize_as_of_their_version():
+    """Test each delta expands to the context as it stood when it was sent."""
+    store = _store()
+    assert store.apply({"conversation_id": "c", "system": "S", "memory": ["m"], "conversation": [_turn(0)]}) == 1
+    first = {"conversation_id": "c", "delta": True, "conversation": [_turn(1)], "n": 1}
+    first["session_version"] = store.apply(first)
+    second = {"conversation_id": "c", "delta": True, "memory": ["m2"], "conversation": [_turn(2)]}
+    second["session_version"] = store.apply(second)
+
+    expanded = store.materialize(first)
+    assert expanded["conversation"] == [_turn(0), _turn(1)]
+    assert expanded["memory"] == ["m"] and expanded["system"] == "S" and expanded["n"] == 1
+    assert "delta" not in expanded
+    assert store.materialize(second)["conversation"] == [_turn(0), _turn(1), _turn(2)]
+    assert store.get("c", since=2) == {
+        "conversation_id": "c", "version": 3, "system": "S", "current_task": "",
+        "delta": True, "memory": ["m2"], "conversation": [_turn(2)]
+    }
+    assert store.get("c", since=99)["conversation"] == [_turn(0), _turn(1), _turn(2)]
+
+def test_unknown_expired_and_trimmed_sessions():
+    """Test deltas need a live session and sessions stay within their bounds."""
+    store = _store(ttl=0.05, max_turns=3)
+    assert store.apply({"conversation_id": "c", "delta": True, "conversation": [_turn(0)]}) is None
+    store.apply({"conversation_id": "c", "conversation": [_turn(0)]})
+    for n in range(1, 5):
+        store.apply({"conversation_id": "c", "delta": True, "conversation": [_turn(n)]})
+    assert store.get("c")["conversation"] == [_turn(2), _turn(3), _turn(4)]
+    time.sleep(0.06)
+    assert store.get("c") is None
+
+def test_delta_package_sends_only_appended_parts():
+    """Test senders diff a package against the last one sent for the conversation."""
+    previous = {"conversation_id": "c", "system": "S", "memory": ["m"], "conversation": [_turn(0)]}
+    package = {**previous, "conversation": [_turn(0), _turn(1)], "target_app": "AppB"}
+    assert delta_package(previous, package) == {
+        "conversation_id": "c", "delta": True, "conversation": [_turn(1)], "target_app": "AppB"
+    }
+    rewritten = {**previous, "conversation": [_turn(9)]}
+    assert delta_package(previous, rewritten) is rewritten
+    assert delta_package(None, package) is package
+
+def test_concurrent_sends_on_one_conversation_keep_every_turn():
+    """Test sends racing on one conversation reach the server in order, each extending the last."""
+    store = _store()
+    deltas = ConversationDeltas(max_conversations=10)
+    received = []
+
+    async def send(package):
+        if package["conversation"][-1] == _turn(0):
+            await asyncio.sleep(0.05)  # Unserialized, the later sends would overtake this one
+        received.append(package)
+        if store.apply(package) is None:
+            raise UnknownConversation("unknown conversation")
+        return {"status": "success"}
+
+    async def run():
+        await asyncio.gather(*(
+            deltas.send({"conversation_id": "c", "conversation": [_turn(n)]}, send, append=True)
+            for n in range(3)
+        ))
+
+    asyncio.run(run())
+    assert store.get("c")["conversation"] == [_turn(0), _turn(1), _turn(2)]
+    assert "delta" not in received[0]
+    assert [package["conversation"] for package in received[1:]] == [[_turn(1)], [_turn(2)]]
+    assert all(package["delta"] for package in received[1:])
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import threading
+import pytest
+from src.mcp_server.inbox import InboxStore
+from src.mcp_server.wal import WriteAheadLog
+
+APPS = ["AppA", "AppB", "AppC"]
+
+def _open(tmp_path, **kwargs):
+    store = InboxStore(APPS, max_depth=100)
+    wal = WriteAheadLog(str(tmp_path), **kwargs)
+    wal.attach(store)
+    return store, wal
+
+@pytest.mark.parametrize("fsync", ["always", "group", "none"])
+def test_recovery_replays_puts_and_removes(tmp_path, fsync):
+    """Test a reopened log rebuilds only the contexts still owed to each app."""
+    store, wal = _open(tmp_path, fsync=fsync, group_commit_ms=1)
+    store.put(["AppA", "AppB"], {"n": 0})
+    store.put(["AppB"], {"n": 1})
+    store.put(["AppC"], {"n": 2})
+    assert store.take("AppA") == [{"n": 0}]
+    page = store.pull("AppB", max_messages=1, lease_seconds=30)
+    store.ack("AppB", lease_id=page["lease_id"])
+    asyncio.run(wal.sync())
+    wal.close()
+
+    recovered, wal = _open(tmp_path)
+    assert recovered.take("AppA") == []
+    assert recovered.take("AppB") == [{"n": 1}]
+    assert recovered.take("AppC") == [{"n": 2}]
+    assert recovered.put(["AppA"], {"n": 3}) == 4  # Ids are not reused
+    wal.close()
+
+def test_unacked_lease_is_redelivered_after_restart(tmp_path):
+    """Test contexts leased but never acked survive a restart."""
+    store, wal = _open(tmp_path)
+    store.put(["AppB"], {"n": 0})
+    store.pull("AppB", max_messages=1, lease_seconds=30)
+    wal.close()
+
+    recovered, wal = _open(tmp_path)
+    assert recovered.take("AppB") == [{"n": 0}]
+    wal.close()
+
+def test_torn_tail_is_ignored(tmp_path):
+    """Test a record cut short by a crash is dropped and earlier ones kept."""
+    store, wal = _open(tmp_path)
+    store.put(["AppB"], {"n": 0})
+    store.put(["AppB"], {"n": 1})
+    wal.close()
+    segment = max(name for name in os.listdir(tmp_path) if name.startswith("wal-"))
+    path = os.path.join(tmp_path, segment)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+
+    recovered, wal = _open(tmp_path)
+    assert recovered.take("AppB") == [{"n": 0}]
+    wal.close()
+
+def test_checkpoint_compacts_segments(tmp_path):
+    """Test checkpoints replace the replayed segments and keep live contexts."""
+    store, wal = _open(tmp_path, checkpoint_records=10, segment_bytes=256)
+    for n in range(25):
+        store.put(["AppB"], {"n": n})
+        store.take("AppB")
+        wal.maybe_checkpoint()
+    store.put(["AppC"], {"n": "kept"})
+    wal.close()
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("checkpoint-")]) == 1
+
+    recovered, wal = _open(tmp_path)
+    assert recovered.take("AppB") == []
+    assert recovered.take("AppC") == [{"n": "kept"}]
+    wal.close()
+
+def test_checkpoint_is_written_in_the_background(tmp_path):
+    """Test maybe_checkpoint returns before the checkpoint file is written."""
+    store, wal = _open(tmp_path, checkpoint_records=5)
+    release = threading.Event()
+    write_checkpoint = wal._write_checkpoint
+
+    def blocked_write(*args):
+        release.wait(5)
+        write_checkpoint(*args)
+
+    wal._write_checkpoint = blocked_write
+    for n in range(5):
+        store.put(["AppB"], {"n": n})
+    wal.maybe_checkpoint()
+    store.put(["AppC"], {"n": "after"})  # Appends go on while it is written
+    wal.maybe_checkpoint()  # One is already running, so this is a no-op
+    release.set()
+    wal.close()
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("checkpoint-")]) == 1
+
+    recovered, wal = _open(tmp_path)
+    assert [m["n"] for m in recovered.take("AppB")] == [0, 1, 2, 3, 4]
+    assert recovered.take("AppC") == [{"n": "after"}]
+    wal.close()
+
+def test_group_commit_shares_fsyncs(tmp_path):
+    """Test concurrent writers waiting on the log share group commits."""
+    store, wal = _open(tmp_path, fsync="group", group_commit_ms=20)
+    baseline = wal.fsyncs
+
+    async def write(n):
+        store.put(["AppB"], {"n": n})
+        await wal.sync()
+
+    async def main():
+        await asyncio.gather(*(write(n) for n in range(50)))
+
+    asyncio.run(main())
+    assert wal.fsyncs - baseline < 10
+    wal.close()